@@ -0,0 +1,158 @@
+"""Replay synthetic Telegram updates into the dispatcher and measure how it copes with load.
+
+The bot runs with TELEGRAM_API_URL and the Drive / Telegraph endpoints pointed
+at the local fake server. For each concurrency level a burst of command updates
+is queued at once, each from its own chat, and the harness waits until the
+bot goes quiet. A command's latency is the time from queueing its update to
+the last Bot API call made to its chat. Peak thread count and memory are
+sampled while the burst runs.
+
+    python -m benchmarks.dispatcher_bench --levels 1 10 50 100 --commands "search alpha" "count {folder}"
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import resource
+import threading
+import time
+
+from benchmarks.drive_bench import percentile, prepare_environment, redirect_endpoints
+from benchmarks.fake_server import add_tree_arguments, start_server
+
+OWNER_ID = 1
+
+def rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # Peak instead of current usage where /proc is not available
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Sampler:
+    """Record the peak thread count and memory of the process until stopped."""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.threads = 0
+        self.rss = 0
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, name="Sampler", daemon=True)
+
+    def __enter__(self):
+        self.__thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.__stop.set()
+        self.__thread.join()
+
+    def __run(self):
+        while not self.__stop.is_set():
+            self.threads = max(self.threads, threading.active_count())
+            self.rss = max(self.rss, rss_bytes())
+            self.__stop.wait(self.interval)
+
+
+def make_update(update_id, chat_id, text):
+    command = text.split(' ', 1)[0]
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': OWNER_ID, 'is_bot': False, 'first_name': 'Bench'},
+            'text': text,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+        }
+    }
+
+def wait_until_quiet(server, chats, settle, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        time.sleep(0.1)
+        activity = server.chat_activity()
+        if all(chat in activity for chat in chats):
+            last = max(activity[chat][1] for chat in chats)
+            if time.time() - last >= settle:
+                return activity
+    return server.chat_activity()
+
+def run_level(server, bot, dispatcher, level, commands, ids, settle, timeout):
+    from telegram import Update
+
+    chats = {}
+    with Sampler() as sampler:
+        for command in itertools.islice(itertools.cycle(commands), level):
+            update_id = next(ids)
+            chat_id = 100000 + update_id
+            chats[chat_id] = time.time()
+            dispatcher.update_queue.put(Update.de_json(make_update(update_id, chat_id, f'/{command}'), bot))
+        activity = wait_until_quiet(server, chats, settle, timeout)
+    finished = [activity[chat][1] - start for chat, start in chats.items() if chat in activity]
+    first = [activity[chat][0] - start for chat, start in chats.items() if chat in activity]
+    return {
+        'updates': level,
+        'answered': len(finished),
+        'p50': round(percentile(finished, 50), 3),
+        'p90': round(percentile(finished, 90), 3),
+        'p99': round(percentile(finished, 99), 3),
+        'first_reply_p50': round(percentile(first, 50), 3),
+        'peak_threads': sampler.threads,
+        'threads_after': threading.active_count(),
+        'peak_rss_mb': round(sampler.rss / (1 << 20), 1)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    add_tree_arguments(parser)
+    parser.add_argument('--levels', nargs='+', type=int, default=[1, 5, 10, 25, 50],
+                        help='updates queued at once, one burst per level')
+    parser.add_argument('--commands', nargs='+', default=['search alpha', 'count {folder}'],
+                        help='commands to replay round robin, {folder} is the first fake drive')
+    parser.add_argument('--settle', type=float, default=2.0,
+                        help='seconds without Bot API calls before a level counts as finished')
+    parser.add_argument('--timeout', type=float, default=300.0, help='longest wait for one level')
+    parser.add_argument('--rate-limit', type=float, default=1000.0, help='DRIVE_RATE_LIMIT used by the bot')
+    parser.add_argument('--search-workers', type=int, default=20, help='SEARCH_WORKERS used by the bot')
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--verbose', action='store_true', help='keep the bot logging at INFO')
+    args = parser.parse_args()
+    if args.json:
+        args.json = os.path.abspath(args.json)
+
+    server, drive_ids = start_server(args)
+    prepare_environment(server, drive_ids, args)
+    os.environ['TELEGRAM_API_URL'] = f'{server.url}/bot'
+    redirect_endpoints(server.url)
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+    from bot import bot, dispatcher
+    from bot.modules import auth, clone, count, delete, list, permission, shell
+
+    commands = [command.format(folder=f'https://drive.google.com/drive/folders/{drive_ids[0]}')
+                for command in args.commands]
+    threading.Thread(target=dispatcher.start, name="Dispatcher", daemon=True).start()
+    ids = itertools.count(1)
+    results = []
+    print(f"{'updates':>8}{'answered':>10}{'p50':>9}{'p90':>9}{'p99':>9}{'first':>9}{'threads':>9}"
+          f"{'after':>7}{'rss MB':>9}")
+    for level in args.levels:
+        result = run_level(server, bot, dispatcher, level, commands, ids, args.settle, args.timeout)
+        results.append(result)
+        print(f"{result['updates']:>8}{result['answered']:>10}{result['p50']:>9}{result['p90']:>9}"
+              f"{result['p99']:>9}{result['first_reply_p50']:>9}{result['peak_threads']:>9}"
+              f"{result['threads_after']:>7}{result['peak_rss_mb']:>9}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+    dispatcher.stop()
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+"""Run drive_list, count and clone end to end against the local fake Drive / Telegraph server.
+
+    python -m benchmarks.drive_bench --drives 2 --depth 3 --fanout 4 --files 20 --latency 0.05 --runs 20
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fake_server import add_tree_arguments, start_server
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ['search', 'count', 'clone']
+
+def prepare_environment(server, drive_ids, args):
+    # Write the files the bot reads at import into a temporary directory and switch to it
+    workdir = tempfile.mkdtemp(prefix='searchx-bench-')
+    with open(os.path.join(workdir, 'token.json'), 'w') as f:
+        json.dump({
+            'token': 'bench',
+            'refresh_token': 'bench',
+            'client_id': 'bench.apps.googleusercontent.com',
+            'client_secret': 'bench',
+            'expiry': '2099-01-01T00:00:00Z'
+        }, f)
+    with open(os.path.join(workdir, 'drive_list'), 'w') as f:
+        for i, drive_id in enumerate(drive_ids):
+            f.write(f"Bench_{i} {drive_id} {server.url}/index/{i}\n")
+    os.environ.update({
+        'BOT_TOKEN': '123456:bench',
+        'OWNER_ID': '1',
+        'DRIVE_FOLDER_ID': 'dest',
+        'IS_TEAM_DRIVE': 'true',
+        'USE_SERVICE_ACCOUNTS': 'false',
+        'DRIVE_RATE_LIMIT': str(args.rate_limit),
+        'SEARCH_WORKERS': str(args.search_workers)
+    })
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_ROOT)
+    return workdir
+
+def redirect_endpoints(base_url):
+    # Point the Drive clients and every Telegraph account at the fake server
+    import telegraph.api
+    from requests.adapters import HTTPAdapter
+    from bot.helper.drive_utils import async_drive, service_factory
+
+    document = service_factory.get_discovery_document()
+    document['rootUrl'] = f'{base_url}/'
+    document['baseUrl'] = f'{base_url}/drive/v3/'
+    async_drive.DRIVE_API_URL = f'{base_url}/drive/v3'
+
+    class RedirectAdapter(HTTPAdapter):
+        def send(self, request, **kwargs):
+            request.url = request.url.replace('https://api.telegra.ph/', f'{base_url}/telegraph/', 1)
+            return super().send(request, **kwargs)
+
+    telegraph_init = telegraph.api.TelegraphApi.__init__
+
+    def init(self, *args, **kwargs):
+        telegraph_init(self, *args, **kwargs)
+        self.session.mount('https://api.telegra.ph/', RedirectAdapter())
+
+    telegraph.api.TelegraphApi.__init__ = init
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))
+    return values[index]
+
+def run_scenario(server, fn, check, runs, concurrency, warmup):
+    for _ in range(warmup):
+        fn()
+    before = server.snapshot()
+    latencies = []
+    errors = 0
+
+    def timed():
+        start = time.perf_counter()
+        try:
+            ok = check(fn())
+        except Exception as e:
+            logging.getLogger(__name__).error(f"Run failed: {e}")
+            ok = False
+        return time.perf_counter() - start, ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for latency, ok in executor.map(lambda _: timed(), range(runs)):
+            latencies.append(latency)
+            errors += 0 if ok else 1
+    elapsed = time.perf_counter() - start
+    after = server.snapshot()
+    calls = {name: after.get(name, 0) - before.get(name, 0) for name in after
+             if after.get(name, 0) != before.get(name, 0)}
+    return {
+        'runs': runs,
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'throughput': round(runs / elapsed, 2) if elapsed else 0.0,
+        'p50': round(percentile(latencies, 50), 3),
+        'p90': round(percentile(latencies, 90), 3),
+        'p99': round(percentile(latencies, 99), 3),
+        'max': round(max(latencies, default=0.0), 3),
+        'threads': threading.active_count(),
+        'calls': dict(sorted(calls.items())),
+        'calls_per_run': round(sum(v for k, v in calls.items() if k != 'throttled') / runs, 1) if runs else 0.0
+    }
+
+def print_report(tree, results):
+    print(f"\nTree: {tree}")
+    print(f"{'scenario':<10}{'runs':>6}{'errors':>8}{'ops/s':>9}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}"
+          f"{'threads':>9}{'calls/run':>11}")
+    for name, result in results.items():
+        print(f"{name:<10}{result['runs']:>6}{result['errors']:>8}{result['throughput']:>9}{result['p50']:>9}"
+              f"{result['p90']:>9}{result['p99']:>9}{result['max']:>9}{result['threads']:>9}"
+              f"{result['calls_per_run']:>11}")
+    for name, result in results.items():
+        print(f"{name} calls: {', '.join(f'{k}={v}' for k, v in result['calls'].items())}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    add_tree_arguments(parser)
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--runs', type=int, default=10, help='measured runs per scenario')
+    parser.add_argument('--warmup', type=int, default=1, help='unmeasured runs per scenario')
+    parser.add_argument('--concurrency', type=int, default=1, help='runs in flight at once')
+    parser.add_argument('--query', default='alpha', help='search query for drive_list')
+    parser.add_argument('--rate-limit', type=float, default=1000.0, help='DRIVE_RATE_LIMIT used by the bot')
+    parser.add_argument('--search-workers', type=int, default=20, help='SEARCH_WORKERS used by the bot')
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--verbose', action='store_true', help='keep the bot logging at INFO')
+    args = parser.parse_args()
+    if args.json:
+        args.json = os.path.abspath(args.json)
+
+    server, drive_ids = start_server(args)
+    prepare_environment(server, drive_ids, args)
+    redirect_endpoints(server.url)
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+    from bot.helper.drive_utils.gdriveTools import GoogleDriveHelper
+    from bot.helper.ext_utils.clone_status import CloneStatus
+
+    drive = server.drive
+    source = drive.children[drive_ids[0]]
+    clone_source = next((fid for fid in source if drive.files[fid]['mimeType'].endswith('folder')), drive_ids[0])
+    scenarios = {
+        'search': (lambda: GoogleDriveHelper(None).drive_list(args.query)[0],
+                   lambda msg: msg.startswith('Found')),
+        'count': (lambda: GoogleDriveHelper().count(f'https://drive.google.com/drive/folders/{drive_ids[0]}'),
+                  lambda msg: 'Files' in msg),
+        'clone': (lambda: GoogleDriveHelper().clone(f'https://drive.google.com/drive/folders/{clone_source}',
+                                                    CloneStatus()),
+                  lambda msg: 'Files' in msg)
+    }
+    tree = drive.stats()
+    results = {}
+    for name in args.scenarios:
+        fn, check = scenarios[name]
+        results[name] = run_scenario(server, fn, check, args.runs, args.concurrency, args.warmup)
+    print_report(tree, results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'tree': tree, 'args': vars(args), 'results': results}, f, indent=2)
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,413 @@
+"""Local stand-in for the Drive v3, Telegraph and Bot API endpoints used by the bot.
+
+    python -m benchmarks.fake_server --drives 2 --depth 3 --fanout 4 --files 20 --port 8765
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import uuid
+
+from collections import Counter
+from email.parser import FeedParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse, unquote
+
+FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+WORDS = ['alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel', 'india', 'juliet',
+         'kilo', 'lima', 'mike', 'november', 'oscar', 'papa']
+EXTENSIONS = ['mkv', 'mp4', 'zip', 'pdf', 'iso']
+PAGE_SIZE = 100
+
+class FakeDrive:
+    # In-memory file store with just enough of Drive's query language for the bot
+
+    def __init__(self):
+        self.files = {}
+        self.children = {}
+        self.changes = []
+        self.__ids = itertools.count()
+        self.__lock = threading.Lock()
+
+    def new_id(self):
+        return f'fake{next(self.__ids):08d}'
+
+    def add(self, name, parent_id, drive_id, mime_type=FOLDER_MIME_TYPE, size=None, file_id=None, md5=None):
+        file = {
+            'id': file_id or self.new_id(),
+            'name': name,
+            'mimeType': mime_type,
+            'parents': [parent_id] if parent_id is not None else [],
+            'modifiedTime': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime()),
+            'trashed': False
+        }
+        if drive_id is not None:
+            file['driveId'] = file['teamDriveId'] = drive_id
+        if mime_type != FOLDER_MIME_TYPE:
+            file['size'] = str(size or 0)
+            file['md5Checksum'] = md5 or hashlib.md5(file['id'].encode()).hexdigest()
+        with self.__lock:
+            self.files[file['id']] = file
+            self.children.setdefault(file['id'], [])
+            if parent_id is not None:
+                self.children.setdefault(parent_id, []).append(file['id'])
+            self.changes.append({'fileId': file['id'], 'removed': False, 'file': file})
+        return file
+
+    def remove(self, file_id):
+        with self.__lock:
+            stack = [file_id]
+            while stack:
+                fid = stack.pop()
+                file = self.files.pop(fid, None)
+                stack.extend(self.children.pop(fid, []))
+                if file is not None:
+                    self.changes.append({'fileId': fid, 'removed': True, 'driveId': file.get('driveId')})
+                for parent in (file or {}).get('parents', []):
+                    if fid in self.children.get(parent, []):
+                        self.children[parent].remove(fid)
+
+    def query(self, q, drive_id=None):
+        q = q or ''
+        parents = re.findall(r"'((?:[^'\\]|\\.)*)' in parents", q)
+        names = [unescape(n).lower() for n in re.findall(r"name contains '((?:[^'\\]|\\.)*)'", q)]
+        mime_eq = re.findall(r"mimeType\s*=\s*'([^']*)'", q)
+        mime_ne = re.findall(r"mimeType\s*!=\s*'([^']*)'", q)
+        with self.__lock:
+            if parents:
+                ids = list(self.children.get(parents[0], []))
+            elif drive_id is not None:
+                ids = [fid for fid, file in self.files.items() if file.get('driveId') == drive_id and fid != drive_id]
+            else:
+                ids = [fid for fid, file in self.files.items() if 'driveId' not in file and fid != 'root']
+            files = [self.files[fid] for fid in ids if fid in self.files]
+        result = []
+        for file in files:
+            if file['trashed']:
+                continue
+            if any(name not in file['name'].lower() for name in names):
+                continue
+            if mime_eq and file['mimeType'] != mime_eq[0]:
+                continue
+            if mime_ne and file['mimeType'] == mime_ne[0]:
+                continue
+            result.append(file)
+        return result
+
+    def list_changes(self, token, drive_id=None):
+        # The changes of drive_id (My Drive when None) after token and the next token
+        with self.__lock:
+            changes = self.changes[token:]
+            token = len(self.changes)
+        return [change for change in changes
+                if change.get('driveId', change.get('file', {}).get('driveId')) == drive_id], token
+
+    def stats(self):
+        folders = sum(1 for file in self.files.values() if file['mimeType'] == FOLDER_MIME_TYPE)
+        return {'files': len(self.files) - folders, 'folders': folders}
+
+
+def unescape(value):
+    return re.sub(r"\\(.)", r"\1", value)
+
+def build_tree(drives=1, depth=3, fanout=3, files=10, seed=0):
+    # Create drives shared drives, each a tree of depth levels of fanout folders holding files files
+    rng = random.Random(seed)
+    drive = FakeDrive()
+    drive.add('My Drive', None, None, file_id='root')
+    drive.add('Clones', 'root', None, file_id='dest')
+    drive_ids = []
+    for d in range(drives):
+        drive_id = f'drive{d:03d}'
+        drive_ids.append(drive_id)
+        drive.add(f'Bench {d}', None, drive_id, file_id=drive_id)
+        level = [drive_id]
+        for current in range(depth + 1):
+            next_level = []
+            for folder_id in level:
+                for _ in range(files):
+                    name = f"{rng.choice(WORDS)} {rng.choice(WORDS)} {rng.randint(1, 999)}.{rng.choice(EXTENSIONS)}"
+                    drive.add(name, folder_id, drive_id, mime_type='application/octet-stream',
+                              size=rng.randint(1 << 20, 1 << 32))
+                if current == depth:
+                    continue
+                for _ in range(fanout):
+                    name = f"{rng.choice(WORDS).title()} {rng.randint(1, 99)}"
+                    next_level.append(drive.add(name, folder_id, drive_id)['id'])
+            level = next_level
+    return drive, drive_ids
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, drive, address=('127.0.0.1', 0), latency=0.0, error_rate=0.0, seed=0):
+        super().__init__(address, FakeHandler)
+        self.drive = drive
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls = Counter()
+        self.pages = itertools.count()
+        self.message_ids = itertools.count(1)
+        self.chats = {}
+        self.__rng = random.Random(seed)
+        self.__lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="FakeServer", daemon=True).start()
+        return self
+
+    def count(self, name):
+        with self.__lock:
+            self.calls[name] += 1
+
+    def snapshot(self):
+        with self.__lock:
+            return dict(self.calls)
+
+    def throttled(self):
+        if self.error_rate <= 0:
+            return False
+        with self.__lock:
+            return self.__rng.random() < self.error_rate
+
+    def drive_call(self, method, path, query, body):
+        # Serve one Drive v3 call and return (status, json)
+        parts = [unquote(part) for part in path.strip('/').split('/')][2:]
+        name = drive_method(method, parts)
+        self.count(name)
+        if self.throttled():
+            self.count('throttled')
+            return 403, {'error': {'code': 403, 'message': 'Rate Limit Exceeded',
+                                   'errors': [{'reason': 'rateLimitExceeded', 'message': 'Rate Limit Exceeded'}]}}
+        drive = self.drive
+        if name == 'files.list':
+            files = drive.query(query.get('q'), query.get('driveId') or query.get('teamDriveId'))
+            start = int(query.get('pageToken') or 0)
+            size = int(query.get('pageSize') or PAGE_SIZE)
+            response = {'files': files[start: start + size]}
+            if start + size < len(files):
+                response['nextPageToken'] = str(start + size)
+            return 200, response
+        if name == 'changes.getStartPageToken':
+            return 200, {'startPageToken': str(len(drive.changes))}
+        if name == 'changes.list':
+            changes, token = drive.list_changes(int(query.get('pageToken') or 0), query.get('driveId'))
+            return 200, {'changes': [{key: value for key, value in change.items() if key != 'driveId'}
+                                     for change in changes], 'newStartPageToken': str(token)}
+        file = drive.files.get(parts[1]) if len(parts) > 1 else None
+        if name == 'files.create':
+            parent = (body.get('parents') or ['root'])[0]
+            parent_file = drive.files.get(parent, {})
+            return 200, drive.add(body.get('name'), parent, parent_file.get('driveId'),
+                                  mime_type=body.get('mimeType', 'application/octet-stream'))
+        if file is None:
+            return 404, {'error': {'code': 404, 'message': f'File not found: {parts[-1]}.',
+                                   'errors': [{'reason': 'notFound', 'message': 'File not found'}]}}
+        if name == 'files.get':
+            return 200, file
+        if name == 'files.copy':
+            parent = (body.get('parents') or ['root'])[0]
+            return 200, drive.add(file['name'], parent, drive.files.get(parent, {}).get('driveId'),
+                                  mime_type=file['mimeType'], size=int(file.get('size', 0)),
+                                  md5=file.get('md5Checksum'))
+        if name == 'files.delete':
+            drive.remove(file['id'])
+            return 204, None
+        if name == 'permissions.create':
+            return 200, {'id': 'anyoneWithLink', 'type': 'anyone', 'role': body.get('role', 'reader')}
+        return 400, {'error': {'code': 400, 'message': f'Unsupported call {method} {path}', 'errors': []}}
+
+    def telegraph_call(self, method, values):
+        self.count(f'telegraph.{method}')
+        if method == 'createAccount':
+            return {'ok': True, 'result': {'short_name': values.get('short_name'),
+                                           'access_token': uuid.uuid4().hex}}
+        if method == 'createPage':
+            path = f"SearchX-{next(self.pages)}"
+            return {'ok': True, 'result': {'path': path, 'url': f'https://telegra.ph/{path}',
+                                           'title': values.get('title')}}
+        if method == 'editPage':
+            return {'ok': True, 'result': {'title': values.get('title')}}
+        return {'ok': False, 'error': f'Unsupported method {method}'}
+
+
+    def bot_api_call(self, method, values):
+        """Answer one Bot API call the way api.telegram.org would, with made up ids."""
+        self.count(f'bot.{method}')
+        if method == 'getMe':
+            return {'id': 123456, 'is_bot': True, 'first_name': 'SearchX', 'username': 'searchx_bench_bot'}
+        chat_id = values.get('chat_id')
+        if chat_id is not None:
+            chat_id = int(chat_id)
+            now = time.time()
+            with self.__lock:
+                activity = self.chats.setdefault(chat_id, [now, now, 0])
+                activity[1] = now
+                activity[2] += 1
+        if method in ('sendMessage', 'editMessageText', 'sendDocument'):
+            message = {
+                'message_id': int(values.get('message_id') or next(self.message_ids)),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'supergroup'},
+                'text': values.get('text', '')
+            }
+            if method == 'sendDocument':
+                message['document'] = {'file_id': uuid.uuid4().hex, 'file_unique_id': uuid.uuid4().hex}
+            return message
+        if method == 'getUpdates':
+            return []
+        return True
+
+    def chat_activity(self):
+        with self.__lock:
+            return {chat_id: tuple(activity) for chat_id, activity in self.chats.items()}
+
+
+def parse_form(content_type, content):
+    """Return the fields of a JSON, urlencoded or multipart request body."""
+    if not content:
+        return {}
+    if content_type.startswith('application/json'):
+        return json.loads(content)
+    if content_type.startswith('multipart/'):
+        parser = FeedParser()
+        parser.feed(f"Content-Type: {content_type}\r\n\r\n")
+        parser.feed(content.decode(errors='replace'))
+        values = {}
+        for part in parser.close().get_payload():
+            name = part.get_param('name', header='content-disposition')
+            if name is not None and part.get_filename() is None:
+                values[name] = part.get_payload()
+        return values
+    return {key: values[-1] for key, values in parse_qs(content.decode()).items()}
+
+def drive_method(method, parts):
+    if parts[:1] == ['changes']:
+        return 'changes.list' if len(parts) == 1 else 'changes.getStartPageToken'
+    if parts[:1] != ['files']:
+        return f'{method} {"/".join(parts)}'
+    if len(parts) == 1:
+        return 'files.list' if method == 'GET' else 'files.create'
+    if len(parts) == 2:
+        return {'GET': 'files.get', 'DELETE': 'files.delete', 'PATCH': 'files.update'}.get(method, 'files.get')
+    return {'copy': 'files.copy', 'permissions': 'permissions.create'}.get(parts[2], parts[2])
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.__handle('GET')
+
+    def do_POST(self):
+        self.__handle('POST')
+
+    def do_DELETE(self):
+        self.__handle('DELETE')
+
+    def do_PATCH(self):
+        self.__handle('PATCH')
+
+    def __handle(self, method):
+        server = self.server
+        length = int(self.headers.get('Content-Length', 0))
+        content = self.rfile.read(length) if length else b''
+        if server.latency > 0:
+            time.sleep(server.latency)
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if url.path.startswith('/bot'):
+            values = parse_form(self.headers.get('Content-Type', ''), content)
+            result = server.bot_api_call(url.path.rstrip('/').split('/')[-1], values)
+            return self.__reply(200, json.dumps({'ok': True, 'result': result}).encode())
+        if url.path.startswith('/telegraph/'):
+            values = {key: values[-1] for key, values in parse_qs(content.decode()).items()}
+            method_name = url.path.split('/')[2]
+            return self.__reply(200, json.dumps(server.telegraph_call(method_name, values)).encode())
+        if url.path.startswith('/batch/'):
+            return self.__batch(content)
+        body = json.loads(content) if content else {}
+        status, response = server.drive_call(method, url.path, query, body)
+        self.__reply(status, json.dumps(response).encode() if response is not None else b'')
+
+    def __batch(self, content):
+        server = self.server
+        server.count('batch')
+        parser = FeedParser()
+        parser.feed(f"Content-Type: {self.headers['Content-Type']}\r\n\r\n")
+        parser.feed(content.decode())
+        boundary = uuid.uuid4().hex
+        parts = []
+        for part in parser.close().get_payload():
+            request = part.get_payload()
+            request_line, rest = request.split('\n', 1)
+            method, target, _ = request_line.strip().split(' ', 2)
+            body = re.split(r'\r?\n\r?\n', rest, 1)[1].strip() if re.search(r'\r?\n\r?\n', rest) else ''
+            url = urlparse(target)
+            query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            status, response = server.drive_call(method, url.path, query, json.loads(body) if body else {})
+            payload = json.dumps(response) if response is not None else ''
+            content_id = part['Content-ID'].strip('<>')
+            parts.append(f"--{boundary}\r\nContent-Type: application/http\r\n"
+                         f"Content-ID: <response-{content_id}>\r\n\r\n"
+                         f"HTTP/1.1 {status} {'OK' if status < 400 else 'Error'}\r\n"
+                         f"Content-Type: application/json; charset=UTF-8\r\n\r\n{payload}\r\n")
+        body = (''.join(parts) + f"--{boundary}--\r\n").encode()
+        self.__reply(200, body, f'multipart/mixed; boundary={boundary}')
+
+    def __reply(self, status, body, content_type='application/json; charset=UTF-8'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def add_tree_arguments(parser):
+    parser.add_argument('--drives', type=int, default=1, help='number of shared drives')
+    parser.add_argument('--depth', type=int, default=3, help='folder levels below each drive root')
+    parser.add_argument('--fanout', type=int, default=3, help='subfolders per folder')
+    parser.add_argument('--files', type=int, default=10, help='files per folder')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every HTTP request')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='fraction of Drive calls answered with 403 rateLimitExceeded')
+    parser.add_argument('--seed', type=int, default=0)
+
+def start_server(args, host='127.0.0.1', port=0):
+    drive, drive_ids = build_tree(args.drives, args.depth, args.fanout, args.files, args.seed)
+    server = FakeServer(drive, (host, port), latency=args.latency, error_rate=args.error_rate,
+                        seed=args.seed).start()
+    return server, drive_ids
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    add_tree_arguments(parser)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+    server, drive_ids = start_server(args, args.host, args.port)
+    print(f"Serving {server.drive.stats()} on {server.url} (Drive {server.url}/drive/v3, "
+          f"Telegraph {server.url}/telegraph, Bot API {server.url}/bot)")
+    print(f"Drive ids: {' '.join(drive_ids)}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
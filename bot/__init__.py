@@ -1,50 +1,148 @@
+import atexit
+import gzip
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import shutil
 import random
 import string
 import requests
-import subprocess
 import socket
+import threading
+import time
+import zipfile
 
 import telegram.ext as tg
 
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from telegraph import Telegraph
 from telegraph.exceptions import RetryAfterError
 
 socket.setdefaulttimeout(600)
 
-if os.path.exists('log.txt'):
-    with open('log.txt', 'r+') as f:
-        f.truncate(0)
-
-logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-                    handlers=[logging.FileHandler('log.txt'), logging.StreamHandler()],
-                    level=logging.INFO)
+startup_time = time.time()
+
+LOG_FILE = 'log.txt'
+
+# Records are only queued by the threads that log them, a single listener thread
+# formats them and does the file and console I/O. Size and compression of the
+# rotated files are applied once config.env has been loaded.
+log_queue = queue.SimpleQueue()
+log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+log_file_handler = logging.handlers.RotatingFileHandler(LOG_FILE, maxBytes=10 * 1024 * 1024, backupCount=5,
+                                                        encoding='utf-8')
+log_stream_handler = logging.StreamHandler()
+for handler in (log_file_handler, log_stream_handler):
+    handler.setFormatter(log_formatter)
+log_listener = logging.handlers.QueueListener(log_queue, log_file_handler, log_stream_handler,
+                                              respect_handler_level=True)
+log_listener.start()
+
+# Queued records only carry their message, the listener's handlers apply log_formatter
+log_queue_handler = logging.handlers.QueueHandler(log_queue)
+log_queue_handler.setFormatter(logging.Formatter('%(message)s'))
+logging.basicConfig(handlers=[log_queue_handler], level=logging.INFO)
+
+def stop_logging():
+    # Registered before any other exit hook so it runs after all of them, and logging.shutdown,
+    # registered when logging was imported, only closes the handlers once the queue is drained.
+    # Threads still running log straight to the handlers from here on.
+    root = logging.getLogger()
+    if log_queue_handler not in root.handlers:
+        return
+    log_listener.stop()
+    root.removeHandler(log_queue_handler)
+    root.addHandler(log_file_handler)
+    root.addHandler(log_stream_handler)
+
+atexit.register(stop_logging)
 
 LOGGER = logging.getLogger(__name__)
 
 def get_config(name: str):
     return os.environ[name]
 
-try:
-    CONFIG_ENV_URL = get_config('CONFIG_ENV_URL')
-    if len(CONFIG_ENV_URL) == 0:
-        CONFIG_ENV_URL = None
-    else:
-        res = requests.get(CONFIG_ENV_URL)
-        if res.status_code == 200:
-            with open('config.env', 'wb+') as f:
-                f.write(res.content)
-                f.close()
-        else:
-            LOGGER.error(f"Failed to load config.env file [{res.status_code}]")
-            raise KeyError
-except KeyError:
-    pass
+def get_config_url(name: str):
+    try:
+        url = get_config(name)
+        return url if len(url) != 0 else None
+    except KeyError:
+        return None
+
+def log_phase(name: str, start: float):
+    LOGGER.info(f"Startup: {name} took {round(time.time() - start, 2)}s")
+    return time.time()
+
+CACHE_DIR = '.cache'
+
+def fetch_remote(url: str, path: str):
+    """Download url to path, returning True if the file changed.
+
+    The ETag / Last-Modified of the last download is kept in CACHE_DIR and sent
+    back, so an unchanged file costs a single 304 and the copy on disk is reused.
+    """
+    meta_path = os.path.join(CACHE_DIR, f'{os.path.basename(path)}.json')
+    headers = {}
+    if os.path.exists(path) and os.path.exists(meta_path):
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        if meta.get('url') == url:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+    try:
+        res = requests.get(url, headers=headers, timeout=60)
+    except requests.RequestException as e:
+        LOGGER.error(f"Failed to load {path} file [{e}]")
+        return False
+    if res.status_code == 304:
+        LOGGER.info(f"Using cached {path} file")
+        return False
+    if res.status_code != 200:
+        LOGGER.error(f"Failed to load {path} file [{res.status_code}]")
+        return False
+    with open(path, 'wb+') as f:
+        f.write(res.content)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(meta_path, 'w') as f:
+        json.dump({
+            'url': url,
+            'etag': res.headers.get('ETag'),
+            'last_modified': res.headers.get('Last-Modified')
+        }, f)
+    return True
+
+phase_time = time.time()
+CONFIG_ENV_URL = get_config_url('CONFIG_ENV_URL')
+if CONFIG_ENV_URL is not None:
+    fetch_remote(CONFIG_ENV_URL, 'config.env')
 
 load_dotenv('config.env')
 
+# config.env may define the other URLs, so these are fetched once it is loaded
+TOKEN_JSON_URL = get_config_url('TOKEN_JSON_URL')
+ACCOUNTS_ZIP_URL = get_config_url('ACCOUNTS_ZIP_URL')
+DRIVE_LIST_URL = get_config_url('DRIVE_LIST_URL')
+ACCOUNTS_ZIP = os.path.join(CACHE_DIR, 'accounts.zip')
+os.makedirs(CACHE_DIR, exist_ok=True)
+with ThreadPoolExecutor(max_workers=3) as executor:
+    downloads = {}
+    if TOKEN_JSON_URL is not None:
+        downloads['token.json'] = executor.submit(fetch_remote, TOKEN_JSON_URL, 'token.json')
+    if ACCOUNTS_ZIP_URL is not None:
+        downloads['accounts.zip'] = executor.submit(fetch_remote, ACCOUNTS_ZIP_URL, ACCOUNTS_ZIP)
+    if DRIVE_LIST_URL is not None:
+        downloads['drive_list'] = executor.submit(fetch_remote, DRIVE_LIST_URL, 'drive_list')
+if 'accounts.zip' in downloads and os.path.exists(ACCOUNTS_ZIP):
+    if downloads['accounts.zip'].result() or not os.path.exists('accounts'):
+        with zipfile.ZipFile(ACCOUNTS_ZIP) as accounts_zip:
+            accounts_zip.extractall()
+phase_time = log_phase("remote config", phase_time)
+
 AUTHORIZED_CHATS = set()
 
 if os.path.exists('authorized_chats.txt'):
@@ -61,22 +159,6 @@ try:
 except:
     pass
 
-try:
-    TOKEN_JSON_URL = get_config('TOKEN_JSON_URL')
-    if len(TOKEN_JSON_URL) == 0:
-        TOKEN_JSON_URL = None
-    else:
-        res = requests.get(TOKEN_JSON_URL)
-        if res.status_code == 200:
-            with open('token.json', 'wb+') as f:
-                f.write(res.content)
-                f.close()
-        else:
-            LOGGER.error(f"Failed to load token.json file [{res.status_code}]")
-            raise KeyError
-except KeyError:
-    pass
-
 try:
     BOT_TOKEN = get_config('BOT_TOKEN')
     OWNER_ID = int(get_config('OWNER_ID'))
@@ -131,11 +213,182 @@ except KeyError:
     GDTOT_CRYPT = None
 
 try:
-    MAX_THREADS = int(get_config('MAX_THREADS'))
-    if MAX_THREADS <= 0 or MAX_THREADS is None:
+    if not os.environ.get('SEARCH_WORKERS') and os.environ.get('MAX_THREADS'):
+        LOGGER.warning("MAX_THREADS is deprecated, set SEARCH_WORKERS instead")
+        SEARCH_WORKERS = int(get_config('MAX_THREADS'))
+    else:
+        SEARCH_WORKERS = int(get_config('SEARCH_WORKERS'))
+    if SEARCH_WORKERS <= 0:
+        raise KeyError
+except (KeyError, ValueError):
+    SEARCH_WORKERS = 20
+
+try:
+    ASYNC_DRIVE_CONCURRENCY = int(get_config('ASYNC_DRIVE_CONCURRENCY'))
+    if ASYNC_DRIVE_CONCURRENCY <= 0:
+        raise KeyError
+except (KeyError, ValueError):
+    ASYNC_DRIVE_CONCURRENCY = 100
+
+try:
+    WEBHOOK_PORT = int(get_config('WEBHOOK_PORT'))
+except (KeyError, ValueError):
+    WEBHOOK_PORT = None
+
+WEBHOOK_URL = get_config_url('WEBHOOK_URL')
+if WEBHOOK_URL is not None:
+    WEBHOOK_URL = WEBHOOK_URL.rstrip('/')
+
+try:
+    WEBHOOK_LISTEN = get_config('WEBHOOK_LISTEN')
+    if len(WEBHOOK_LISTEN) == 0:
+        raise KeyError
+except KeyError:
+    WEBHOOK_LISTEN = '0.0.0.0'
+
+try:
+    WEBHOOK_PATH = get_config('WEBHOOK_PATH').strip('/')
+    if len(WEBHOOK_PATH) == 0:
+        raise KeyError
+except KeyError:
+    WEBHOOK_PATH = 'webhook'
+
+try:
+    WEBHOOK_SECRET = get_config('WEBHOOK_SECRET')
+    if len(WEBHOOK_SECRET) == 0:
+        raise KeyError
+except KeyError:
+    WEBHOOK_SECRET = None
+
+try:
+    WEBHOOK_WORKERS = int(get_config('WEBHOOK_WORKERS'))
+    if WEBHOOK_WORKERS <= 0:
+        raise KeyError
+except (KeyError, ValueError):
+    WEBHOOK_WORKERS = 8
+
+try:
+    LOG_MAX_SIZE = int(get_config('LOG_MAX_SIZE'))
+    if LOG_MAX_SIZE <= 0:
+        raise KeyError
+except (KeyError, ValueError):
+    LOG_MAX_SIZE = 10
+
+try:
+    LOG_BACKUP_COUNT = int(get_config('LOG_BACKUP_COUNT'))
+    if LOG_BACKUP_COUNT <= 0:
+        raise KeyError
+except (KeyError, ValueError):
+    LOG_BACKUP_COUNT = 5
+
+try:
+    LOG_COMPRESS = get_config('LOG_COMPRESS')
+    LOG_COMPRESS = LOG_COMPRESS.lower() == 'true'
+except KeyError:
+    LOG_COMPRESS = False
+
+def compress_log(source, dest):
+    with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+log_file_handler.maxBytes = LOG_MAX_SIZE * 1024 * 1024
+log_file_handler.backupCount = LOG_BACKUP_COUNT
+if LOG_COMPRESS:
+    log_file_handler.namer = lambda name: f'{name}.gz'
+    log_file_handler.rotator = compress_log
+
+try:
+    METRICS_PORT = int(get_config('METRICS_PORT'))
+except (KeyError, ValueError):
+    METRICS_PORT = None
+
+try:
+    METRICS_LISTEN = get_config('METRICS_LISTEN')
+    if len(METRICS_LISTEN) == 0:
         raise KeyError
 except KeyError:
-    MAX_THREADS = 1
+    METRICS_LISTEN = '0.0.0.0'
+
+# Bot API endpoint, e.g. a self-hosted telegram-bot-api server (http://localhost:8081/bot)
+TELEGRAM_API_URL = get_config_url('TELEGRAM_API_URL')
+
+try:
+    CHANGES_POLL_INTERVAL = int(get_config('CHANGES_POLL_INTERVAL'))
+    if CHANGES_POLL_INTERVAL < 0:
+        raise KeyError
+except (KeyError, ValueError):
+    CHANGES_POLL_INTERVAL = 60
+
+try:
+    CHANGES_CONCURRENCY = int(get_config('CHANGES_CONCURRENCY'))
+    if CHANGES_CONCURRENCY <= 0:
+        raise KeyError
+except (KeyError, ValueError):
+    CHANGES_CONCURRENCY = 4
+
+try:
+    COUNT_CACHE_TTL = int(get_config('COUNT_CACHE_TTL'))
+    if COUNT_CACHE_TTL < 0:
+        raise KeyError
+except (KeyError, ValueError):
+    COUNT_CACHE_TTL = 3600
+
+try:
+    VERIFY_CLONE = get_config('VERIFY_CLONE').lower()
+    if VERIFY_CLONE not in ['report', 'fix']:
+        raise KeyError
+except KeyError:
+    VERIFY_CLONE = None
+
+try:
+    COMMAND_WORKERS = int(get_config('COMMAND_WORKERS'))
+    if COMMAND_WORKERS <= 0:
+        raise KeyError
+except (KeyError, ValueError):
+    COMMAND_WORKERS = 8
+
+try:
+    COMMAND_QUEUE_SIZE = int(get_config('COMMAND_QUEUE_SIZE'))
+    if COMMAND_QUEUE_SIZE <= 0:
+        raise KeyError
+except (KeyError, ValueError):
+    COMMAND_QUEUE_SIZE = 50
+
+try:
+    STATUS_UPDATE_INTERVAL = int(get_config('STATUS_UPDATE_INTERVAL'))
+    if STATUS_UPDATE_INTERVAL <= 0:
+        raise KeyError
+except (KeyError, ValueError):
+    STATUS_UPDATE_INTERVAL = 3
+
+try:
+    BATCH_WORKERS = int(get_config('BATCH_WORKERS'))
+    if BATCH_WORKERS <= 0:
+        raise KeyError
+except (KeyError, ValueError):
+    BATCH_WORKERS = 4
+
+try:
+    DDL_CACHE_TTL = int(get_config('DDL_CACHE_TTL'))
+    if DDL_CACHE_TTL < 0:
+        raise KeyError
+except (KeyError, ValueError):
+    DDL_CACHE_TTL = 7 * 24 * 60 * 60
+
+try:
+    DRIVE_RATE_LIMIT = float(get_config('DRIVE_RATE_LIMIT'))
+    if DRIVE_RATE_LIMIT <= 0:
+        raise KeyError
+except (KeyError, ValueError):
+    DRIVE_RATE_LIMIT = 10.0
+
+try:
+    DRIVE_MAX_ATTEMPTS = int(get_config('DRIVE_MAX_ATTEMPTS'))
+    if DRIVE_MAX_ATTEMPTS <= 0:
+        raise KeyError
+except (KeyError, ValueError):
+    DRIVE_MAX_ATTEMPTS = 5
 
 try:
     XSRF_TOKEN = get_config('XSRF_TOKEN')
@@ -153,40 +406,6 @@ try:
 except KeyError:
     DRIVE_INDEX_URL = None
 
-try:
-    ACCOUNTS_ZIP_URL = get_config('ACCOUNTS_ZIP_URL')
-    if len(ACCOUNTS_ZIP_URL) == 0:
-        ACCOUNTS_ZIP_URL = None
-    else:
-        res = requests.get(ACCOUNTS_ZIP_URL)
-        if res.status_code == 200:
-            with open('accounts.zip', 'wb+') as f:
-                f.write(res.content)
-                f.close()
-        else:
-            LOGGER.error(f"Failed to load accounts.zip file [{res.status_code}]")
-            raise KeyError
-        subprocess.run(["unzip", "-q", "-o", "accounts.zip"])
-        os.remove("accounts.zip")
-except KeyError:
-    pass
-
-try:
-    DRIVE_LIST_URL = get_config('DRIVE_LIST_URL')
-    if len(DRIVE_LIST_URL) == 0:
-        DRIVE_LIST_URL = None
-    else:
-        res = requests.get(DRIVE_LIST_URL)
-        if res.status_code == 200:
-            with open('drive_list', 'wb+') as f:
-                f.write(res.content)
-                f.close()
-        else:
-            LOGGER.error(f"Failed to load drive_list file [{res.status_code}]")
-            raise KeyError
-except KeyError:
-    pass
-
 DRIVE_NAME = []
 DRIVE_ID = []
 INDEX_URL = []
@@ -215,22 +434,34 @@ def create_account(sname):
         telegraph = Telegraph()
         telegraph.create_account(short_name=sname)
         telegraph_token = telegraph.get_access_token()
-        telegra_ph.append(Telegraph(access_token=telegraph_token))
+        return Telegraph(access_token=telegraph_token)
     except RetryAfterError as err:
         LOGGER.info(f"Telegra.ph account creation limit hit, waiting for {err.retry_after}s")
         time.sleep(err.retry_after)
-        create_account(sname)
+        return create_account(sname)
 
 telegra_ph_accounts_count = 5
 telegra_ph = []
-# Generate Telegraph Token
-for i in range(telegra_ph_accounts_count):
-    sname = ''.join(random.SystemRandom().choices(string.ascii_letters, k=8))
-    create_account(sname)
-
-LOGGER.info(f"Generated {telegra_ph_accounts_count} TELEGRAPH_TOKEN")
-
-
-updater = tg.Updater(token=BOT_TOKEN, use_context=True)
+telegra_ph_lock = threading.Lock()
+
+def get_telegraph_accounts():
+    """Return the Telegraph accounts, creating them on first use."""
+    with telegra_ph_lock:
+        if len(telegra_ph) == 0:
+            start = time.time()
+            # Generate Telegraph Token
+            snames = [''.join(random.SystemRandom().choices(string.ascii_letters, k=8))
+                      for _ in range(telegra_ph_accounts_count)]
+            with ThreadPoolExecutor(max_workers=telegra_ph_accounts_count) as executor:
+                telegra_ph.extend(executor.map(create_account, snames))
+            LOGGER.info(f"Generated {telegra_ph_accounts_count} TELEGRAPH_TOKEN in {round(time.time() - start, 2)}s")
+    return telegra_ph
+
+phase_time = log_phase("config", phase_time)
+
+if TELEGRAM_API_URL is not None:
+    updater = tg.Updater(token=BOT_TOKEN, base_url=TELEGRAM_API_URL, use_context=True)
+else:
+    updater = tg.Updater(token=BOT_TOKEN, use_context=True)
 bot = updater.bot
 dispatcher = updater.dispatcher
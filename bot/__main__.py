@@ -1,11 +1,19 @@
+import threading
+import time
+
 from telegram.ext import CommandHandler
 
-from bot import AUTHORIZED_CHATS, dispatcher, updater
-from bot.modules import auth, clone, count, delete, list, permission, shell
+from bot import AUTHORIZED_CHATS, WEBHOOK_PORT, METRICS_PORT, dispatcher, updater, startup_time, phase_time, log_phase, \
+    get_telegraph_accounts
+from bot.modules import auth, clone, count, delete, dupes, list, permission, profile, shell, verify
+from bot.helper.ext_utils import log_reader, metrics
+from bot.helper.ext_utils.metrics import track_command
+from bot.helper.telegram_helper import webhook
 from bot.helper.telegram_helper.bot_commands import BotCommands
 from bot.helper.telegram_helper.filters import CustomFilters
 from bot.helper.telegram_helper.message_utils import *
 
+@track_command(BotCommands.StartCommand)
 def start(update, context):
     if CustomFilters.authorized_user(update) or CustomFilters.authorized_chat(update):
         if update.message.chat.type == "private":
@@ -17,6 +25,7 @@ def start(update, context):
         sendMessage(f"Access denied", context.bot, update)
         LOGGER.info('Denied: {} [{}]'.format(update.message.from_user.first_name, update.message.from_user.id))
 
+@track_command(BotCommands.HelpCommand)
 def bot_help(update, context):
     help_string = f'''
 <u><i><b>Usage:</b></i></u>
@@ -27,6 +36,9 @@ For <i>folder</i> results only:
 For <i>file</i> results only:
 <code>/{BotCommands.ListCommand} -f &lt;query&gt;</code>
 
+To show how long each search phase took:
+<code>/{BotCommands.ListCommand} -t &lt;query&gt;</code>
+
 <u><i><b>Commands:</b></i></u>
 
 /{BotCommands.StartCommand}: Start the bot
@@ -37,9 +49,19 @@ For <i>file</i> results only:
 
 /{BotCommands.CountCommand} [drive_url]: Count data of Drive
 
+/{BotCommands.VerifyCommand} [source_url] [dest_url]: Compare a copy with its source by path, size and md5
+
+/{BotCommands.VerifyCommand} -f [source_url] [dest_url]: Also re-copy missing and mismatched files, trashing bad copies (Only owner)
+
+Send or reply to several links with /{BotCommands.CloneCommand} or /{BotCommands.CountCommand} to process them together
+
 /{BotCommands.PermissionCommand} [drive_url]: Set data permission to 'Anyone with the link' (Only owner)
 
-/{BotCommands.DeleteCommand} [drive_url]: Delete data from Drive (Only owner)
+/{BotCommands.PermissionCommand} -r [drive_url]: Set permission on every item of a folder (Only owner)
+
+/{BotCommands.DeleteCommand} [drive_url]: Delete data from Drive, folders with everything in them (Only owner)
+
+/{BotCommands.DupesCommand}: Find duplicate files across the Drives, -r to list every Drive again (Only owner)
 
 /{BotCommands.AuthorizeCommand}: Authorize an user or a chat for using the bot (Only owner)
 
@@ -49,16 +71,46 @@ For <i>file</i> results only:
 
 /{BotCommands.ShellCommand} [cmd]: Execute bash commands (Only owner)
 
-/{BotCommands.LogCommand}: Get the log file (Only owner)
+/{BotCommands.LogCommand} [lines] or [30m]: Get the log file, its last lines or the records of a time window (Only owner)
+
+/{BotCommands.ProfileCommand} [count] or [command] [count]: Profile the next commands and get the report (Only owner)
 
 /{BotCommands.HelpCommand}: Get this message
 '''
     sendMessage(help_string, context.bot, update)
 
+LOG_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+@track_command(BotCommands.LogCommand)
 def log(update, context):
-    send_log_file(context.bot, update)
+    args = update.message.text.split()[1:]
+    if len(args) == 0:
+        return send_log_file(context.bot, update)
+    arg = args[0].lower()
+    if arg.isdigit() and int(arg) > 0:
+        lines = log_reader.last_lines(int(arg))
+    elif arg[:-1].isdigit() and arg[-1] in LOG_UNITS:
+        lines = log_reader.lines_since(int(arg[:-1]) * LOG_UNITS[arg[-1]])
+    else:
+        return sendMessage(f"Send /{BotCommands.LogCommand} [lines] or a time window like 30m, 2h, 1d",
+                           context.bot, update)
+    if len(lines) == 0:
+        return sendMessage("No log records found", context.bot, update)
+    send_file(context.bot, update, 'log.txt', ''.join(lines))
+
+def warm_up():
+    # Pay for the Drive client imports, the Drive caches, Telegraph accounts and change feed off the startup path
+    start = time.time()
+    import bot.helper.drive_utils.gdriveTools
+    from bot.helper.drive_utils.drive_cache import change_feed
+    # Subscribed before the feed starts so the duplicate index sees every change
+    import bot.helper.drive_utils.dupes_index
+    get_telegraph_accounts()
+    change_feed.start()
+    log_phase("warm up", start)
 
 def main():
+    modules_time = log_phase("modules", phase_time)
     start_handler = CommandHandler(BotCommands.StartCommand, start, run_async=True)
     help_handler = CommandHandler(BotCommands.HelpCommand, bot_help,
                                   filters=CustomFilters.authorized_chat | CustomFilters.authorized_user, run_async=True)
@@ -69,8 +121,20 @@ def main():
     dispatcher.add_handler(help_handler)
     dispatcher.add_handler(log_handler)
 
-    updater.start_polling()
-    LOGGER.info("Bot started")
-    updater.idle()
+    if METRICS_PORT is not None:
+        metrics.start_server()
+
+    if WEBHOOK_PORT is not None:
+        server = webhook.start_webhook()
+        log_phase("webhook", modules_time)
+    else:
+        updater.start_polling()
+        log_phase("polling", modules_time)
+    LOGGER.info(f"Bot started in {round(time.time() - startup_time, 2)}s")
+    threading.Thread(target=warm_up, name="WarmUp", daemon=True).start()
+    if WEBHOOK_PORT is not None:
+        webhook.idle(server)
+    else:
+        updater.idle()
 
 main()
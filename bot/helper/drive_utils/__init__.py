@@ -0,0 +1,4 @@
+def drive_helper(*args, **kwargs):
+    # gdriveTools pulls in googleapiclient and the Drive caches, so it is only loaded by the first command using it
+    from bot.helper.drive_utils.gdriveTools import GoogleDriveHelper
+    return GoogleDriveHelper(*args, **kwargs)
@@ -0,0 +1,282 @@
+import asyncio
+import atexit
+import threading
+
+import aiohttp
+
+from google.auth.transport.requests import Request
+
+from bot import LOGGER, ASYNC_DRIVE_CONCURRENCY, DRIVE_MAX_ATTEMPTS
+from bot.helper.drive_utils.rate_limiter import THROTTLE_REASONS, credentials_key, get_limiter, \
+    parse_retry_after, should_retry
+from bot.helper.ext_utils import metrics
+
+DRIVE_API_URL = "https://www.googleapis.com/drive/v3"
+FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+
+class AsyncDriveError(Exception):
+    def __init__(self, status, reason, message):
+        super().__init__(f"<HttpError {status} \"{message}\". Details: \"{reason}\">")
+        self.status = status
+        self.reason = reason
+        self.message = message
+
+
+class AsyncDriveClient:
+    # Drive v3 client on the shared event loop, one keep-alive pool per client behind a request semaphore
+
+    def __init__(self, credentials, concurrency=ASYNC_DRIVE_CONCURRENCY):
+        self.credentials = credentials
+        self.concurrency = concurrency
+        self.__semaphore = None
+        self.__session = None
+        self.__refresh_lock = threading.Lock()
+
+    async def close(self):
+        if self.__session is not None:
+            await self.__session.close()
+            self.__session = None
+
+    def __get_session(self):
+        if self.__session is None or self.__session.closed:
+            connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=60)
+            self.__session = aiohttp.ClientSession(connector=connector,
+                                                   timeout=aiohttp.ClientTimeout(total=600))
+            self.__semaphore = asyncio.Semaphore(self.concurrency)
+        return self.__session
+
+    def __refresh_credentials(self):
+        with self.__refresh_lock:
+            if not self.credentials.valid:
+                self.credentials.refresh(Request())
+        return self.credentials.token
+
+    async def __get_token(self):
+        if self.credentials.valid:
+            return self.credentials.token
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.__refresh_credentials)
+
+    async def request(self, method, path, params=None, body=None, name=None):
+        session = self.__get_session()
+        limiter = get_limiter(self.credentials)
+        name = name or f'{method} {path}'
+        for attempt in range(1, DRIVE_MAX_ATTEMPTS + 1):
+            token = await self.__get_token()
+            headers = {"Authorization": f"Bearer {token}"}
+            async with self.__semaphore:
+                await limiter.acquire_async()
+                with metrics.DRIVE_LATENCY.time(name):
+                    async with session.request(method, f"{DRIVE_API_URL}/{path}", params=params,
+                                               json=body, headers=headers) as resp:
+                        data = {} if resp.status == 204 else await resp.json(content_type=None)
+            metrics.DRIVE_REQUESTS.inc(name, resp.status)
+            if resp.status < 400:
+                limiter.on_success()
+                return data
+            error = data.get('error', {}) if isinstance(data, dict) else {}
+            errors = error.get('errors') or [{}]
+            reason = errors[0].get('reason', '')
+            if resp.status == 429 or reason in THROTTLE_REASONS:
+                limiter.on_throttle(parse_retry_after(resp.headers.get('Retry-After')))
+            elif resp.status >= 500:
+                await asyncio.sleep(min(2 ** attempt, 30))
+            if attempt == DRIVE_MAX_ATTEMPTS or not should_retry(resp.status, reason):
+                raise AsyncDriveError(resp.status, reason, error.get('message', str(data)))
+            LOGGER.debug(f"Retrying {method} {path} after {reason or resp.status} [{attempt}/{DRIVE_MAX_ATTEMPTS}]")
+            metrics.DRIVE_RETRIES.inc(name, reason or resp.status)
+
+    async def list_files(self, query, fields='nextPageToken, files(id, name, mimeType, size)', **params):
+        files = []
+        params.update({
+            'q': query,
+            'fields': fields,
+            'pageSize': params.get('pageSize', 1000),
+            'supportsAllDrives': 'true',
+            'includeItemsFromAllDrives': 'true'
+        })
+        while True:
+            response = await self.request('GET', 'files', params=params, name='files.list')
+            files.extend(response.get('files', []))
+            page_token = response.get('nextPageToken')
+            if page_token is None:
+                break
+            params['pageToken'] = page_token
+        return files
+
+    async def get_file(self, file_id, fields='id, name, mimeType, size'):
+        return await self.request('GET', f'files/{file_id}',
+                                  params={'fields': fields, 'supportsAllDrives': 'true'}, name='files.get')
+
+    async def copy_file(self, file_id, dest_id, fields='id, name, mimeType, size'):
+        return await self.request('POST', f'files/{file_id}/copy',
+                                  params={'fields': fields, 'supportsAllDrives': 'true'},
+                                  body={'parents': [dest_id]}, name='files.copy')
+
+    async def create_folder(self, name, parent_id=None):
+        body = {
+            'name': name,
+            'mimeType': FOLDER_MIME_TYPE
+        }
+        if parent_id is not None:
+            body['parents'] = [parent_id]
+        return await self.request('POST', 'files', params={'fields': 'id, name', 'supportsAllDrives': 'true'},
+                                  body=body, name='files.create')
+
+    async def delete_file(self, file_id):
+        return await self.request('DELETE', f'files/{file_id}', params={'supportsAllDrives': 'true'},
+                                  name='files.delete')
+
+    async def create_permission(self, file_id, body):
+        return await self.request('POST', f'files/{file_id}/permissions',
+                                  params={'supportsAllDrives': 'true'}, body=body,
+                                  name='permissions.create')
+
+    async def get_start_page_token(self, drive_id=None):
+        params = {'supportsAllDrives': 'true'}
+        if drive_id is not None:
+            params['driveId'] = drive_id
+        response = await self.request('GET', 'changes/startPageToken', params=params,
+                                      name='changes.getStartPageToken')
+        return response.get('startPageToken')
+
+    async def list_changes(self, page_token, drive_id=None, fields='nextPageToken, newStartPageToken, '
+                           'changes(fileId, removed, file(id, name, mimeType, parents, trashed, size, '
+                           'md5Checksum, modifiedTime))'):
+        # The changes after page_token and the token to continue from next time
+        changes = []
+        params = {
+            'pageToken': page_token,
+            'pageSize': 1000,
+            'fields': fields,
+            'includeRemoved': 'true',
+            'supportsAllDrives': 'true'
+        }
+        if drive_id is not None:
+            params['driveId'] = drive_id
+            params['includeItemsFromAllDrives'] = 'true'
+        while True:
+            response = await self.request('GET', 'changes', params=params, name='changes.list')
+            changes.extend(response.get('changes', []))
+            if 'newStartPageToken' in response:
+                return changes, response['newStartPageToken']
+            params['pageToken'] = response.get('nextPageToken')
+
+    async def list_children(self, folder_id,
+                            fields='nextPageToken, files(id, name, mimeType, size, shortcutDetails)'):
+        return await self.list_files(f"'{folder_id}' in parents and trashed = false", fields=fields)
+
+    async def list_children_many(self, folder_ids):
+        return await asyncio.gather(*[self.list_children(fid) for fid in folder_ids])
+
+    async def walk(self, folder_id):
+        # (folder_id, children) of every folder below folder_id, listed a tree level at a time
+        tree = []
+        level = [folder_id]
+        while level:
+            results = await self.list_children_many(level)
+            next_level = []
+            for fid, children in zip(level, results):
+                tree.append((fid, children))
+                for child in children:
+                    if child.get('mimeType') == FOLDER_MIME_TYPE:
+                        next_level.append(child.get('id'))
+            level = next_level
+        return tree
+
+    async def list_tree(self, folder_id,
+                        fields='nextPageToken, files(id, name, mimeType, size, md5Checksum)'):
+        """Return {relative path: [items]} of everything below folder_id, a tree level at a time.
+
+        Drive allows several items with one name in a folder, so each path maps to a list.
+        """
+        tree = {}
+        level = [(folder_id, '')]
+        while level:
+            results = await asyncio.gather(*[self.list_children(fid, fields=fields) for fid, _ in level])
+            next_level = []
+            for (_, path), children in zip(level, results):
+                for child in children:
+                    child_path = f"{path}{child.get('name')}"
+                    tree.setdefault(child_path, []).append(child)
+                    if child.get('mimeType') == FOLDER_MIME_TYPE:
+                        next_level.append((child.get('id'), f"{child_path}/"))
+            level = next_level
+        return tree
+
+    async def list_trees(self, folder_ids):
+        return await asyncio.gather(*[self.list_tree(fid) for fid in folder_ids])
+
+    async def count(self, folder_id):
+        # (total_files, total_folders, total_bytes) of a folder tree
+        total_files = total_folders = total_bytes = 0
+        shortcuts = []
+        for _, children in await self.walk(folder_id):
+            for child in children:
+                shortcut_details = child.get('shortcutDetails')
+                if shortcut_details is not None:
+                    shortcuts.append(shortcut_details)
+                elif child.get('mimeType') == FOLDER_MIME_TYPE:
+                    total_folders += 1
+                else:
+                    total_files += 1
+                    total_bytes += int(child.get('size', 0))
+        targets = await asyncio.gather(*[self.get_file(s['targetId']) for s in shortcuts])
+        for target in targets:
+            if target.get('mimeType') == FOLDER_MIME_TYPE:
+                total_folders += 1
+                files, folders, size = await self.count(target.get('id'))
+                total_files += files
+                total_folders += folders
+                total_bytes += size
+            else:
+                total_files += 1
+                total_bytes += int(target.get('size', 0))
+        return total_files, total_folders, total_bytes
+
+
+_loop = None
+_loop_lock = threading.Lock()
+_clients = {}
+
+def get_event_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="AsyncDrive", daemon=True).start()
+    return _loop
+
+def run_coroutine(coro):
+    # Run a coroutine on the shared Drive event loop and wait for it
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result()
+
+def get_client(credentials):
+    # The pooled client of an account, reusing its open connections
+    key = credentials_key(credentials)
+    with _loop_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = AsyncDriveClient(credentials)
+            _clients[key] = client
+        else:
+            client.credentials = credentials
+    return client
+
+async def _close(clients):
+    await asyncio.gather(*[client.close() for client in clients], return_exceptions=True)
+
+def close_clients():
+    # Close the sessions of every pooled client on the loop they were opened on
+    with _loop_lock:
+        loop = _loop
+        clients = list(_clients.values())
+        _clients.clear()
+    if loop is None or not clients:
+        return
+    try:
+        asyncio.run_coroutine_threadsafe(_close(clients), loop).result(timeout=10)
+    except Exception as e:
+        LOGGER.error(f"Closing the Drive sessions failed: {e}")
+
+atexit.register(close_clients)
@@ -0,0 +1,421 @@
+import asyncio
+import atexit
+import json
+import os
+import threading
+import time
+
+from collections import OrderedDict
+
+from bot import LOGGER, DATABASE_URL, DRIVE_ID, CHANGES_POLL_INTERVAL, CHANGES_CONCURRENCY, COUNT_CACHE_TTL
+from bot.helper.drive_utils import async_drive
+from bot.helper.drive_utils.service_factory import get_credentials
+from bot.helper.ext_utils import metrics
+from bot.helper.ext_utils.bot_utils import write_json
+
+ANCESTOR_CACHE_SIZE = 100000
+COUNT_CACHE_SIZE = 100000
+COUNT_CACHE_FILES = 1000000
+# The count cache file is saved after this many folders changed or this many seconds passed
+FLUSH_CHANGES = 1000
+FLUSH_INTERVAL = 600
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+def is_removed(change):
+    # True when a change entry means the item is gone: deleted, trashed or no longer visible
+    return change.get('removed', False) or change.get('file', {}).get('trashed', False)
+
+
+class AncestorCache:
+    # Folders walked for search result paths, only served while the change feed keeps them current
+
+    def __init__(self, max_size=ANCESTOR_CACHE_SIZE):
+        self.max_size = max_size
+        self.enabled = False
+        self.__lock = threading.Lock()
+        self.__files = OrderedDict()
+
+    @staticmethod
+    def __entry(file_id, file, drive_id):
+        return {'id': file_id, 'name': file.get('name'), 'parents': file.get('parents'), 'driveId': drive_id}
+
+    def get(self, file_id):
+        if not self.enabled:
+            return None
+        with self.__lock:
+            file = self.__files.get(file_id)
+            if file is not None:
+                self.__files.move_to_end(file_id)
+            return file
+
+    def set(self, file_id, file):
+        if not self.enabled:
+            return
+        with self.__lock:
+            self.__files[file_id] = self.__entry(file.get('id'), file, file.get('driveId') or 'root')
+            self.__files.move_to_end(file_id)
+            while len(self.__files) > self.max_size:
+                self.__files.popitem(last=False)
+
+    def on_change(self, drive_id, change):
+        with self.__lock:
+            if change is None:
+                for file_id in [file_id for file_id, file in self.__files.items() if file['driveId'] == drive_id]:
+                    del self.__files[file_id]
+                return
+            file_id = change.get('fileId')
+            if file_id not in self.__files:
+                return
+            if is_removed(change):
+                del self.__files[file_id]
+            else:
+                self.__files[file_id] = self.__entry(file_id, change.get('file', {}), drive_id)
+
+
+class CountCache:
+    # Subtree totals of every folder counted by /count, with the ids of the files directly in it, so a later
+    # count only lists the branches that changed. A folder is only kept while all its subfolders are.
+
+    def __init__(self, path='count_cache.json', max_size=COUNT_CACHE_SIZE, max_files=COUNT_CACHE_FILES):
+        self.path = path
+        self.max_size = max_size
+        self.max_files = max_files
+        self.__lock = threading.Lock()
+        self.__flush_lock = threading.Lock()
+        self.__folders = OrderedDict()
+        self.__file_parents = {}
+        self.__files = 0
+        self.__removed = set()
+        self.__dirty = False
+        self.__changes = 0
+        self.__flushed_at = time.time()
+        self.__generation = 0
+        self.__db = None
+        if DATABASE_URL is not None:
+            from bot.helper.ext_utils.database import DatabaseHelper
+            self.__db = DatabaseHelper()
+            self.__folders.update(self.__db.get_counts())
+        elif os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    data = json.load(f)
+                tokens = data.get('tokens', {})
+                for folder_id, entry in data.get('folders', {}).items():
+                    # Folders of a drive whose changes went on after the save may be stale
+                    if tokens.get(entry['drive']) == change_feed.token(entry['drive']):
+                        self.__folders[folder_id] = entry
+            except (ValueError, AttributeError, KeyError):
+                LOGGER.error(f"Ignoring corrupt {self.path}")
+        for folder_id, entry in self.__folders.items():
+            self.__files += len(entry.get('file_ids', []))
+            for file_id in entry.get('file_ids', []):
+                self.__file_parents[file_id] = folder_id
+
+    @property
+    def enabled(self):
+        return COUNT_CACHE_TTL > 0 or CHANGES_POLL_INTERVAL > 0
+
+    def __valid(self, entry, modified=None):
+        if change_feed.follows(entry['drive']):
+            return True
+        return (modified is None or entry['modified'] == modified) and \
+            time.time() - entry['computed_at'] < COUNT_CACHE_TTL
+
+    def get(self, folder_id, modified):
+        with self.__lock:
+            entry = self.__folders.get(folder_id)
+            if entry is None or not self.__valid(entry, modified):
+                return None
+            self.__folders.move_to_end(folder_id)
+            return entry
+
+    def __stale(self, folder_id, stale):
+        # Every ancestor of a kept folder up to the top of its counted tree is kept too
+        while folder_id in self.__folders and folder_id not in stale:
+            stale.add(folder_id)
+            folder_id = self.__folders[folder_id]['parent']
+
+    def __remove(self, stale):
+        for folder_id in stale:
+            file_ids = self.__folders.pop(folder_id).get('file_ids', [])
+            self.__files -= len(file_ids)
+            for file_id in file_ids:
+                if self.__file_parents.get(file_id) == folder_id:
+                    del self.__file_parents[file_id]
+        if stale:
+            self.__removed.update(stale)
+            self.__dirty = True
+            self.__changes += len(stale)
+
+    def on_change(self, drive_id, change):
+        stale = set()
+        with self.__lock:
+            self.__generation += 1
+            if change is None:
+                stale.update(fid for fid, entry in self.__folders.items() if entry['drive'] == drive_id)
+            else:
+                file_id = change.get('fileId')
+                # The old location of a moved or removed file or folder
+                self.__stale(self.__file_parents.get(file_id), stale)
+                self.__stale(file_id, stale)
+                for parent in change.get('file', {}).get('parents', []):
+                    self.__stale(parent, stale)
+            self.__remove(stale)
+
+    def __evict(self):
+        stale = set()
+        for folder_id, entry in self.__folders.items():
+            if not self.__valid(entry):
+                self.__stale(folder_id, stale)
+        self.__remove(stale)
+        # Least recently used first, until both the folders and their file ids fit
+        folders = iter(list(self.__folders))
+        while len(self.__folders) > self.max_size or self.__files > self.max_files:
+            stale = set()
+            self.__stale(next(folders, None), stale)
+            self.__remove(stale)
+
+    def __store(self, entries, generation):
+        with self.__lock:
+            if generation != self.__generation:
+                # A change came in while listing, it may not be in the totals
+                return
+            self.__remove([folder_id for folder_id in entries if folder_id in self.__folders])
+            for folder_id, entry in entries.items():
+                self.__folders[folder_id] = entry
+                self.__files += len(entry['file_ids'])
+                for file_id in entry['file_ids']:
+                    self.__file_parents[file_id] = folder_id
+            self.__removed.difference_update(entries)
+            self.__dirty = True
+            self.__changes += len(entries)
+            self.__evict()
+        if self.__db is not None:
+            self.__db.set_counts(entries)
+        self.flush()
+
+    def flush(self, force=False):
+        with self.__flush_lock:
+            with self.__lock:
+                if not self.__dirty:
+                    return
+                # MongoDB only gets the removals, the file is rewritten whole so it waits for enough changes
+                if self.__db is None and not force and self.__changes < FLUSH_CHANGES and \
+                        time.time() - self.__flushed_at < FLUSH_INTERVAL:
+                    return
+                self.__dirty = False
+                self.__changes = 0
+                self.__flushed_at = time.time()
+                removed, self.__removed = self.__removed, set()
+                if self.__db is None:
+                    # Entries are never changed once stored, so a shallow copy is a consistent snapshot;
+                    # tokens are only advanced after their changes were applied, so they are never ahead
+                    drives = {entry['drive'] for entry in self.__folders.values()}
+                    data = {'tokens': {drive: change_feed.token(drive) for drive in drives},
+                            'folders': dict(self.__folders)}
+            if self.__db is not None:
+                self.__db.remove_counts(removed)
+            else:
+                write_json(self.path, data)
+
+    async def count(self, client, folder):
+        # (total_files, total_folders, total_bytes) of the tree of folder, metadata with id, driveId,
+        # parents and modifiedTime
+        generation = self.__generation
+        fields = 'nextPageToken, files(id, name, mimeType, size, modifiedTime, shortcutDetails)'
+        drive = folder.get('driveId', 'root')
+        root_id = folder.get('id')
+        parents = {root_id: (folder.get('parents') or [None])[0]}
+        modified = {root_id: folder.get('modifiedTime')}
+        totals = {}
+        walked = []
+        level = [root_id]
+        while level:
+            listing = []
+            for folder_id in level:
+                entry = self.get(folder_id, modified[folder_id])
+                if entry is None:
+                    listing.append(folder_id)
+                else:
+                    totals[folder_id] = [entry['files'], entry['folders'], entry['bytes'], True]
+            results = await asyncio.gather(*[client.list_children(folder_id, fields=fields)
+                                             for folder_id in listing])
+            level = []
+            for folder_id, children in zip(listing, results):
+                files = folders = size = 0
+                subfolders = []
+                file_ids = []
+                shortcuts = []
+                for child in children:
+                    if child.get('shortcutDetails') is not None:
+                        shortcuts.append(child['shortcutDetails'])
+                    elif child.get('mimeType') == FOLDER_MIME_TYPE:
+                        folders += 1
+                        subfolders.append(child['id'])
+                        parents[child['id']] = folder_id
+                        modified[child['id']] = child.get('modifiedTime')
+                    else:
+                        files += 1
+                        size += int(child.get('size', 0))
+                        file_ids.append(child['id'])
+                targets = await asyncio.gather(*[client.get_file(
+                    s['targetId'], fields='id, name, mimeType, size, driveId, parents, modifiedTime')
+                    for s in shortcuts])
+                for target in targets:
+                    if target.get('mimeType') == FOLDER_MIME_TYPE:
+                        target_files, target_folders, target_size = await self.count(client, target)
+                        files += target_files
+                        folders += target_folders + 1
+                        size += target_size
+                    else:
+                        files += 1
+                        size += int(target.get('size', 0))
+                totals[folder_id] = [files, folders, size, not shortcuts]
+                walked.append((folder_id, subfolders, file_ids))
+                level.extend(subfolders)
+        entries = {}
+        now = time.time()
+        for folder_id, subfolders, file_ids in reversed(walked):
+            total = totals[folder_id]
+            for subfolder in subfolders:
+                files, folders, size, exact = totals[subfolder]
+                total[0] += files
+                total[1] += folders
+                total[2] += size
+                total[3] = total[3] and exact
+            if total[3]:
+                entries[folder_id] = {
+                    'files': total[0],
+                    'folders': total[1],
+                    'bytes': total[2],
+                    'computed_at': now,
+                    'modified': modified[folder_id],
+                    'parent': parents[folder_id],
+                    'drive': drive,
+                    'file_ids': file_ids
+                }
+        if entries:
+            self.__store(entries, generation)
+        return tuple(totals[root_id][:3])
+
+
+class ChangeFeed:
+    # Hands every change of the drives in drive_list to callback(drive_id, change), None when a drive's
+    # log was lost and whatever is cached about it has to go. Flush callbacks run before tokens are saved
+
+    def __init__(self, drive_ids, path='change_tokens.json'):
+        self.drive_ids = list(dict.fromkeys(drive_ids))
+        self.path = path
+        self.running = False
+        self.synced = False
+        self.__subscribers = []
+        self.__flushes = []
+        self.__tokens = {}
+        self.__db = None
+        if DATABASE_URL is not None:
+            from bot.helper.ext_utils.database import DatabaseHelper
+            self.__db = DatabaseHelper()
+            self.__tokens = self.__db.get_change_tokens()
+        elif os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    self.__tokens = json.load(f)
+            except ValueError:
+                LOGGER.error(f"Ignoring corrupt {self.path}")
+
+    def subscribe(self, callback, flush=None):
+        self.__subscribers.append(callback)
+        if flush is not None:
+            self.__flushes.append(flush)
+
+    def token(self, drive_id):
+        return self.__tokens.get(drive_id)
+
+    def follows(self, drive_id):
+        # True when every change of drive_id up to the last poll has been handed to the subscribers
+        return self.synced and drive_id in self.__tokens
+
+    def __notify(self, drive_id, change):
+        for callback in self.__subscribers:
+            try:
+                callback(drive_id, change)
+            except Exception as e:
+                LOGGER.error(f"Change subscriber failed: {e}", exc_info=True)
+
+    def __save(self, updated):
+        if self.__db is not None:
+            for drive_id in updated:
+                self.__db.set_change_token(drive_id, self.__tokens[drive_id])
+        else:
+            write_json(self.path, self.__tokens)
+
+    async def __poll_drive(self, client, semaphore, drive_id):
+        # My Drive is followed without a driveId, shared drives with theirs
+        drive = None if drive_id == 'root' else drive_id
+        async with semaphore:
+            token = self.__tokens.get(drive_id)
+            if token is not None:
+                try:
+                    changes, token = await client.list_changes(token, drive)
+                except async_drive.AsyncDriveError as e:
+                    if e.status not in (400, 404):
+                        raise
+                    LOGGER.warning(f"Change token of {drive_id} is no longer valid, starting over")
+                    token = None
+            if token is None:
+                # Whatever happened before this token is unknown
+                self.__notify(drive_id, None)
+                self.__tokens[drive_id] = await client.get_start_page_token(drive)
+                return drive_id
+        for change in changes:
+            self.__notify(drive_id, change)
+        metrics.DRIVE_CHANGES.inc(drive_id, amount=len(changes))
+        self.__tokens[drive_id] = token
+        return drive_id
+
+    async def __poll_all(self, client):
+        semaphore = asyncio.Semaphore(CHANGES_CONCURRENCY)
+        results = await asyncio.gather(*[self.__poll_drive(client, semaphore, drive_id)
+                                         for drive_id in self.drive_ids], return_exceptions=True)
+        updated = []
+        for drive_id, result in zip(self.drive_ids, results):
+            if isinstance(result, Exception):
+                LOGGER.error(f"Polling changes of {drive_id} failed: {result}")
+            else:
+                updated.append(drive_id)
+        return updated
+
+    def poll(self):
+        # Apply every change since the last poll and persist the new tokens
+        client = async_drive.get_client(get_credentials())
+        updated = async_drive.run_coroutine(self.__poll_all(client))
+        for flush in self.__flushes:
+            flush()
+        if updated:
+            self.__save(updated)
+
+    def __run(self):
+        while True:
+            start = time.time()
+            try:
+                self.poll()
+                # Only cache once every drive has a token, or changes made in between would be missed
+                self.synced = all(drive_id in self.__tokens for drive_id in self.drive_ids)
+                ancestor_cache.enabled = self.synced
+            except Exception as e:
+                LOGGER.error(f"Polling changes failed: {e}")
+            time.sleep(max(0.0, CHANGES_POLL_INTERVAL - (time.time() - start)))
+
+    def start(self):
+        if self.running or CHANGES_POLL_INTERVAL == 0 or not self.drive_ids:
+            return
+        self.running = True
+        threading.Thread(target=self.__run, name="ChangeFeed", daemon=True).start()
+        LOGGER.info(f"Following changes of {len(self.drive_ids)} drives every {CHANGES_POLL_INTERVAL}s")
+
+ancestor_cache = AncestorCache()
+change_feed = ChangeFeed(DRIVE_ID)
+change_feed.subscribe(ancestor_cache.on_change)
+count_cache = CountCache()
+change_feed.subscribe(count_cache.on_change, count_cache.flush)
+atexit.register(count_cache.flush, force=True)
@@ -0,0 +1,178 @@
+import atexit
+import json
+import os
+import threading
+import time
+
+from bot import LOGGER
+from bot.helper.drive_utils.drive_cache import FOLDER_MIME_TYPE, change_feed, is_removed
+from bot.helper.ext_utils.bot_utils import get_readable_file_size, write_json
+
+MAX_PATH_DEPTH = 100
+# The index is saved after a build, and after changes once this many arrived or this many seconds passed
+FLUSH_CHANGES = 10000
+FLUSH_INTERVAL = 600
+
+class DupesIndex:
+    # md5Checksum and size of every file in the drives of drive_list, with the folders giving their paths.
+    # Read from its JSON file on the first /dupes or change, and saved with the change token of each drive,
+    # so a drive whose token is behind the feed's is dropped and listed again.
+
+    def __init__(self, path='dupes_index.json'):
+        self.path = path
+        self.__lock = threading.Lock()
+        self.__build_lock = threading.Lock()
+        self.__drives = None
+        self.__pending = {}
+        self.__dirty = False
+        self.__changes = 0
+        self.__flushed_at = time.time()
+        self.__flush_lock = threading.Lock()
+
+    def __load(self):
+        # Called with __lock held
+        if self.__drives is not None:
+            return
+        drives = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    drives = json.load(f)
+            except ValueError:
+                LOGGER.error(f"Ignoring corrupt {self.path}")
+        for drive_id in list(drives):
+            if drives[drive_id].get('token') != change_feed.token(drive_id):
+                # Changes after the save were applied to the feed but not to this copy
+                del drives[drive_id]
+        self.__drives = drives
+
+    @staticmethod
+    def __add(drive, item):
+        parent = (item.get('parents') or [None])[0]
+        if item.get('mimeType') == FOLDER_MIME_TYPE:
+            drive['folders'][item['id']] = [item.get('name'), parent]
+        elif item.get('md5Checksum') is not None:
+            drive['files'][item['id']] = [item.get('name'), parent, int(item.get('size', 0)), item['md5Checksum']]
+
+    @staticmethod
+    def __apply(drive, change):
+        file_id = change.get('fileId')
+        drive['files'].pop(file_id, None)
+        drive['folders'].pop(file_id, None)
+        if not is_removed(change):
+            DupesIndex.__add(drive, change.get('file', {}))
+
+    def on_change(self, drive_id, change):
+        with self.__lock:
+            self.__load()
+            if drive_id in self.__pending:
+                # Replayed on the new listing once it is complete
+                self.__pending[drive_id].append(change)
+            if drive_id not in self.__drives:
+                return
+            if change is None:
+                del self.__drives[drive_id]
+            else:
+                self.__apply(self.__drives[drive_id], change)
+            self.__dirty = True
+            self.__changes += 1
+
+    def flush(self, force=False):
+        with self.__flush_lock:
+            with self.__lock:
+                if not self.__dirty:
+                    return
+                if not force and self.__changes < FLUSH_CHANGES and time.time() - self.__flushed_at < FLUSH_INTERVAL:
+                    return
+                self.__dirty = False
+                self.__changes = 0
+                self.__flushed_at = time.time()
+                # Entries are replaced rather than changed, so shallow copies are a consistent snapshot;
+                # tokens are only advanced after their changes were applied, so they are never ahead
+                drives = {drive_id: dict(drive, files=dict(drive['files']), folders=dict(drive['folders']),
+                                         token=change_feed.token(drive_id))
+                          for drive_id, drive in self.__drives.items()}
+            write_json(self.path, drives)
+
+    def build(self, gd, drive_ids, reuse=change_feed.follows):
+        # List every drive whose index reuse(drive_id) rejects and return {drive_id: error} of the failed ones
+        with self.__build_lock:
+            with self.__lock:
+                self.__load()
+                stale = [drive_id for drive_id in dict.fromkeys(drive_ids)
+                         if drive_id not in self.__drives or not reuse(drive_id)]
+                for drive_id in stale:
+                    self.__pending[drive_id] = []
+            fresh = {drive_id: {'built_at': time.time(), 'files': {}, 'folders': {}} for drive_id in stale}
+            errors = {}
+            try:
+                for drive_id, items, error in gd.list_drives(stale):
+                    if error is not None:
+                        LOGGER.error(f"Listing {drive_id} failed: {error}")
+                        errors[drive_id] = error
+                        continue
+                    for item in items:
+                        self.__add(fresh[drive_id], item)
+            finally:
+                with self.__lock:
+                    for drive_id in stale:
+                        pending = self.__pending.pop(drive_id)
+                        if drive_id in errors:
+                            continue
+                        if None in pending:
+                            # The change log was reset while listing, nothing is known to be current
+                            self.__drives.pop(drive_id, None)
+                            continue
+                        for change in pending:
+                            self.__apply(fresh[drive_id], change)
+                        self.__drives[drive_id] = fresh[drive_id]
+                    self.__dirty = True
+            self.flush(force=True)
+            return errors
+
+    def file_path(self, drive_id, file_id):
+        drive = self.__drives.get(drive_id, {'files': {}, 'folders': {}})
+        if file_id not in drive['files']:
+            # Removed since the duplicates were collected
+            return None
+        name, parent = drive['files'][file_id][:2]
+        parts = [name]
+        while parent in drive['folders'] and len(parts) < MAX_PATH_DEPTH:
+            name, parent = drive['folders'][parent]
+            parts.append(name)
+        return '/'.join(reversed(parts))
+
+    def duplicates(self, drive_ids, min_size=1):
+        # Return [(md5, size, [(drive_id, file_id), ...]), ...] of files stored more than once, most wasteful first
+        groups = {}
+        with self.__lock:
+            self.__load()
+            for drive_id in dict.fromkeys(drive_ids):
+                for file_id, (_, _, size, md5) in self.__drives.get(drive_id, {}).get('files', {}).items():
+                    if size >= min_size:
+                        groups.setdefault((md5, size), []).append((drive_id, file_id))
+        dupes = [(md5, size, files) for (md5, size), files in groups.items() if len(files) > 1]
+        dupes.sort(key=lambda group: group[1] * (len(group[2]) - 1), reverse=True)
+        return dupes
+
+    def report(self, dupes, names):
+        # Return the duplicate groups as text, names mapping drive ids to drive names
+        reclaimable = sum(size * (len(files) - 1) for _, size, files in dupes)
+        lines = [f"Duplicate groups: {len(dupes)}",
+                 f"Duplicate files: {sum(len(files) - 1 for _, _, files in dupes)}",
+                 f"Reclaimable: {get_readable_file_size(reclaimable)}"]
+        with self.__lock:
+            self.__load()
+            for md5, size, files in dupes:
+                lines.append('')
+                lines.append(f"{md5} | {get_readable_file_size(size)} x {len(files)} | "
+                             f"reclaimable {get_readable_file_size(size * (len(files) - 1))}")
+                for drive_id, file_id in files:
+                    path = self.file_path(drive_id, file_id)
+                    if path is not None:
+                        lines.append(f"  {names.get(drive_id, drive_id)}: {path}")
+        return '\n'.join(lines) + '\n'
+
+dupes_index = DupesIndex()
+change_feed.subscribe(dupes_index.on_change, dupes_index.flush)
+atexit.register(dupes_index.flush, force=True)
@@ -1,4 +1,3 @@
-import logging
 import os
 import json
 import re
@@ -11,62 +10,30 @@ import time
 from telegram import InlineKeyboardMarkup
 from telegraph.exceptions import RetryAfterError
 
-from queue import Queue
-from threading import Thread
 
-from httplib2 import Http
-from googleapiclient.http import HttpRequest
-from google_auth_httplib2 import AuthorizedHttp
-
-from google.auth.transport.requests import Request
-from google.oauth2 import service_account
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from tenacity import *
 
-from bot import LOGGER, DRIVE_NAME, DRIVE_ID, INDEX_URL, telegra_ph, \
-    IS_TEAM_DRIVE, parent_id, USE_SERVICE_ACCOUNTS, DRIVE_INDEX_URL, MAX_THREADS
+from bot import LOGGER, DRIVE_NAME, DRIVE_ID, INDEX_URL, get_telegraph_accounts, \
+    IS_TEAM_DRIVE, parent_id, USE_SERVICE_ACCOUNTS, DRIVE_INDEX_URL, DRIVE_MAX_ATTEMPTS, VERIFY_CLONE
+from bot.helper.drive_utils import async_drive
+from bot.helper.drive_utils.drive_cache import ancestor_cache, count_cache
+from bot.helper.drive_utils.rate_limiter import THROTTLE_REASONS, get_limiter, get_reason, should_retry
+from bot.helper.drive_utils.service_factory import G_DRIVE_TOKEN_FILE, get_credentials, get_service
+from bot.helper.ext_utils import metrics
 from bot.helper.ext_utils.bot_utils import *
+from bot.helper.ext_utils.clone_status import CloneStatus
+from bot.helper.ext_utils.executor import search_pool, telegraph_pool
 from bot.helper.telegram_helper import button_builder
 
-logging.getLogger('googleapiclient.discovery').setLevel(logging.ERROR)
-
 if USE_SERVICE_ACCOUNTS:
     SERVICE_ACCOUNT_INDEX = randrange(len(os.listdir("accounts")))
 
 telegraph_limit = 95
 
-class ThreadWorker(Thread):
-
-    def __init__(self, queue, function, callback=None):
-        Thread.__init__(self)
-        self.queue = queue
-        self.function = function
-        self.callback = callback
-
-    def run(self):
-        while True:
-            index, arg = self.queue.get()
-            result = exception = None
-
-            try:
-                result = self.function(*arg)
-            except Exception as e:
-                exception = e
-            finally:
-                if self.callback is not None:
-                    self.callback(index, result, exception)
-                self.queue.task_done()
-
-
 class GoogleDriveHelper:
     def __init__(self, name=None, listener=None):
         self.listener = listener
         self.name = name
-        self.__G_DRIVE_TOKEN_FILE = "token.json"
-        # Check https://developers.google.com/drive/scopes for all available scopes
-        self.__OAUTH_SCOPE = ['https://www.googleapis.com/auth/drive']
         self.__G_DRIVE_DIR_MIME_TYPE = "application/vnd.google-apps.folder"
         self.__G_DRIVE_BASE_DOWNLOAD_URL = "https://drive.google.com/uc?id={}&export=download"
         self.__G_DRIVE_DIR_BASE_DOWNLOAD_URL = "https://drive.google.com/drive/folders/{}"
@@ -78,47 +45,28 @@ class GoogleDriveHelper:
         self.total_folders = 0
         self.transferred_size = 0
         self.alt_auth = False
+        self.dest_id = None
         self.responses = {}
         self.dir_list = {}
+        self.search_timings = {}
 
     def authorize(self):
-        # Get credentials
-        credentials = None
-        if not USE_SERVICE_ACCOUNTS:
-            if os.path.exists(self.__G_DRIVE_TOKEN_FILE):
-                credentials = Credentials.from_authorized_user_file(self.__G_DRIVE_TOKEN_FILE, self.__OAUTH_SCOPE)
-            if credentials is None or not credentials.valid:
-                if credentials and credentials.expired and credentials.refresh_token:
-                    credentials.refresh(Request())
-        else:
-            LOGGER.info(f"Authorizing with {SERVICE_ACCOUNT_INDEX}.json file")
-            credentials = service_account.Credentials.from_service_account_file(
-                f'accounts/{SERVICE_ACCOUNT_INDEX}.json', scopes=self.__OAUTH_SCOPE)
-
-        self.credentials = credentials
-        authorized_http = AuthorizedHttp(credentials, http=Http())
-        return build('drive', 'v3', cache_discovery=False, requestBuilder=self.build_request, http=authorized_http)
+        # Credentials and services are cached per account by the service factory
+        account = SERVICE_ACCOUNT_INDEX if USE_SERVICE_ACCOUNTS else None
+        if account is not None:
+            LOGGER.debug(f"Authorizing with {account}.json file")
+        self.credentials = get_credentials(account)
+        return get_service(account)
 
     def alt_authorize(self):
-        credentials = None
         if USE_SERVICE_ACCOUNTS and not self.alt_auth:
             self.alt_auth = True
-            if os.path.exists(self.__G_DRIVE_TOKEN_FILE):
+            if os.path.exists(G_DRIVE_TOKEN_FILE):
                 LOGGER.info("Authorizing with token.json file")
-                credentials = Credentials.from_authorized_user_file(self.__G_DRIVE_TOKEN_FILE, self.__OAUTH_SCOPE)
-                if credentials is None or not credentials.valid:
-                    if credentials and credentials.expired and credentials.refresh_token:
-                        credentials.refresh(Request())
-
-                self.credentials = credentials
-                authorized_http = AuthorizedHttp(credentials, http=Http())
-                return build('drive', 'v3', cache_discovery=False, requestBuilder=self.build_request, http=authorized_http)
+                self.credentials = get_credentials()
+                return get_service()
         return None
 
-    def build_request(self, http, *args, **kwargs):
-        new_http = AuthorizedHttp(self.credentials, http=Http())
-        return HttpRequest(new_http, *args, **kwargs)
-
     @staticmethod
     def getIdFromUrl(link: str):
         if "folders" in link or "file" in link:
@@ -139,9 +87,10 @@ class GoogleDriveHelper:
             return msg
         msg = ''
         try:
-            res = self.__service.files().delete(fileId=file_id, supportsTeamDrives=IS_TEAM_DRIVE).execute()
+            # Deleting a folder deletes everything below it in the same request
+            res = self.__service.files().delete(fileId=file_id, supportsAllDrives=True).execute()
             msg = "Successfully deleted"
-        except HttpError as err:
+        except (HttpError, async_drive.AsyncDriveError) as err:
             if "File not found" in str(err):
                 msg = "No such file exists"
             elif "insufficientFilePermissions" in str(err):
@@ -163,9 +112,10 @@ class GoogleDriveHelper:
             SERVICE_ACCOUNT_INDEX = 0
         SERVICE_ACCOUNT_INDEX += 1
         LOGGER.info(f"Authorizing with {SERVICE_ACCOUNT_INDEX}.json file")
+        metrics.ACCOUNT_SWITCHES.inc()
         self.__service = self.authorize()
 
-    def __set_permission(self, drive_id):
+    def __permission_request(self, drive_id):
         permissions = {
             'role': 'reader',
             'type': 'anyone',
@@ -173,9 +123,141 @@ class GoogleDriveHelper:
             'withLink': True
         }
         return self.__service.permissions().create(supportsTeamDrives=True, fileId=drive_id,
-                                                   body=permissions).execute()
+                                                   body=permissions)
 
-    def setPerm(self, link: str):
+    def __set_permission(self, drive_id):
+        return self.__permission_request(drive_id).execute()
+
+    def __execute_batch(self, requests):
+        # Send requests in Drive batch calls of 100, retrying the throttled ones and server errors.
+        # Returns the responses of the requests that succeeded and the exceptions of the others by index
+        limiter = get_limiter(self.credentials)
+        responses = {}
+        failed = {}
+        pending = list(range(len(requests)))
+        for attempt in range(1, DRIVE_MAX_ATTEMPTS + 1):
+            retry = []
+            throttled = []
+
+            def on_error(index, exception):
+                failed[index] = exception
+                if not isinstance(exception, HttpError):
+                    # Transport error, the request may not even have reached Drive
+                    retry.append(index)
+                    return
+                status = exception.resp.status
+                reason = get_reason(exception)
+                if status == 429 or reason in THROTTLE_REASONS:
+                    throttled.append(index)
+                    retry.append(index)
+                elif should_retry(status, reason):
+                    retry.append(index)
+
+            def callback(request_id, response, exception):
+                index = int(request_id)
+                method = requests[index].methodId.replace('drive.', '', 1)
+                if exception is None:
+                    metrics.DRIVE_REQUESTS.inc(method, 200)
+                    responses[index] = response
+                    return
+                metrics.DRIVE_REQUESTS.inc(method, exception.resp.status if isinstance(exception, HttpError) else 'error')
+                on_error(index, exception)
+
+            for i in range(0, len(pending), 100):
+                chunk = pending[i: i + 100]
+                batch = self.__service.new_batch_http_request(callback=callback)
+                for index in chunk:
+                    batch.add(requests[index], request_id=str(index))
+                limiter.acquire(len(chunk))
+                try:
+                    with metrics.DRIVE_LATENCY.time('batch'):
+                        batch.execute()
+                except (HttpError, OSError) as e:
+                    # The batch call itself failed, so did every request it had not answered
+                    for index in chunk:
+                        if index not in responses and index not in failed:
+                            on_error(index, e)
+            if len(retry) == 0 or attempt == DRIVE_MAX_ATTEMPTS:
+                break
+            if throttled:
+                limiter.on_throttle()
+            else:
+                time.sleep(min(2 ** attempt, 30))
+            for index in retry:
+                del failed[index]
+            pending = sorted(retry)
+        return responses, failed
+
+    def __drive_files_request(self, drive_id, page_token, fields):
+        if drive_id == "root":
+            return self.__service.files().list(q="'me' in owners and trashed = false",
+                                               spaces='drive',
+                                               pageSize=1000,
+                                               pageToken=page_token,
+                                               fields=fields)
+        return self.__service.files().list(supportsAllDrives=True,
+                                           includeItemsFromAllDrives=True,
+                                           driveId=drive_id,
+                                           corpora='drive',
+                                           q="trashed = false",
+                                           pageSize=1000,
+                                           pageToken=page_token,
+                                           fields=fields)
+
+    def list_drives(self, drive_ids, fields='nextPageToken, files(id, name, mimeType, size, md5Checksum, parents)'):
+        """Yield (drive_id, items, error) for every page of every item in the drives.
+
+        The next page of all drives still being listed is fetched in one batch
+        call, so a round costs one request per 100 drives. A drive whose page
+        fails is reported once with its error and not listed further.
+        """
+        tokens = {drive_id: None for drive_id in dict.fromkeys(drive_ids)}
+        while tokens:
+            order = list(tokens)
+            responses, failed = self.__execute_batch([self.__drive_files_request(drive_id, tokens[drive_id], fields)
+                                                      for drive_id in order])
+            for index, drive_id in enumerate(order):
+                if index in failed:
+                    del tokens[drive_id]
+                    yield drive_id, [], failed[index]
+                    continue
+                response = responses[index]
+                if response.get('nextPageToken') is None:
+                    del tokens[drive_id]
+                else:
+                    tokens[drive_id] = response['nextPageToken']
+                yield drive_id, response.get('files', []), None
+
+    def __walk_tree(self, folder_id):
+        """Return the files and the folders (grouped by depth) below folder_id."""
+        client = async_drive.get_client(self.credentials)
+        tree = async_drive.run_coroutine(client.walk(folder_id))
+        depth = {folder_id: 0}
+        files = []
+        folders = []
+        for fid, children in tree:
+            for child in children:
+                if child.get('mimeType') == self.__G_DRIVE_DIR_MIME_TYPE:
+                    depth[child.get('id')] = depth[fid] + 1
+                    if len(folders) < depth[fid] + 1:
+                        folders.append([])
+                    folders[depth[fid]].append(child.get('id'))
+                else:
+                    files.append(child.get('id'))
+        return files, folders
+
+    def __set_permission_tree(self, folder_id):
+        files, folders = self.__walk_tree(folder_id)
+        ids = [folder_id] + [fid for level in folders for fid in level] + files
+        _, failed = self.__execute_batch([self.__permission_request(fid) for fid in ids])
+        for exception in failed.values():
+            LOGGER.error(exception)
+        msg = f"Successfully set permissions on {len(ids) - len(failed)} items"
+        if failed:
+            msg += f"\nFailed on {len(failed)} items"
+        return msg
+
+    def setPerm(self, link: str, recursive=False):
         try:
             file_id = self.getIdFromUrl(link)
         except (KeyError, IndexError):
@@ -184,9 +266,12 @@ class GoogleDriveHelper:
             return msg
         msg = ''
         try:
-            res = self.__set_permission(file_id)
-            msg = "Successfully set permissions"
-        except HttpError as err:
+            if recursive:
+                msg = self.__set_permission_tree(file_id)
+            else:
+                res = self.__set_permission(file_id)
+                msg = "Successfully set permissions"
+        except (HttpError, async_drive.AsyncDriveError) as err:
             if "File not found" in str(err):
                 msg = "No such file exists"
             elif "insufficientFilePermissions" in str(err):
@@ -194,15 +279,13 @@ class GoogleDriveHelper:
                 token_service = self.alt_authorize()
                 if token_service is not None:
                     self.__service = token_service
-                    return self.setPerm(link)
+                    return self.setPerm(link, recursive)
             else:
                 msg = str(err)
             LOGGER.error(f"{msg}")
         finally:
             return msg
 
-    @retry(wait=wait_exponential(multiplier=2, min=3, max=6), stop=stop_after_attempt(5),
-           retry=retry_if_exception_type(HttpError), before=before_log(LOGGER, logging.DEBUG))
     def copyFile(self, file_id, dest_id, status):
         body = {
             'parents': [dest_id]
@@ -223,34 +306,22 @@ class GoogleDriveHelper:
                 else:
                     raise err
 
-    @retry(wait=wait_exponential(multiplier=2, min=3, max=6), stop=stop_after_attempt(5),
-           retry=retry_if_exception_type(HttpError), before=before_log(LOGGER, logging.DEBUG))
     def getFileMetadata(self, file_id):
         return self.__service.files().get(supportsAllDrives=True, fileId=file_id,
-                                              fields="name, id, mimeType, size").execute()
+                                              fields="name, id, mimeType, size, md5Checksum, driveId, "
+                                                     "parents, modifiedTime").execute()
 
-    @retry(wait=wait_exponential(multiplier=2, min=3, max=6), stop=stop_after_attempt(5),
-           retry=retry_if_exception_type(HttpError), before=before_log(LOGGER, logging.DEBUG))
-    def getFilesByFolderId(self, folder_id):
-        page_token = None
-        query = f"'{folder_id}' in parents and trashed = false"
-        files = []
-        while True:
-            response = self.__service.files().list(supportsTeamDrives=True,
-                                                   includeTeamDriveItems=True,
-                                                   q=query,
-                                                   spaces='drive',
-                                                   pageSize=200,
-                                                   fields='nextPageToken, files(id, name, mimeType, size)',
-                                                   pageToken=page_token).execute()
-            for file in response.get('files', []):
-                files.append(file)
-            page_token = response.get('nextPageToken', None)
-            if page_token is None:
-                break
-        return files
+    def checkExists(self, file_id):
+        try:
+            meta = self.__service.files().get(supportsAllDrives=True, fileId=file_id,
+                                              fields="id, trashed").execute()
+            return not meta.get('trashed', False)
+        except HttpError as err:
+            LOGGER.error(err)
+            return False
 
-    def clone(self, link, status):
+    def clone(self, link, status, repair=False):
+        self.dest_id = None
         self.transferred_size = 0
         self.total_files = 0
         self.total_folders = 0
@@ -266,8 +337,12 @@ class GoogleDriveHelper:
             status.set_source_folder(meta.get('name'), self.__G_DRIVE_DIR_BASE_DOWNLOAD_URL.format(meta.get('id')))
             if meta.get("mimeType") == self.__G_DRIVE_DIR_MIME_TYPE:
                 dir_id = self.create_directory(meta.get('name'), parent_id)
+                if not IS_TEAM_DRIVE:
+                    # Subfolders inherit the link sharing of the root folder
+                    self.__set_permission(dir_id)
                 self.cloneFolder(meta.get('name'), meta.get('name'), meta.get('id'), dir_id, status)
                 status.set_status(True)
+                self.dest_id = dir_id
                 msg += f'<b>Filename: </b><code>{meta.get("name")}</code>'
                 msg += f'\n<b>Size: </b>{get_readable_file_size(self.transferred_size)}'
                 msg += f"\n<b>Type: </b>Folder"
@@ -277,8 +352,16 @@ class GoogleDriveHelper:
                 if DRIVE_INDEX_URL is not None:
                     url = requests.utils.requote_uri(f'{DRIVE_INDEX_URL}/{meta.get("name")}/')
                     msg += f' | <a href="{url}">Index Link</a>'
+                if VERIFY_CLONE is not None:
+                    try:
+                        msg += '\n\n' + self.verify_tree(meta.get('id'), dir_id,
+                                                         VERIFY_CLONE == 'fix' and repair, status)
+                    except Exception as err:
+                        LOGGER.error(f"Verifying {meta.get('name')} failed: {err}")
+                        msg += '\n\n<b>Verification failed</b>'
             else:
                 file = self.copyFile(meta.get('id'), parent_id, status)
+                self.dest_id = file.get('id')
                 try:
                     typ = file.get('mimeType')
                 except:
@@ -294,9 +377,6 @@ class GoogleDriveHelper:
                     url = requests.utils.requote_uri(f'{DRIVE_INDEX_URL}/{file.get("name")}')
                     msg += f' | <a href="{url}">Index Link</a>'
         except Exception as err:
-            if isinstance(err, RetryError):
-                LOGGER.info(f"Total attempts: {err.last_attempt.attempt_number}")
-                err = err.last_attempt.exception()
             err = str(err).replace('>', '').replace('<', '')
             LOGGER.error(err)
             if "User rate limit exceeded" in str(err):
@@ -305,7 +385,7 @@ class GoogleDriveHelper:
                 token_service = self.alt_authorize()
                 if token_service is not None:
                     self.__service = token_service
-                    return self.clone(link, status)
+                    return self.clone(link, status, repair)
                 msg = "No such file exists"
             else:
                 msg = str(err)
@@ -313,36 +393,189 @@ class GoogleDriveHelper:
         return msg
 
     def cloneFolder(self, name, local_path, folder_id, parent_id, status):
-        LOGGER.info(f"Syncing: {local_path}")
-        files = self.getFilesByFolderId(folder_id)
-        if len(files) == 0:
-            return parent_id
-        for file in files:
-            if file.get('mimeType') == self.__G_DRIVE_DIR_MIME_TYPE:
-                self.total_folders += 1
-                file_path = os.path.join(local_path, file.get('name'))
-                current_dir_id = self.create_directory(file.get('name'), parent_id)
-                self.cloneFolder(file.get('name'), file_path, file.get('id'), current_dir_id, status)
+        # Walk the source one tree level at a time: list every folder of the level
+        # concurrently, copy its files and create all subfolders of the next level
+        # through batch requests, whose ids become the parents of the next copies.
+        level = [(folder_id, parent_id, local_path)]
+        while level:
+            # copyFile may have switched to another service account
+            client = async_drive.get_client(self.credentials)
+            listings = async_drive.run_coroutine(client.list_children_many([source for source, _, _ in level]))
+            folders = []
+            for (source_id, dest_id, path), files in zip(level, listings):
+                LOGGER.info(f"Syncing: {path}")
+                for file in files:
+                    if file.get('mimeType') == self.__G_DRIVE_DIR_MIME_TYPE:
+                        self.total_folders += 1
+                        folders.append((file, dest_id, os.path.join(path, file.get('name'))))
+                    else:
+                        self.copyFile(file.get('id'), dest_id, status)
+                        self.total_files += 1
+                        self.transferred_size += int(file.get('size', 0))
+                        status.set_name(file.get('name'))
+                        status.add_size(int(file.get('size', 0)))
+            dir_ids = self.create_directories([(file.get('name'), dest_id) for file, dest_id, _ in folders])
+            level = [(file.get('id'), dir_id, path) for (file, _, path), dir_id in zip(folders, dir_ids)]
+
+    def __same_item(self, source, dest):
+        if source.get('mimeType') != dest.get('mimeType'):
+            return False
+        if source.get('size') != dest.get('size'):
+            return False
+        return source.get('md5Checksum') is None or source.get('md5Checksum') == dest.get('md5Checksum')
+
+    def compare_trees(self, source_id, dest_id):
+        """List both trees at once and return (source, dest, missing, mismatched, extra).
+
+        source and dest map relative paths to items, missing holds (path, item) of source
+        items with no copy, mismatched (path, item, copy) of copies whose size or md5Checksum
+        differ and extra (path, copy) of destination items with no source.
+        """
+        client = async_drive.get_client(self.credentials)
+        source, dest = async_drive.run_coroutine(client.list_trees([source_id, dest_id]))
+        missing = []
+        mismatched = []
+        extra = []
+        for path, items in source.items():
+            copies = list(dest.get(path, []))
+            for item in items:
+                copy = next((c for c in copies if self.__same_item(item, c)), None)
+                if copy is None:
+                    copy = next((c for c in copies if c.get('mimeType') == item.get('mimeType')), None)
+                    if copy is None:
+                        missing.append((path, item))
+                        continue
+                    mismatched.append((path, item, copy))
+                copies.remove(copy)
+            extra.extend((path, copy) for copy in copies)
+        extra.extend((path, copy) for path, copies in dest.items() if path not in source for copy in copies)
+        return source, dest, missing, mismatched, extra
+
+    def __repair(self, dest_id, dest, missing, mismatched, status):
+        """Re-copy missing and mismatched items into the destination tree.
+
+        Returns the number of files copied and the paths that could not be, as
+        a folder above them could not be created. Replaced copies are trashed.
+        """
+        folders = {'': dest_id}
+        for path, copies in dest.items():
+            if copies[0].get('mimeType') == self.__G_DRIVE_DIR_MIME_TYPE:
+                folders[path] = copies[0].get('id')
+        missing_folders = {}
+        missing_files = []
+        for path, item in missing:
+            if item.get('mimeType') == self.__G_DRIVE_DIR_MIME_TYPE:
+                missing_folders.setdefault(path.count('/'), []).append((path, item))
             else:
-                self.copyFile(file.get('id'), parent_id, status)
-                self.total_files += 1
-                self.transferred_size += int(file.get('size', 0))
-                status.set_name(file.get('name'))
-                status.add_size(int(file.get('size')))
+                missing_files.append((path, item))
+        # Missing folders are created a depth at a time, as their parents may be missing too
+        for depth in sorted(missing_folders):
+            level = [(path, item) for path, item in missing_folders[depth] if path.rpartition('/')[0] in folders]
+            dir_ids = self.create_directories([(item.get('name'), folders[path.rpartition('/')[0]])
+                                               for path, item in level])
+            for (path, _), dir_id in zip(level, dir_ids):
+                folders[path] = dir_id
+        copied = 0
+        skipped = [path for level in missing_folders.values() for path, _ in level if path not in folders]
+        for path, item, copy in [(path, item, None) for path, item in missing_files] + mismatched:
+            parent = folders.get(path.rpartition('/')[0])
+            if parent is None:
+                skipped.append(path)
+                continue
+            status.set_name(item.get('name'))
+            self.copyFile(item.get('id'), parent, status)
+            status.add_size(int(item.get('size', 0)))
+            copied += 1
+            if copy is not None:
+                LOGGER.info(f"Replacing: {path}")
+                self.__service.files().update(fileId=copy.get('id'), body={'trashed': True},
+                                              supportsAllDrives=True).execute()
+        return copied, skipped
+
+    def verify_tree(self, source_id, dest_id, fix=False, status=None, limit=20):
+        """Compare a folder with its copy and return the report, re-copying what differs when fix is set."""
+        source, dest, missing, mismatched, extra = self.compare_trees(source_id, dest_id)
+        msg = f'<b>Source items: </b>{sum(len(items) for items in source.values())}'
+        msg += f' | <b>Destination items: </b>{sum(len(items) for items in dest.values())}'
+        msg += f'\n<b>Missing: </b>{len(missing)}'
+        msg += f'\n<b>Mismatched: </b>{len(mismatched)}'
+        msg += f'\n<b>Extra: </b>{len(extra)}'
+        problems = [f'Missing: {path}' for path, _ in missing] + \
+                   [f'Mismatched: {path}' for path, _, _ in mismatched]
+        if len(problems) > 0:
+            msg += '\n\n' + '\n'.join(f'<code>{problem}</code>' for problem in problems[:limit])
+            if len(problems) > limit:
+                msg += f'\n<i>and {len(problems) - limit} more</i>'
+            if fix:
+                copied, skipped = self.__repair(dest_id, dest, missing, mismatched, status or CloneStatus())
+                msg += f'\n\n<b>Re-copied: </b>{copied} files'
+                if len(skipped) > 0:
+                    msg += f'\n<b>Not re-copied: </b>{len(skipped)}, their folder could not be created'
+                    msg += '\n' + '\n'.join(f'<code>{path}</code>' for path in skipped[:limit])
+                    if len(skipped) > limit:
+                        msg += f'\n<i>and {len(skipped) - limit} more</i>'
+        else:
+            msg += '\n\n<b>Verified: </b>every item matches'
+        return msg
 
-    @retry(wait=wait_exponential(multiplier=2, min=3, max=6), stop=stop_after_attempt(5),
-           retry=retry_if_exception_type(HttpError), before=before_log(LOGGER, logging.DEBUG))
-    def create_directory(self, directory_name, parent_id):
+    def verify(self, link, dest_link, fix=False):
+        try:
+            source_id = self.getIdFromUrl(link)
+            dest_id = self.getIdFromUrl(dest_link)
+        except (KeyError, IndexError):
+            msg = "Drive ID not found"
+            LOGGER.error(f"{msg}")
+            return msg
+        try:
+            source = self.getFileMetadata(source_id)
+            dest = self.getFileMetadata(dest_id)
+            msg = f'<b>Name: </b><code>{source.get("name")}</code>\n'
+            if source.get('mimeType') == dest.get('mimeType') == self.__G_DRIVE_DIR_MIME_TYPE:
+                return msg + self.verify_tree(source_id, dest_id, fix)
+            if source.get('mimeType') == self.__G_DRIVE_DIR_MIME_TYPE or \
+                    dest.get('mimeType') == self.__G_DRIVE_DIR_MIME_TYPE:
+                return msg + 'Compare a folder with a folder or a file with a file'
+            if self.__same_item(source, dest):
+                return msg + '<b>Verified: </b>the files match'
+            return msg + '<b>Mismatched: </b>size or md5Checksum differ'
+        except Exception as err:
+            err = str(err).replace('>', '').replace('<', '')
+            LOGGER.error(err)
+            if "File not found" in str(err):
+                msg = "No such file exists"
+            else:
+                msg = str(err)
+            LOGGER.error(f"{msg}")
+            return msg
+
+    def __directory_request(self, directory_name, parent_id):
         file_metadata = {
             "name": directory_name,
             "mimeType": self.__G_DRIVE_DIR_MIME_TYPE
         }
         if parent_id is not None:
             file_metadata["parents"] = [parent_id]
-        file = self.__service.files().create(supportsTeamDrives=True, body=file_metadata).execute()
+        return self.__service.files().create(supportsTeamDrives=True, body=file_metadata)
+
+    def create_directories(self, directories):
+        """Create (name, parent_id) folders through batch requests and return their ids in order."""
+        if len(directories) == 0:
+            return []
+        responses, failed = self.__execute_batch(
+            [self.__directory_request(name, parent) for name, parent in directories])
+        dir_ids = []
+        for index, (name, parent) in enumerate(directories):
+            if index in failed:
+                LOGGER.error(failed[index])
+                dir_ids.append(self.create_directory(name, parent))
+            else:
+                LOGGER.info(f"Created: {name}")
+                dir_ids.append(responses[index].get("id"))
+        return dir_ids
+
+    def create_directory(self, directory_name, parent_id):
+        file = self.__directory_request(directory_name, parent_id).execute()
         file_id = file.get("id")
-        if not IS_TEAM_DRIVE:
-            self.__set_permission(file_id)
         LOGGER.info("Created: {}".format(file.get("name")))
         return file_id
 
@@ -358,7 +591,14 @@ class GoogleDriveHelper:
             meta = self.getFileMetadata(file_id)
             mime_type = meta.get('mimeType')
             if mime_type == self.__G_DRIVE_DIR_MIME_TYPE:
-                self.gDrive_directory(meta)
+                client = async_drive.get_client(self.credentials)
+                if count_cache.enabled:
+                    files, folders, size = async_drive.run_coroutine(count_cache.count(client, meta))
+                else:
+                    files, folders, size = async_drive.run_coroutine(client.count(meta.get('id')))
+                self.total_files += files
+                self.total_folders += folders
+                self.total_bytes += size
                 msg += f'<b>Name: </b><code>{meta.get("name")}</code>'
                 msg += f'\n<b>Size: </b>{get_readable_file_size(self.total_bytes)}'
                 msg += f'\n<b>Type: </b>Folder'
@@ -374,9 +614,6 @@ class GoogleDriveHelper:
                 msg += f'\n<b>Type: </b>{mime_type}'
                 msg += f'\n<b>Files: </b>{self.total_files}'
         except Exception as err:
-            if isinstance(err, RetryError):
-                LOGGER.info(f"Total attempts: {err.last_attempt.attempt_number}")
-                err = err.last_attempt.exception()
             err = str(err).replace('>', '').replace('<', '')
             LOGGER.error(err)
             if "File not found" in str(err):
@@ -394,40 +631,28 @@ class GoogleDriveHelper:
         size = int(filee.get('size', 0))
         self.total_bytes += size
 
-    def gDrive_directory(self, drive_folder):
-        files = self.getFilesByFolderId(drive_folder['id'])
-        if len(files) == 0:
-            return
-        for filee in files:
-            shortcut_details = filee.get('shortcutDetails')
-            if shortcut_details is not None:
-                mime_type = shortcut_details['targetMimeType']
-                file_id = shortcut_details['targetId']
-                filee = self.getFileMetadata(file_id)
-            else:
-                mime_type = filee.get('mimeType')
-            if mime_type == self.__G_DRIVE_DIR_MIME_TYPE:
-                self.total_folders += 1
-                self.gDrive_directory(filee)
-            else:
-                self.total_files += 1
-                self.gDrive_file(filee)
+    def __get_ancestor(self, file_id):
+        file = ancestor_cache.get(file_id)
+        if file is None:
+            file = self.__service.files().get(
+                fileId=file_id,
+                supportsAllDrives=True,
+                fields='id, name, parents, driveId'
+            ).execute()
+            ancestor_cache.set(file_id, file)
+        return file
 
     def get_recursive_list(self, file, root_id="root"):
         return_list = []
         if not root_id:
             root_id = file.get('teamDriveId')
         if root_id == "root":
-            root_id = self.__service.files().get(fileId='root', fields="id").execute().get('id')
+            root_id = self.__get_ancestor('root').get('id')
         x = file.get("name")
         y = file.get("id")
         while y != root_id:
             return_list.append(x)
-            file = self.__service.files().get(
-                fileId = file.get("parents")[0],
-                supportsAllDrives=True,
-                fields='id, name, parents'
-            ).execute()
+            file = self.__get_ancestor(file.get("parents")[0])
             x = file.get("name")
             y = file.get("id")
         return_list.reverse()
@@ -470,6 +695,8 @@ class GoogleDriveHelper:
 
 
     def batch_response_callback(self, request_id, response, exception):
+        metrics.DRIVE_REQUESTS.inc('files.list', 200 if exception is None else
+                                   getattr(getattr(exception, 'resp', None), 'status', 'error'))
         if exception is not None:
             LOGGER.exception(f"Failed to call the drive api")
             LOGGER.exception(exception)
@@ -480,12 +707,12 @@ class GoogleDriveHelper:
         self.responses[int(request_id)] = response
 
 
-    def recursive_list_callback(self, index, result, exception):
-        if exception is not None:
-            LOGGER.exception(f"Failed to get recursive drive dir list")
-            LOGGER.exception(exception)
-        else:
-            self.dir_list[result[0]][index] = result[1]
+    def __execute_search_batch(self, queued):
+        get_limiter(self.credentials).acquire(queued)
+        with metrics.DRIVE_LATENCY.time('batch'):
+            self.__batch.execute()
+        # An executed batch keeps its requests, so the next ones go in a new one
+        self.__batch = self.__service.new_batch_http_request(callback=self.batch_response_callback)
 
     def drive_list(self, file_name):
 
@@ -514,35 +741,43 @@ class GoogleDriveHelper:
         query += "trashed=false"
 
         index = 0
-        start_time = time.time()
+        start_time = phase_time = time.time()
         self.file_name = file_name
+        self.search_timings = {}
 
+        queued = 0
         for parent_id in DRIVE_ID:
             self.responses[index] = None
             self.drive_query(str(index), parent_id, query)
-            if index + 1 % 100 == 0:
-                self.__batch.execute()
             index += 1
-        if index + 1 % 100 != 0:
-            self.__batch.execute()
-
-        THREADS = 0
-        queue = Queue()
-        for index, response in self.responses.items():
-            if INDEX_URL[index] is not None:
-                self.dir_list[DRIVE_ID[index]] = {}
-                if response:
-                    count = -1
-                    for file in response:
-                        count += 1
-                        if THREADS < MAX_THREADS:
-                            worker = ThreadWorker(queue, function=self.get_recursive_list, callback=self.recursive_list_callback)
-                            worker.start()
-                            THREADS += 1
-                        queue.put((count, (file, DRIVE_ID[index])))
-
-        #wait until all threading processes are finished
-        queue.join()
+            queued += 1
+            if queued == 100:
+                self.__execute_search_batch(queued)
+                queued = 0
+        if queued > 0:
+            self.__execute_search_batch(queued)
+        phase_time = self.__search_phase('query', phase_time)
+
+        # Resolve the folder path of every result on the shared search pool; the
+        # paths still queued are cancelled if the search fails half way
+        jobs = {}
+        try:
+            for index, response in self.responses.items():
+                if INDEX_URL[index] is not None:
+                    self.dir_list[DRIVE_ID[index]] = {}
+                    for count, file in enumerate(response or []):
+                        jobs[(DRIVE_ID[index], count)] = (file, search_pool.submit(self.get_recursive_list, file,
+                                                                                   DRIVE_ID[index]))
+            for (drive_id, count), (file, job) in jobs.items():
+                try:
+                    self.dir_list[drive_id][count] = job.result()[1]
+                except Exception as e:
+                    LOGGER.error(f"Failed to get recursive drive dir list: {e}")
+                    self.dir_list[drive_id][count] = [file.get('name')]
+        finally:
+            for _, job in jobs.values():
+                job.cancel()
+        phase_time = self.__search_phase('paths', phase_time)
 
         msg = ''
         content_count = 0
@@ -589,37 +824,36 @@ class GoogleDriveHelper:
 
         if msg != '':
             self.telegraph_content.append(msg)
-
-        msg = f"Found {content_count} results in {round(time.time() - start_time, 2)}s"
-
+        phase_time = self.__search_phase('render', phase_time)
 
         total_pages = len(self.telegraph_content)
         if total_pages == 0:
+            self.__log_search_timings(file_name, content_count, start_time)
             return "Found nothing", None
 
-        acc_no=-1
-        tg_pg_acc = len(telegra_ph)
+        telegra_ph = get_telegraph_accounts()
         page_per_acc = 3
-        for i in range(total_pages):
-
-            if i % page_per_acc == 0:
-                acc_no = (acc_no+1) % tg_pg_acc
-
-            ## Add prev page link
-            if i != 0:
-                self.telegraph_content[i] +=  f'<b><a href="https://telegra.ph/{self.path[i-1]}">Prev</a> | Page {i+1}/{total_pages}</b>'
-            else:
-                self.telegraph_content[i] += f'<b>Page {i+1}/{total_pages}</b>'
-
-            self.create_page( telegra_ph[acc_no] , self.telegraph_content[i] )
-
-            if i != 0:
-                ## Edit prev page to add next page link
-                self.telegraph_content[i-1] += f'<b> | <a href="https://telegra.ph/{self.path[i]}">Next</a></b>'
-                self.edit_page( telegra_ph[ (acc_no - 1) if i % page_per_acc == 0 else acc_no ],
-                           self.telegraph_content[i-1],
-                           self.path[i-1])
-
+        # A page can only be edited by the account that created it
+        accounts = [telegra_ph[(i // page_per_acc) % len(telegra_ph)] for i in range(total_pages)]
+        # Pages are created in parallel, then edited in parallel to link them
+        # together once every path is known
+        self.path = list(telegraph_pool.map(
+            lambda i: self.create_page(accounts[i], self.telegraph_content[i] + f'<b>Page {i+1}/{total_pages}</b>'),
+            range(total_pages)))
+        if total_pages > 1:
+            for i in range(total_pages):
+                nav = f'Page {i+1}/{total_pages}'
+                if i != 0:
+                    nav = f'<a href="https://telegra.ph/{self.path[i-1]}">Prev</a> | {nav}'
+                if i != total_pages - 1:
+                    nav += f' | <a href="https://telegra.ph/{self.path[i+1]}">Next</a>'
+                self.telegraph_content[i] += f'<b>{nav}</b>'
+            list(telegraph_pool.map(lambda i: self.edit_page(accounts[i], self.telegraph_content[i], self.path[i]),
+                                    range(total_pages)))
+        self.__search_phase('telegraph', phase_time)
+        self.__log_search_timings(file_name, content_count, start_time)
+
+        msg = f"Found {content_count} results in {self.search_timings['total']}s"
 
         buttons = button_builder.ButtonMaker()
         buttons.build_button("VIEW HERE", f"https://telegra.ph/{self.path[0]}")
@@ -627,26 +861,43 @@ class GoogleDriveHelper:
         return msg, InlineKeyboardMarkup(buttons.build_menu(1))
 
 
+    def __search_phase(self, phase, start):
+        now = time.time()
+        self.search_timings[phase] = round(now - start, 3)
+        metrics.SEARCH_PHASE_LATENCY.observe(now - start, phase)
+        return now
+
+    def __log_search_timings(self, query, results, start):
+        self.search_timings['total'] = round(time.time() - start, 2)
+        LOGGER.info(json.dumps({'event': 'search', 'query': query, 'results': results,
+                                'pages': len(self.telegraph_content), 'timings': self.search_timings}))
+
     def create_page(self, acc, content):
         try:
-            self.path.append(
-                acc.create_page(title='SearchX',
-                                author_name='XXX',
-                                author_url='https://github.com/hsj51/SearchX',
-                                html_content=content)['path'])
+            with metrics.TELEGRAPH_LATENCY.time('create_page'):
+                path = acc.create_page(title='SearchX',
+                                       author_name='XXX',
+                                       author_url='https://github.com/hsj51/SearchX',
+                                       html_content=content)['path']
+            metrics.TELEGRAPH_REQUESTS.inc('create_page', 'ok')
+            return path
         except RetryAfterError as e:
+            metrics.TELEGRAPH_REQUESTS.inc('create_page', 'flood_wait')
             LOGGER.info(f"Telegra.ph limit hit, sleeping for {e.retry_after}s")
             time.sleep(e.retry_after)
-            self.create_page(acc, content)
+            return self.create_page(acc, content)
 
     def edit_page(self, acc, content, path):
         try:
-            acc.edit_page(path = path,
-                          title = 'SearchX',
-                          author_name='XXX',
-                          author_url='https://github.com/hsj51/SearchX',
-                          html_content=content)
+            with metrics.TELEGRAPH_LATENCY.time('edit_page'):
+                acc.edit_page(path = path,
+                              title = 'SearchX',
+                              author_name='XXX',
+                              author_url='https://github.com/hsj51/SearchX',
+                              html_content=content)
+            metrics.TELEGRAPH_REQUESTS.inc('edit_page', 'ok')
         except RetryAfterError as e:
+            metrics.TELEGRAPH_REQUESTS.inc('edit_page', 'flood_wait')
             LOGGER.info(f"Telegra.ph limit hit, sleeping for {e.retry_after}s")
             time.sleep(e.retry_after)
             self.edit_page(acc, content, path)
@@ -0,0 +1,133 @@
+import asyncio
+import json
+import threading
+import time
+
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
+
+from bot import LOGGER, USE_SERVICE_ACCOUNTS, DRIVE_RATE_LIMIT, DRIVE_MAX_ATTEMPTS
+from bot.helper.ext_utils import metrics
+
+THROTTLE_REASONS = ['rateLimitExceeded', 'userRateLimitExceeded']
+QUOTA_REASONS = ['userRateLimitExceeded', 'dailyLimitExceeded']
+
+class RateLimiter:
+    """Token bucket whose refill rate follows Drive's throttling.
+
+    Every successful call nudges the rate up towards max_rate, every throttled
+    call halves it and pauses the bucket for Retry-After seconds, so the rate
+    settles just below the point where Drive starts rejecting requests.
+    """
+
+    def __init__(self, max_rate, min_rate=0.5, burst=None, name=None):
+        self.name = name
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate, max_rate)
+        self.rate = max_rate
+        self.burst = burst or max(1.0, max_rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.__lock = threading.Lock()
+
+    def reserve(self, tokens=1):
+        """Take tokens from the bucket and return how long the caller has to wait."""
+        with self.__lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= tokens
+            wait = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+            return max(wait, self.blocked_until - now)
+
+    def acquire(self, tokens=1):
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens=1):
+        wait = self.reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def on_success(self):
+        with self.__lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + 1 / self.rate)
+
+    def on_throttle(self, retry_after=None):
+        metrics.DRIVE_RATE_LIMITED.inc(self.name)
+        with self.__lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            pause = retry_after if retry_after is not None else 1 / self.rate
+            self.blocked_until = max(self.blocked_until, time.monotonic() + pause)
+            LOGGER.info(f"Drive throttled, lowering rate to {round(self.rate, 2)} req/s for {round(pause, 2)}s")
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def credentials_key(credentials):
+    return getattr(credentials, 'service_account_email', None) or getattr(credentials, 'client_id', None)
+
+def get_limiter(credentials):
+    key = credentials_key(credentials)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = RateLimiter(DRIVE_RATE_LIMIT, name=key)
+            _limiters[key] = limiter
+    return limiter
+
+def parse_retry_after(value):
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+def get_reason(err: HttpError):
+    try:
+        return json.loads(err.content).get('error').get('errors')[0].get('reason')
+    except Exception:
+        return ''
+
+def should_retry(status, reason):
+    if reason in QUOTA_REASONS and USE_SERVICE_ACCOUNTS:
+        # Let the caller switch to the next service account
+        return False
+    if reason == 'dailyLimitExceeded':
+        return False
+    return status == 429 or status >= 500 or reason in THROTTLE_REASONS
+
+
+class RateLimitedHttpRequest(HttpRequest):
+    """HttpRequest that waits on its account's RateLimiter before every attempt."""
+
+    def __init__(self, http, *args, limiter=None, **kwargs):
+        super().__init__(http, *args, **kwargs)
+        self.limiter = limiter
+
+    def execute(self, http=None, num_retries=0):
+        method = self.methodId.replace('drive.', '', 1)
+        for attempt in range(1, DRIVE_MAX_ATTEMPTS + 1):
+            self.limiter.acquire()
+            try:
+                with metrics.DRIVE_LATENCY.time(method):
+                    result = super().execute(http=http, num_retries=num_retries)
+            except HttpError as err:
+                status = err.resp.status
+                reason = get_reason(err)
+                metrics.DRIVE_REQUESTS.inc(method, status)
+                if status == 429 or reason in THROTTLE_REASONS:
+                    self.limiter.on_throttle(parse_retry_after(err.resp.get('retry-after')))
+                elif status >= 500:
+                    time.sleep(min(2 ** attempt, 30))
+                if attempt == DRIVE_MAX_ATTEMPTS or not should_retry(status, reason):
+                    raise
+                LOGGER.debug(f"Retrying {self.methodId} after {reason or status} [{attempt}/{DRIVE_MAX_ATTEMPTS}]")
+                metrics.DRIVE_RETRIES.inc(method, reason or status)
+                continue
+            metrics.DRIVE_REQUESTS.inc(method, 200)
+            self.limiter.on_success()
+            return result
@@ -0,0 +1,73 @@
+import json
+import logging
+import threading
+
+from httplib2 import Http
+from google_auth_httplib2 import AuthorizedHttp
+
+from google.auth.transport.requests import Request
+from google.oauth2 import service_account
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+
+from bot import LOGGER
+from bot.helper.drive_utils.rate_limiter import RateLimitedHttpRequest, get_limiter
+
+logging.getLogger('googleapiclient.discovery').setLevel(logging.ERROR)
+
+G_DRIVE_TOKEN_FILE = "token.json"
+# Check https://developers.google.com/drive/scopes for all available scopes
+OAUTH_SCOPE = ['https://www.googleapis.com/auth/drive']
+
+_lock = threading.Lock()
+_discovery = None
+_credentials = {}
+_services = {}
+
+def get_discovery_document():
+    """Return the Drive v3 discovery document bundled with googleapiclient, parsed once."""
+    global _discovery
+    with _lock:
+        if _discovery is None:
+            _discovery = json.loads(get_static_doc('drive', 'v3'))
+    return _discovery
+
+def get_credentials(account=None):
+    """Return the cached credentials of a service account index, or of token.json when account is None."""
+    with _lock:
+        credentials = _credentials.get(account)
+        if credentials is None:
+            if account is None:
+                credentials = Credentials.from_authorized_user_file(G_DRIVE_TOKEN_FILE, OAUTH_SCOPE)
+            else:
+                credentials = service_account.Credentials.from_service_account_file(
+                    f'accounts/{account}.json', scopes=OAUTH_SCOPE)
+            _credentials[account] = credentials
+    if not credentials.valid and credentials.expired and getattr(credentials, 'refresh_token', None):
+        credentials.refresh(Request())
+    return credentials
+
+def get_service(account=None):
+    """Return the Drive service of an account, built once and shared by every GoogleDriveHelper.
+
+    Each request gets its own AuthorizedHttp from the request builder, so one
+    service object can be used from several threads at once.
+    """
+    credentials = get_credentials(account)
+    with _lock:
+        service = _services.get(account)
+    if service is not None:
+        return service
+    limiter = get_limiter(credentials)
+
+    def build_request(http, *args, **kwargs):
+        new_http = AuthorizedHttp(credentials, http=Http())
+        return RateLimitedHttpRequest(new_http, *args, limiter=limiter, **kwargs)
+
+    service = build_from_document(get_discovery_document(), requestBuilder=build_request,
+                                  http=AuthorizedHttp(credentials, http=Http()))
+    with _lock:
+        service = _services.setdefault(account, service)
+    LOGGER.info(f"Built Drive service for {'token.json' if account is None else f'{account}.json'}")
+    return service
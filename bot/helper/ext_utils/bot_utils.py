@@ -1,5 +1,12 @@
+import functools
+import json
+import os
 import re
-import threading
+import tempfile
+
+from bot.helper.ext_utils import metrics
+from bot.helper.ext_utils.executor import PoolFull, command_pool, log_exception
+from bot.helper.telegram_helper.message_utils import sendNotice
 
 SIZE_UNITS = ['B', 'KB', 'MB', 'GB', 'TB', 'PB']
 
@@ -30,9 +37,64 @@ def is_sharer_link(url: str):
     url = re.match(r'https?://sharer\.pw/\S+', url)
     return bool(url)
 
+def is_ddl_link(url: str):
+    return is_appdrive_link(url) or is_gdtot_link(url) or is_sharer_link(url)
+
+def get_links(text: str, check=None):
+    """Return the unique links in text, in order, that pass check (any supported link by default)."""
+    if check is None:
+        check = lambda url: is_gdrive_link(url) or is_ddl_link(url)
+    links = re.findall(r'https?://\S+', text or '')
+    return [link for link in dict.fromkeys(links) if check(link)]
+
+def write_json(path: str, data):
+    """Write data to a temporary file and move it over path, so a crash never leaves half a file.
+
+    Every writer gets its own temporary file, so two processes saving the
+    same path leave one complete copy instead of a mix of both.
+    """
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                                     prefix=f'{os.path.basename(path)}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+def split_message(text: str, limit=4000, separator='\n\n'):
+    """Split text on separator into chunks that fit in one Telegram message."""
+    parts = []
+    for part in text.split(separator):
+        # A part longer than a message is cut at its last line break that fits, or at the limit
+        while len(part) > limit:
+            cut = part.rfind('\n', 0, limit)
+            if cut <= 0:
+                cut = limit
+            parts.append(part[:cut])
+            part = part[cut:].lstrip('\n')
+        parts.append(part)
+    chunks = ['']
+    for part in parts:
+        if len(chunks[-1]) + len(part) + len(separator) > limit and chunks[-1] != '':
+            chunks.append('')
+        chunks[-1] += part + separator
+    return [chunk.strip() for chunk in chunks if chunk.strip() != '']
+
 def new_thread(fn):
-    def wrapper(*args, **kwargs):
-        thread = threading.Thread(target=fn, args=args, kwargs=kwargs)
-        thread.start()
-        return thread
+    """Run a command handler on the command pool, telling the user when it has to wait."""
+    @functools.wraps(fn)
+    def wrapper(update, context):
+        # Runs on the dispatcher thread, so the replies are not waited for
+        try:
+            future, position = command_pool.try_submit(fn, update, context)
+        except PoolFull:
+            metrics.COMMANDS_REJECTED.inc(command_pool.name)
+            sendNotice("The bot is busy, try again in a few minutes", context.bot, update)
+            return None
+        future.add_done_callback(log_exception)
+        if position > 0:
+            sendNotice(f"Busy, queued at position {position}", context.bot, update)
+        return future
     return wrapper
@@ -1,14 +1,45 @@
-from pymongo import MongoClient
+import atexit
+import os
+import threading
 
-from bot import AUTHORIZED_CHATS, DATABASE_URL
+from queue import Queue
+from pymongo import MongoClient, ReplaceOne
+from pymongo.errors import OperationFailure
+
+from bot import LOGGER, AUTHORIZED_CHATS, DATABASE_URL
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Return the process wide MongoClient, whose connection pool is shared by every DatabaseHelper."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = MongoClient(host=DATABASE_URL)
+    return _client
 
 class DatabaseHelper:
     def __init__(self):
-        self.mongodb = MongoClient(host=DATABASE_URL)["SearchX"]
+        self.mongodb = get_client()["SearchX"]
         self.col = self.mongodb["users"]
+        self.links = self.mongodb["links"]
+        self.changes = self.mongodb["changes"]
+        self.counts = self.mongodb["counts"]
+
+    def create_indexes(self):
+        try:
+            self.col.create_index("user_id", unique=True)
+        except OperationFailure as e:
+            # Older databases may hold duplicate entries from insert_one
+            LOGGER.warning(f"Failed to create unique user_id index: {e}")
+            self.col.create_index("user_id")
+        self.links.create_index("url", unique=True)
+        self.changes.create_index("drive_id", unique=True)
+        self.counts.create_index("folder_id", unique=True)
 
     def auth_user(self, user_id: int):
-        self.col.insert_one({"user_id": user_id})
+        self.col.update_one({"user_id": user_id}, {"$set": {"user_id": user_id}}, upsert=True)
         return 'Authorization granted'
 
     def unauth_user(self, user_id: int):
@@ -18,11 +49,114 @@ class DatabaseHelper:
     def get_users(self):
         return self.col.find().sort("user_id")
 
+    def get_link(self, url: str):
+        return self.links.find_one({"url": url}, {"_id": 0})
+
+    def set_link(self, entry: dict):
+        self.links.replace_one({"url": entry["url"]}, entry, upsert=True)
+
+    def remove_link(self, url: str):
+        self.links.delete_many({"url": url})
+
+    def get_change_tokens(self):
+        return {entry["drive_id"]: entry["token"] for entry in self.changes.find()}
+
+    def set_change_token(self, drive_id: str, token: str):
+        self.changes.update_one({"drive_id": drive_id}, {"$set": {"token": token}}, upsert=True)
+
+    def get_counts(self):
+        return {entry.pop("folder_id"): entry for entry in self.counts.find({}, {"_id": 0})}
+
+    def set_counts(self, entries: dict):
+        if entries:
+            self.counts.bulk_write([ReplaceOne({"folder_id": folder_id}, {"folder_id": folder_id, **entry}, upsert=True)
+                                    for folder_id, entry in entries.items()], ordered=False)
+
+    def remove_counts(self, folder_ids):
+        if folder_ids:
+            self.counts.delete_many({"folder_id": {"$in": list(folder_ids)}})
+
     def load_users(self):
         users = self.get_users()
         for user in users:
             AUTHORIZED_CHATS.add(user['user_id'])
 
+
+class AuthStore:
+    """Authorization changes with write-behind persistence.
+
+    AUTHORIZED_CHATS is updated right away and stays the only thing
+    CustomFilters reads; the change is then written to MongoDB, or to
+    authorized_chats.txt without a database, by a background thread. The
+    file only holds the chats authorized through the bot, never the ones
+    given in the AUTHORIZED_CHATS config.
+    """
+
+    def __init__(self, path='authorized_chats.txt'):
+        self.path = path
+        self.__db = DatabaseHelper() if DATABASE_URL is not None else None
+        self.__queue = Queue()
+        self.__lock = threading.Lock()
+        self.__chats = set()
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                self.__chats = {int(line.split()[0]) for line in f if line.strip()}
+        threading.Thread(target=self.__writer, name="AuthWriter", daemon=True).start()
+
+    def authorize(self, chat_id: int):
+        with self.__lock:
+            if chat_id in AUTHORIZED_CHATS:
+                return 'Already authorized'
+            AUTHORIZED_CHATS.add(chat_id)
+            self.__chats.add(chat_id)
+        self.__queue.put((True, chat_id))
+        return 'Authorization granted'
+
+    def unauthorize(self, chat_id: int):
+        with self.__lock:
+            if chat_id not in AUTHORIZED_CHATS:
+                return 'Already unauthorized'
+            AUTHORIZED_CHATS.discard(chat_id)
+            self.__chats.discard(chat_id)
+        self.__queue.put((False, chat_id))
+        return 'Authorization revoked'
+
+    def flush(self):
+        self.__queue.join()
+
+    def __save(self):
+        with self.__lock:
+            chats = sorted(self.__chats)
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w') as file:
+            for chat_id in chats:
+                file.write(f'{chat_id}\n')
+        os.replace(temp_path, self.path)
+
+    def __writer(self):
+        while True:
+            changes = [self.__queue.get()]
+            while not self.__queue.empty():
+                changes.append(self.__queue.get_nowait())
+            try:
+                if self.__db is not None:
+                    for authorized, chat_id in changes:
+                        if authorized:
+                            self.__db.auth_user(chat_id)
+                        else:
+                            self.__db.unauth_user(chat_id)
+                else:
+                    # Several queued changes collapse into one rewrite of the file
+                    self.__save()
+            except Exception as e:
+                LOGGER.error(f"Failed to save authorized chats: {e}")
+            for _ in changes:
+                self.__queue.task_done()
+
 if DATABASE_URL is not None:
     db = DatabaseHelper()
+    db.create_indexes()
     db.load_users()
+
+auth_store = AuthStore()
+atexit.register(auth_store.flush)
@@ -1,2 +1,5 @@
 class DDLException(Exception):
     pass
+
+class LoggedOut(Exception):
+    pass
@@ -0,0 +1,113 @@
+import threading
+import time
+
+from collections import deque
+from concurrent.futures import Future
+
+from bot import LOGGER, BATCH_WORKERS, COMMAND_WORKERS, COMMAND_QUEUE_SIZE, SEARCH_WORKERS
+from bot.helper.ext_utils import metrics
+
+class PoolFull(Exception):
+    pass
+
+
+class _Job:
+    __slots__ = ('fn', 'args', 'kwargs', 'future', 'queued_at')
+
+    def __init__(self, fn, args, kwargs):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.queued_at = time.perf_counter()
+
+
+class BoundedPool:
+    """Named pool of at most `workers` threads with a FIFO of at most `max_queue` waiting jobs.
+
+    Threads are started on demand and kept for the life of the process. submit()
+    blocks while the queue is full, which pushes back on the caller, and
+    try_submit() refuses the job instead so a command can be turned away.
+    """
+
+    def __init__(self, name, workers, max_queue):
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self.__jobs = deque()
+        self.__threads = 0
+        self.__idle = 0
+        self.__lock = threading.Lock()
+        self.__not_empty = threading.Condition(self.__lock)
+        self.__not_full = threading.Condition(self.__lock)
+
+    @property
+    def queued(self):
+        with self.__lock:
+            return len(self.__jobs)
+
+    def __enqueue(self, job, block):
+        with self.__lock:
+            while len(self.__jobs) >= self.max_queue:
+                if not block:
+                    metrics.POOL_REJECTED.inc(self.name)
+                    raise PoolFull(f"{self.name} pool is full")
+                self.__not_full.wait()
+            if self.__idle <= len(self.__jobs) and self.__threads < self.workers:
+                self.__threads += 1
+                self.__idle += 1
+                threading.Thread(target=self.__run, name=f"{self.name}-{self.__threads}", daemon=True).start()
+            self.__jobs.append(job)
+            position = max(0, len(self.__jobs) - self.__idle)
+            self.__not_empty.notify()
+        return position
+
+    def submit(self, fn, *args, **kwargs):
+        job = _Job(fn, args, kwargs)
+        self.__enqueue(job, block=True)
+        return job.future
+
+    def try_submit(self, fn, *args, **kwargs):
+        """Queue fn without waiting and return (future, position), position 0 meaning it started at once."""
+        job = _Job(fn, args, kwargs)
+        position = self.__enqueue(job, block=False)
+        return job.future, position
+
+    def map(self, fn, iterable):
+        futures = [self.submit(fn, item) for item in iterable]
+        for future in futures:
+            yield future.result()
+
+    def __run(self):
+        while True:
+            with self.__lock:
+                while not self.__jobs:
+                    self.__not_empty.wait()
+                job = self.__jobs.popleft()
+                self.__idle -= 1
+                self.__not_full.notify()
+            if job.future.set_running_or_notify_cancel():
+                metrics.POOL_WAIT.observe(time.perf_counter() - job.queued_at, self.name)
+                metrics.current_job.queued_at = job.queued_at
+                try:
+                    job.future.set_result(job.fn(*job.args, **job.kwargs))
+                except BaseException as e:
+                    job.future.set_exception(e)
+                finally:
+                    metrics.current_job.queued_at = None
+            with self.__lock:
+                self.__idle += 1
+
+
+def log_exception(future):
+    if not future.cancelled() and future.exception() is not None:
+        LOGGER.error(f"Command failed: {future.exception()}", exc_info=future.exception())
+
+# Command handlers, the Drive jobs of multi-link commands, link resolvers, search
+# path lookups and Telegraph publishing each get their own pool, so one kind of
+# work can not starve the others
+command_pool = BoundedPool('Command', COMMAND_WORKERS, COMMAND_QUEUE_SIZE)
+drive_pool = BoundedPool('Drive', BATCH_WORKERS, BATCH_WORKERS * 4)
+resolve_pool = BoundedPool('Resolve', BATCH_WORKERS, BATCH_WORKERS * 4)
+search_pool = BoundedPool('Search', SEARCH_WORKERS, SEARCH_WORKERS * 100)
+telegraph_pool = BoundedPool('Telegraph', 5, 50)
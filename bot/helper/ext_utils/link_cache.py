@@ -0,0 +1,90 @@
+import json
+import os
+import threading
+import time
+
+from urllib.parse import urlparse
+
+from bot import LOGGER, DATABASE_URL, DDL_CACHE_TTL
+from bot.helper.ext_utils.bot_utils import write_json
+
+class LinkCache:
+    """Remembers the last successful clone of every DDL link.
+
+    Entries map a normalized AppDrive / GDToT / Sharer URL to the Drive id it
+    resolved to, the id of the cloned copy and the result message sent back,
+    and are kept in MongoDB when DATABASE_URL is set or in a JSON file. Links
+    that resolve to a temporary copy, deleted once cloned, have no source id.
+    Nothing is read or written when DDL_CACHE_TTL is 0.
+    """
+
+    def __init__(self, path='ddl_cache.json'):
+        self.path = path
+        self.__lock = threading.Lock()
+        self.__links = {}
+        self.__db = None
+        if DATABASE_URL is not None:
+            from bot.helper.ext_utils.database import DatabaseHelper
+            self.__db = DatabaseHelper()
+        elif os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    self.__links = json.load(f)
+            except ValueError:
+                LOGGER.error(f"Ignoring corrupt {self.path}")
+
+    @staticmethod
+    def normalize(url: str):
+        parsed = urlparse(url.strip())
+        host = parsed.netloc.lower()
+        for prefix in ['www.', 'new.']:
+            if host.startswith(prefix):
+                host = host[len(prefix):]
+        return f"{host}{parsed.path.rstrip('/')}"
+
+    def __save(self):
+        write_json(self.path, self.__links)
+
+    def get(self, url: str):
+        if DDL_CACHE_TTL == 0:
+            return None
+        key = self.normalize(url)
+        if self.__db is not None:
+            entry = self.__db.get_link(key)
+        else:
+            with self.__lock:
+                entry = self.__links.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry['time'] > DDL_CACHE_TTL:
+            self.remove(url)
+            return None
+        return entry
+
+    def set(self, url: str, source_id, dest_id: str, result: str):
+        if DDL_CACHE_TTL == 0:
+            return
+        entry = {
+            'url': self.normalize(url),
+            'source_id': source_id,
+            'dest_id': dest_id,
+            'result': result,
+            'time': time.time()
+        }
+        if self.__db is not None:
+            self.__db.set_link(entry)
+        else:
+            with self.__lock:
+                self.__links[entry['url']] = entry
+                self.__save()
+
+    def remove(self, url: str):
+        key = self.normalize(url)
+        if self.__db is not None:
+            self.__db.remove_link(key)
+        else:
+            with self.__lock:
+                if self.__links.pop(key, None) is not None:
+                    self.__save()
+
+link_cache = LinkCache()
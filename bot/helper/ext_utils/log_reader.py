@@ -0,0 +1,70 @@
+import gzip
+import os
+
+from datetime import datetime, timedelta
+
+from bot import LOG_FILE, LOG_BACKUP_COUNT
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+TAIL_BLOCK = 64 * 1024
+
+def log_files():
+    """Return the current and rotated log files, newest first."""
+    files = [LOG_FILE] if os.path.exists(LOG_FILE) else []
+    for i in range(1, LOG_BACKUP_COUNT + 1):
+        for path in (f'{LOG_FILE}.{i}', f'{LOG_FILE}.{i}.gz'):
+            if os.path.exists(path):
+                files.append(path)
+                break
+    return files
+
+def read_lines(path):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8', errors='replace') as f:
+        return f.readlines()
+
+def read_tail(path, count):
+    """Return the last count lines of path, reading plain files from the end."""
+    if path.endswith('.gz'):
+        return read_lines(path)[-count:]
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = b''
+        while position > 0 and data.count(b'\n') <= count:
+            step = min(TAIL_BLOCK, position)
+            position -= step
+            f.seek(position)
+            data = f.read(step) + data
+    lines = data.decode('utf-8', errors='replace').splitlines(keepends=True)
+    return lines[-count:]
+
+def last_lines(count):
+    lines = []
+    for path in log_files():
+        lines = read_tail(path, count - len(lines)) + lines
+        if len(lines) >= count:
+            break
+    return lines
+
+def parse_time(line):
+    try:
+        return datetime.strptime(line[:19], TIME_FORMAT)
+    except ValueError:
+        # Continuation of a multi-line record, e.g. a traceback
+        return None
+
+def lines_since(seconds):
+    """Return the log records written in the last seconds, across rotated files."""
+    cutoff = datetime.now() - timedelta(seconds=seconds)
+    lines = []
+    for path in log_files():
+        file_lines = read_lines(path)
+        start = next((i for i, line in enumerate(file_lines)
+                      if (logged := parse_time(line)) is not None and logged >= cutoff), None)
+        if start is None:
+            break
+        lines = file_lines[start:] + lines
+        if start > 0:
+            break
+    return lines
@@ -0,0 +1,180 @@
+import functools
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from bot import LOGGER, METRICS_LISTEN, METRICS_PORT
+from bot.helper.ext_utils.profiler import command_profiler
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+registry = []
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names, values, extra=None):
+    labels = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        labels.append(extra)
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+class Counter:
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.__values = {}
+        self.__lock = threading.Lock()
+        registry.append(self)
+
+    def inc(self, *labels, amount=1):
+        labels = tuple(str(label) for label in labels)
+        with self.__lock:
+            self.__values[labels] = self.__values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self.__lock:
+            for labels, value in sorted(self.__values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labels, labels)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self.__values = {}
+        self.__lock = threading.Lock()
+        registry.append(self)
+
+    def observe(self, value, *labels):
+        labels = tuple(str(label) for label in labels)
+        with self.__lock:
+            series = self.__values.get(labels)
+            if series is None:
+                # Bucket counts, then sum and count of every observation
+                series = self.__values[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self.__lock:
+            for labels, series in sorted(self.__values.items()):
+                for bound, count in zip(self.buckets, series):
+                    bucket = _format_labels(self.labels, labels, f'le="{bound}"')
+                    lines.append(f'{self.name}_bucket{bucket} {count}')
+                bucket = _format_labels(self.labels, labels, 'le="+Inf"')
+                lines.append(f'{self.name}_bucket{bucket} {series[-1]}')
+                lines.append(f'{self.name}_sum{_format_labels(self.labels, labels)} {round(series[-2], 6)}')
+                lines.append(f'{self.name}_count{_format_labels(self.labels, labels)} {series[-1]}')
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+DRIVE_REQUESTS = Counter('searchx_drive_requests_total', 'Drive API calls by method and HTTP status, retries included',
+                         ('method', 'status'))
+DRIVE_LATENCY = Histogram('searchx_drive_request_seconds', 'Drive API call latency by method, per attempt',
+                          ('method',))
+DRIVE_RETRIES = Counter('searchx_drive_retries_total', 'Drive API calls retried by method and reason',
+                        ('method', 'reason'))
+DRIVE_RATE_LIMITED = Counter('searchx_drive_rate_limited_total', 'Drive throttling responses per account',
+                             ('account',))
+ACCOUNT_SWITCHES = Counter('searchx_service_account_switches_total', 'Service account switches')
+DRIVE_CHANGES = Counter('searchx_drive_changes_total', 'Drive change log entries applied to the caches per drive',
+                        ('drive',))
+TELEGRAPH_REQUESTS = Counter('searchx_telegraph_requests_total', 'Telegraph calls by method and result',
+                             ('method', 'status'))
+TELEGRAPH_LATENCY = Histogram('searchx_telegraph_request_seconds', 'Telegraph call latency by method',
+                              ('method',))
+SEARCH_PHASE_LATENCY = Histogram('searchx_search_phase_seconds', 'Time spent in each phase of a search',
+                                 ('phase',))
+POOL_WAIT = Histogram('searchx_pool_wait_seconds', 'Time jobs wait in a pool queue before they start', ('pool',))
+POOL_REJECTED = Counter('searchx_pool_rejected_total', 'Jobs turned away because a pool queue was full', ('pool',))
+COMMANDS = Counter('searchx_commands_total', 'Bot commands handled by command and result',
+                   ('command', 'status'))
+COMMAND_LATENCY = Histogram('searchx_command_seconds', 'End to end bot command time', ('command',))
+COMMANDS_REJECTED = Counter('searchx_commands_rejected_total', 'Bot commands turned away because their pool was full',
+                            ('pool',))
+
+# Set by the pool thread running a job to when the job was queued
+current_job = threading.local()
+
+def track_command(command):
+    """Record how long a command handler takes and whether it raised, profiling it when /profile asked for it.
+
+    A handler run from a pool is timed from when it was queued, so the wait for a free worker is counted.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = getattr(current_job, 'queued_at', None) or time.perf_counter()
+            status = 'ok'
+            try:
+                if command_profiler.remaining > 0:
+                    return command_profiler.run(command, fn, *args, **kwargs)
+                return fn(*args, **kwargs)
+            except Exception:
+                status = 'error'
+                raise
+            finally:
+                COMMAND_LATENCY.observe(time.perf_counter() - start, command)
+                COMMANDS.inc(command, status)
+        return wrapper
+    return decorator
+
+def render():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0].rstrip('/') != '/metrics':
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        LOGGER.debug(f"Metrics: {format % args}")
+
+def start_server():
+    server = ThreadingHTTPServer((METRICS_LISTEN, METRICS_PORT), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="MetricsServer", daemon=True).start()
+    LOGGER.info(f"Serving metrics on {METRICS_LISTEN}:{METRICS_PORT}/metrics")
+    return server
@@ -1,19 +1,55 @@
 import base64
-import cloudscraper
 import re
 import requests
+import threading
+import time
 
 from lxml import etree
-from urllib.parse import urlparse
+from urllib.parse import urlparse, parse_qs
 
-from bot import APPDRIVE_EMAIL, APPDRIVE_PASS, GDTOT_CRYPT, XSRF_TOKEN, laravel_session
-from bot.helper.ext_utils.exceptions import DDLException
+from bot import LOGGER, APPDRIVE_EMAIL, APPDRIVE_PASS, GDTOT_CRYPT, XSRF_TOKEN, laravel_session
+from bot.helper.ext_utils.exceptions import DDLException, LoggedOut
 
 account = {
     'email': APPDRIVE_EMAIL, 
     'passwd': APPDRIVE_PASS
 }
 
+SESSION_MAX_AGE = 6 * 60 * 60
+
+class SessionPool:
+    # One logged in keep-alive session per host, used by one resolver at a time as requests and cloudscraper
+    # sessions are not thread safe. Logged in again once older than SESSION_MAX_AGE or after a logout
+
+    def __init__(self, create_session, login=None):
+        self.__create_session = create_session
+        self.__login = login
+        self.__lock = threading.Lock()
+        self.__sessions = {}
+
+    def run(self, url, resolve, site):
+        # resolve(session, url), logging in again once if it raises LoggedOut
+        host = urlparse(url).netloc
+        with self.__lock:
+            entry = self.__sessions.setdefault(host, {'lock': threading.Lock(), 'session': None, 'created': 0})
+        for attempt in range(2):
+            with entry['lock']:
+                if entry['session'] is None or time.time() - entry['created'] >= SESSION_MAX_AGE:
+                    session = self.__create_session()
+                    if self.__login is not None:
+                        LOGGER.info(f"Logging in: {host}")
+                        self.__login(session, url)
+                    entry['session'], entry['created'] = session, time.time()
+                try:
+                    return resolve(entry['session'], url)
+                except LoggedOut:
+                    entry['session'] = None
+        raise DDLException(f"Failed to login to {site}")
+
+def logged_out(res):
+    # The site's login page or a Cloudflare challenge rather than the page asked for
+    return urlparse(res.url).path.startswith('/login') or res.status_code in [403, 503]
+
 def account_login(client, url, email, password):
     data = {
         'email': email,
@@ -21,6 +57,32 @@ def account_login(client, url, email, password):
     }
     client.post(f'https://{urlparse(url).netloc}/login', data=data)
 
+def appdrive_session():
+    client = requests.Session()
+    client.headers.update({
+        "user-agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/97.0.4692.99 Safari/537.36"
+    })
+    return client
+
+def gdtot_session():
+    client = requests.Session()
+    client.cookies.update({'crypt': GDTOT_CRYPT})
+    return client
+
+def sharer_session():
+    import cloudscraper
+    scraper = cloudscraper.create_scraper(allow_brotli=False)
+    scraper.cookies.update({
+        "XSRF-TOKEN": XSRF_TOKEN,
+        "laravel_session": laravel_session
+    })
+    return scraper
+
+appdrive_sessions = SessionPool(appdrive_session,
+                                lambda client, url: account_login(client, url, account['email'], account['passwd']))
+gdtot_sessions = SessionPool(gdtot_session)
+sharer_sessions = SessionPool(sharer_session)
+
 def gen_payload(data, boundary=f'{"-"*6}_'):
     data_string = ''
     for item in data:
@@ -40,13 +102,16 @@ def parse_info(data):
 def appdrive(url: str) -> str:
     if (APPDRIVE_EMAIL or APPDRIVE_PASS) is None:
         raise DDLException("APPDRIVE_EMAIL and APPDRIVE_PASS env vars not provided")
-    client = requests.Session()
-    client.headers.update({
-        "user-agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/97.0.4692.99 Safari/537.36"
-    })
-    account_login(client, url, account['email'], account['passwd'])
+    return appdrive_sessions.run(url, appdrive_resolve, "AppDrive")
+
+def appdrive_resolve(client, url):
     res = client.get(url)
-    key = re.findall(r'"key",\s+"(.*?)"', res.text)[0]
+    if logged_out(res):
+        raise LoggedOut
+    key = re.findall(r'"key",\s+"(.*?)"', res.text)
+    if len(key) == 0:
+        raise DDLException("Invalid link")
+    key = key[0]
     ddl_btn = etree.HTML(res.content).xpath("//button[@id='drc']")
     info_parsed = parse_info(res.text)
     info_parsed['error'] = False
@@ -85,11 +150,18 @@ def appdrive(url: str) -> str:
 def gdtot(url: str) -> str:
     if GDTOT_CRYPT is None:
         raise DDLException("GDTOT_CRYPT env var not provided")
-    client = requests.Session()
-    client.cookies.update({'crypt': GDTOT_CRYPT})
-    res = client.get(url)
+    return gdtot_sessions.run(url, gdtot_resolve, "GDToT")
+
+def gdtot_resolve(client, url):
+    # The file page sets the per-file state /dld expects
+    client.get(url)
     res = client.get(f"https://new.gdtot.nl/dld?id={url.split('/')[-1]}")
-    url = re.findall(r'URL=(.*?)"', res.text)[0]
+    if logged_out(res):
+        raise LoggedOut
+    ddl_url = re.findall(r'URL=(.*?)"', res.text)
+    if len(ddl_url) == 0:
+        raise DDLException("Invalid link")
+    url = ddl_url[0]
     info = {}
     info['error'] = False
     params = parse_qs(urlparse(url).query)
@@ -111,13 +183,17 @@ def gdtot(url: str) -> str:
 def sharer(url: str, forced_login=False) -> str:
     if (XSRF_TOKEN or laravel_session) is None:
         raise DDLException("XSRF_TOKEN and laravel_session env vars not provided")
-    scraper = cloudscraper.create_scraper(allow_brotli=False)
-    scraper.cookies.update({
-        "XSRF-TOKEN": XSRF_TOKEN,
-        "laravel_session": laravel_session
-    })
+    return sharer_sessions.run(url, lambda scraper, url: sharer_resolve(scraper, url, forced_login), "Sharer")
+
+def sharer_resolve(scraper, url, forced_login=False):
     res = scraper.get(url)
-    token = re.findall("_token\s=\s'(.*?)'", res.text, re.DOTALL)[0]
+    if logged_out(res):
+        # Cloudflare clearance or site session expired
+        raise LoggedOut
+    token = re.findall("_token\s=\s'(.*?)'", res.text, re.DOTALL)
+    if len(token) == 0:
+        raise DDLException("Invalid link")
+    token = token[0]
     ddl_btn = etree.HTML(res.content).xpath("//button[@id='btndirect']")
     info = {}
     info['error'] = True
@@ -140,7 +216,7 @@ def sharer(url: str, forced_login=False) -> str:
         info['gdrive_link'] = res['url']
     if len(ddl_btn) and not forced_login and not 'url' in info:
         # retry download via login
-        return sharer(url, forced_login=True)
+        return sharer_resolve(scraper, url, forced_login=True)
     if not info['error']:
         return info['gdrive_link']
     else:
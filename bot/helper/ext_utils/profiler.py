@@ -0,0 +1,90 @@
+import cProfile
+import io
+import pstats
+import threading
+import time
+
+# (file, function) pairs whose cumulative time is reported as Drive / Telegraph time.
+# RateLimitedHttpRequest.execute covers single requests with their retries and
+# limiter waits, BatchHttpRequest._execute batch calls and run_coroutine the
+# waits on the async Drive client.
+DRIVE_FUNCTIONS = [('rate_limiter.py', 'execute'), ('googleapiclient/http.py', '_execute'),
+                   ('async_drive.py', 'run_coroutine')]
+LIMITER_FUNCTIONS = [('rate_limiter.py', 'acquire')]
+TELEGRAPH_FUNCTIONS = [('gdriveTools.py', 'create_page'), ('gdriveTools.py', 'edit_page')]
+TOP_FUNCTIONS = 30
+
+class CommandProfiler:
+    """Profile the next few runs of the tracked bot commands with cProfile.
+
+    Only the `remaining` counter is read while nothing is armed, so commands
+    pay no profiling cost unless an owner asked for a profile.
+    """
+
+    def __init__(self):
+        self.remaining = 0
+        self.command = None
+        self.reply = None
+        self.__lock = threading.Lock()
+
+    def arm(self, count, command, reply):
+        """Profile the next count runs of command (any command when None), sending reports to reply(filename, text)."""
+        with self.__lock:
+            self.remaining = count
+            self.command = command
+            self.reply = reply
+
+    def disarm(self):
+        with self.__lock:
+            self.remaining = 0
+            self.command = None
+            self.reply = None
+
+    def __claim(self, command):
+        with self.__lock:
+            if self.remaining <= 0 or self.command not in (None, command):
+                return None
+            self.remaining -= 1
+            reply = self.reply
+            if self.remaining == 0:
+                self.command = None
+                self.reply = None
+            return reply
+
+    def run(self, command, fn, *args, **kwargs):
+        reply = self.__claim(command)
+        if reply is None:
+            return fn(*args, **kwargs)
+        profile = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            return profile.runcall(fn, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            reply(f"profile_{command}_{time.strftime('%Y%m%d_%H%M%S')}.txt", report(command, profile, elapsed))
+
+
+def cumulative_time(stats, functions):
+    total = 0.0
+    for (filename, _, name), (_, _, _, cumtime, _) in stats.stats.items():
+        if any(filename.endswith(suffix) and name == function for suffix, function in functions):
+            total += cumtime
+    return total
+
+def report(command, profile, elapsed):
+    stream = io.StringIO()
+    stats = pstats.Stats(profile, stream=stream)
+    drive = cumulative_time(stats, DRIVE_FUNCTIONS)
+    limiter = cumulative_time(stats, LIMITER_FUNCTIONS)
+    telegraph = cumulative_time(stats, TELEGRAPH_FUNCTIONS)
+    stream.write(f"Command: /{command}\n"
+                 f"Wall time: {round(elapsed, 3)}s\n"
+                 f"Drive calls: {round(drive, 3)}s (rate limiter waits: {round(limiter, 3)}s)\n"
+                 f"Telegraph: {round(telegraph, 3)}s\n"
+                 f"Other: {round(max(0.0, elapsed - drive - telegraph), 3)}s\n\n"
+                 f"Only the command's own thread is profiled, work handed to other threads shows up as waits.\n\n")
+    stats.sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+    stats.sort_stats('tottime').print_stats(TOP_FUNCTIONS)
+    return stream.getvalue()
+
+command_profiler = CommandProfiler()
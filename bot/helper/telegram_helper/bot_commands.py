@@ -4,6 +4,8 @@ class _BotCommands:
         self.ListCommand = 'search'
         self.CloneCommand = 'clone'
         self.CountCommand = 'count'
+        self.VerifyCommand = 'verify'
+        self.DupesCommand = 'dupes'
         self.PermissionCommand = 'perm'
         self.DeleteCommand = 'del'
         self.AuthorizeCommand = 'authorize'
@@ -11,6 +13,7 @@ class _BotCommands:
         self.UsersCommand = 'users'
         self.ShellCommand = 'shell'
         self.LogCommand = 'log'
+        self.ProfileCommand = 'profile'
         self.HelpCommand = 'help'
 
 BotCommands = _BotCommands()
@@ -0,0 +1,133 @@
+import heapq
+import itertools
+import threading
+import time
+
+from collections import deque
+from concurrent.futures import Future
+
+from telegram.error import NetworkError, RetryAfter, TimedOut, BadRequest, Unauthorized
+
+from bot import LOGGER
+
+# Telegram allows about one message per second in a chat and 30 per second overall
+CHAT_GAP = 1
+GLOBAL_CALLS_PER_SECOND = 30
+MAX_ATTEMPTS = 4
+SENDER_THREADS = 4
+
+class _Call:
+    def __init__(self, fn, args, kwargs, key=None):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.key = key
+        self.future = Future()
+        self.attempts = 0
+        self.started = False
+
+
+class MessageQueue:
+    """Outbound Bot API calls, paced per chat and globally.
+
+    Calls to one chat run one at a time in the order they were queued, so a
+    deleteMessage always runs after the sendMessage it refers to. RetryAfter
+    pauses the chat for the time Telegram asks, network errors are retried
+    with backoff, and every caller gets a Future instead of waiting on I/O.
+    """
+
+    def __init__(self, senders=SENDER_THREADS):
+        self.__chats = {}
+        self.__ready = []
+        self.__counter = itertools.count()
+        self.__sent = deque()
+        self.__lock = threading.Condition()
+        for i in range(senders):
+            threading.Thread(target=self.__run, name=f"MessageQueue-{i}", daemon=True).start()
+
+    def submit(self, chat_id, fn, *args, **kwargs):
+        return self.__submit(chat_id, _Call(fn, args, kwargs))
+
+    def submit_latest(self, chat_id, key, fn, *args, **kwargs):
+        """Like submit, but replace a call with the same key that is still waiting in the chat's queue.
+
+        The replaced call keeps its place and its Future, so only the newest
+        state of something like a progress message is ever sent.
+        """
+        with self.__lock:
+            for call in self.__chats.get(chat_id, ()):
+                if call.key == key and not call.started:
+                    call.fn, call.args, call.kwargs = fn, args, kwargs
+                    return call.future
+            # The lock is reentrant, so the check and the queueing are one step
+            return self.__submit(chat_id, _Call(fn, args, kwargs, key))
+
+    def __submit(self, chat_id, call):
+        with self.__lock:
+            calls = self.__chats.get(chat_id)
+            if calls is None:
+                calls = self.__chats[chat_id] = deque()
+                heapq.heappush(self.__ready, (time.time(), next(self.__counter), chat_id))
+            calls.append(call)
+            self.__lock.notify()
+        return call.future
+
+    def __global_wait(self, now):
+        while self.__sent and now - self.__sent[0] >= 1:
+            self.__sent.popleft()
+        if len(self.__sent) < GLOBAL_CALLS_PER_SECOND:
+            return 0
+        return 1 - (now - self.__sent[0])
+
+    def __next_call(self):
+        with self.__lock:
+            while True:
+                now = time.time()
+                if not self.__ready:
+                    self.__lock.wait()
+                    continue
+                ready, _, chat_id = self.__ready[0]
+                wait = max(ready - now, self.__global_wait(now))
+                if wait > 0:
+                    self.__lock.wait(wait)
+                    continue
+                heapq.heappop(self.__ready)
+                self.__sent.append(now)
+                call = self.__chats[chat_id][0]
+                call.started = True
+                return chat_id, call
+
+    def __done(self, chat_id, ready, retry=False):
+        with self.__lock:
+            calls = self.__chats[chat_id]
+            if not retry:
+                calls.popleft()
+            if calls:
+                heapq.heappush(self.__ready, (ready, next(self.__counter), chat_id))
+                self.__lock.notify()
+            else:
+                del self.__chats[chat_id]
+
+    def __run(self):
+        while True:
+            chat_id, call = self.__next_call()
+            call.attempts += 1
+            try:
+                result = call.fn(*call.args, **call.kwargs)
+            except RetryAfter as e:
+                LOGGER.info(f"Flood limit hit in {chat_id}, waiting for {e.retry_after}s")
+                self.__done(chat_id, time.time() + e.retry_after, retry=True)
+                continue
+            except (TimedOut, NetworkError) as e:
+                if call.attempts < MAX_ATTEMPTS and not isinstance(e, (BadRequest, Unauthorized)):
+                    LOGGER.warning(f"Retrying message to {chat_id} after {e} [{call.attempts}/{MAX_ATTEMPTS}]")
+                    self.__done(chat_id, time.time() + 2 ** call.attempts, retry=True)
+                    continue
+                call.future.set_exception(e)
+            except Exception as e:
+                call.future.set_exception(e)
+            else:
+                call.future.set_result(result)
+            self.__done(chat_id, time.time() + CHAT_GAP)
+
+message_queue = MessageQueue()
@@ -1,35 +1,62 @@
+import io
+
 from telegram.message import Message
 from telegram.update import Update
 
 from bot import LOGGER, bot
+from bot.helper.telegram_helper.message_queue import message_queue
+
+def log_error(future):
+    if future.exception() is not None:
+        LOGGER.error(str(future.exception()))
 
 def sendMessage(text: str, bot, update: Update):
+    # Waits for the queued call, as callers edit or delete the returned message
+    future = message_queue.submit(update.message.chat_id, bot.sendMessage, update.message.chat_id,
+                                  reply_to_message_id=update.message.message_id,
+                                  text=text, parse_mode='HTMl')
     try:
-        return bot.sendMessage(update.message.chat_id,
-                               reply_to_message_id=update.message.message_id,
-                               text=text, parse_mode='HTMl')
+        return future.result()
     except Exception as e:
         LOGGER.error(str(e))
 
+def sendNotice(text: str, bot, update: Update):
+    # Like sendMessage, without waiting for the message to be sent
+    future = message_queue.submit(update.message.chat_id, bot.sendMessage, update.message.chat_id,
+                                  reply_to_message_id=update.message.message_id,
+                                  text=text, parse_mode='HTMl')
+    future.add_done_callback(log_error)
+
 def editMessage(text: str, message: Message, reply_markup=None):
-    try:
-        bot.edit_message_text(chat_id=message.chat.id,
-                              message_id=message.message_id,
-                              reply_markup=reply_markup,
-                              text=text, parse_mode='HTMl',
-                              disable_web_page_preview=True)
-    except Exception as e:
-        LOGGER.error(str(e))
+    if message is None:
+        return
+    future = message_queue.submit(message.chat.id, bot.edit_message_text, chat_id=message.chat.id,
+                                  message_id=message.message_id,
+                                  reply_markup=reply_markup,
+                                  text=text, parse_mode='HTMl',
+                                  disable_web_page_preview=True)
+    future.add_done_callback(log_error)
 
 def deleteMessage(bot, message: Message):
-    try:
-        bot.delete_message(chat_id=message.chat.id,
-                           message_id=message.message_id)
-    except Exception as e:
-        LOGGER.error(str(e))
+    if message is None:
+        return
+    future = message_queue.submit(message.chat.id, bot.delete_message, chat_id=message.chat.id,
+                                  message_id=message.message_id)
+    future.add_done_callback(log_error)
 
 def send_log_file(bot, update: Update):
-    with open('log.txt', 'rb') as f:
-        bot.send_document(document=f, filename=f.name,
-                          reply_to_message_id=update.message.message_id,
-                          chat_id=update.message.chat_id)
+    def send_document():
+        with open('log.txt', 'rb') as f:
+            return bot.send_document(document=f, filename=f.name,
+                                     reply_to_message_id=update.message.message_id,
+                                     chat_id=update.message.chat_id)
+    future = message_queue.submit(update.message.chat_id, send_document)
+    future.add_done_callback(log_error)
+
+def send_file(bot, update: Update, filename: str, content: str):
+    def send_document():
+        return bot.send_document(document=io.BytesIO(content.encode()), filename=filename,
+                                 reply_to_message_id=update.message.message_id,
+                                 chat_id=update.message.chat_id)
+    future = message_queue.submit(update.message.chat_id, send_document)
+    future.add_done_callback(log_error)
@@ -0,0 +1,143 @@
+import heapq
+import itertools
+import threading
+import time
+
+from telegram.error import BadRequest
+
+from bot import LOGGER, bot, STATUS_UPDATE_INTERVAL
+from bot.helper.telegram_helper.message_queue import message_queue
+
+# Telegram allows about one message per second in a private chat and 20 per
+# minute in a group; the global limit is kept by the message queue
+PRIVATE_CHAT_GAP = 1
+GROUP_CHAT_GAP = 3
+MAX_INTERVAL = 15
+
+class _StatusJob:
+    def __init__(self, message, render, done):
+        self.message = message
+        self.render = render
+        self.done = done
+        self.interval = STATUS_UPDATE_INTERVAL
+        self.last_text = ''
+        self.removed = False
+
+    @property
+    def key(self):
+        return self.message.chat.id, self.message.message_id
+
+
+class StatusScheduler:
+    """Single thread that refreshes every live progress message.
+
+    Jobs are rendered only when they are due, so a message is always edited
+    with the newest state and intermediate states are dropped. Edits go
+    through the message queue, so they share its budget and order with the
+    other calls to the chat, and an edit still waiting there is replaced by
+    the newer one. Each job's interval grows while its text stays the same
+    and shrinks again when there is progress to show.
+    """
+
+    def __init__(self):
+        self.__jobs = {}
+        self.__heap = []
+        self.__counter = itertools.count()
+        self.__chat_ready = {}
+        self.__lock = threading.Lock()
+        self.__wakeup = threading.Event()
+        self.__thread = None
+
+    def add(self, message, render, done):
+        """Refresh message with render() until done() returns True."""
+        if message is None:
+            return
+        job = _StatusJob(message, render, done)
+        with self.__lock:
+            self.__jobs[job.key] = job
+            self.__schedule(job, time.time() + job.interval)
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__run, name="StatusScheduler", daemon=True)
+                self.__thread.start()
+        self.__wakeup.set()
+
+    def remove(self, message):
+        if message is None:
+            return
+        with self.__lock:
+            job = self.__jobs.pop((message.chat.id, message.message_id), None)
+            if job is not None:
+                job.removed = True
+
+    def __schedule(self, job, due):
+        heapq.heappush(self.__heap, (due, next(self.__counter), job))
+
+    def __next_job(self):
+        with self.__lock:
+            while self.__heap:
+                due, _, job = self.__heap[0]
+                if self.__jobs.get(job.key) is not job:
+                    heapq.heappop(self.__heap)
+                    continue
+                now = time.time()
+                if due > now:
+                    return None, due - now
+                heapq.heappop(self.__heap)
+                wait = self.__chat_ready.get(job.message.chat.id, 0) - now
+                if wait > 0:
+                    self.__schedule(job, now + wait)
+                    continue
+                return job, 0
+            return None, None
+
+    def __run(self):
+        while True:
+            job, wait = self.__next_job()
+            if job is None:
+                self.__wakeup.wait(wait)
+                self.__wakeup.clear()
+                continue
+            try:
+                if job.done():
+                    self.remove(job.message)
+                    continue
+                self.__refresh(job)
+            except Exception as e:
+                LOGGER.error(f"Status update failed: {e}")
+            with self.__lock:
+                if self.__jobs.get(job.key) is job:
+                    self.__schedule(job, time.time() + job.interval)
+
+    def __edited(self, job, future):
+        error = future.exception()
+        if error is None or (isinstance(error, BadRequest) and "not modified" in str(error).lower()):
+            return
+        # Message to edit not found or no longer editable
+        LOGGER.error(f"Status update failed: {error}")
+        self.remove(job.message)
+
+    def __edit(self, job, text):
+        # Runs when the queue gets to the edit, which may be after the message was deleted on completion;
+        # the delete is queued behind an edit already running, so skipping the ones not started is enough
+        with self.__lock:
+            if job.removed:
+                return None
+        chat_id = job.message.chat.id
+        return bot.edit_message_text(chat_id=chat_id, message_id=job.message.message_id, text=text,
+                                     parse_mode='HTMl', disable_web_page_preview=True)
+
+    def __refresh(self, job):
+        text = job.render()
+        if text == job.last_text:
+            job.interval = min(MAX_INTERVAL, job.interval * 1.5)
+            return
+        chat = job.message.chat
+        gap = PRIVATE_CHAT_GAP if chat.type == 'private' else GROUP_CHAT_GAP
+        future = message_queue.submit_latest(chat.id, ('status', job.message.message_id), self.__edit, job, text)
+        future.add_done_callback(lambda future: self.__edited(job, future))
+        with self.__lock:
+            self.__chat_ready[chat.id] = time.time() + gap
+        job.last_text = text
+        job.interval = max(STATUS_UPDATE_INTERVAL, job.interval * 0.75)
+
+status_scheduler = StatusScheduler()
@@ -0,0 +1,85 @@
+import hmac
+import json
+import signal
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from telegram import Update
+
+from bot import LOGGER, bot, dispatcher, WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, \
+    WEBHOOK_SECRET, WEBHOOK_WORKERS
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if self.path.rstrip('/') != f'/{WEBHOOK_PATH}':
+            return self.__reply(404)
+        if WEBHOOK_SECRET is not None:
+            token = self.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+            if not hmac.compare_digest(token, WEBHOOK_SECRET):
+                LOGGER.warning(f"Rejected webhook call from {self.client_address[0]}")
+                return self.__reply(403)
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            update = Update.de_json(json.loads(self.rfile.read(length)), bot)
+        except (ValueError, TypeError) as e:
+            LOGGER.error(f"Invalid webhook update: {e}")
+            return self.__reply(400)
+        dispatcher.update_queue.put(update)
+        self.__reply(200)
+
+    def __reply(self, status):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        LOGGER.debug(f"Webhook: {format % args}")
+
+
+class WebhookServer(HTTPServer):
+    """HTTP listener for Telegram updates that serves requests on a fixed size pool."""
+
+    def __init__(self, address, workers=WEBHOOK_WORKERS):
+        super().__init__(address, WebhookHandler)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='Webhook')
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self.__process, request, client_address)
+
+    def __process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False)
+
+
+def start_webhook():
+    server = WebhookServer((WEBHOOK_LISTEN, WEBHOOK_PORT))
+    threading.Thread(target=dispatcher.start, name="Dispatcher", daemon=True).start()
+    threading.Thread(target=server.serve_forever, name="WebhookServer", daemon=True).start()
+    LOGGER.info(f"Listening for updates on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}")
+    if WEBHOOK_URL is not None:
+        bot.set_webhook(url=f'{WEBHOOK_URL}/{WEBHOOK_PATH}', secret_token=WEBHOOK_SECRET,
+                        max_connections=WEBHOOK_WORKERS)
+        LOGGER.info(f"Webhook set to {WEBHOOK_URL}/{WEBHOOK_PATH}")
+    return server
+
+def idle(server):
+    """Block until SIGINT/SIGTERM, then stop the listener and the dispatcher."""
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda signum, frame: stop.set())
+    while not stop.is_set():
+        stop.wait(1)
+    LOGGER.info("Stopping webhook")
+    server.shutdown()
+    server.server_close()
+    dispatcher.stop()
@@ -1,11 +1,13 @@
 from telegram.ext import CommandHandler
 
-from bot import AUTHORIZED_CHATS, DATABASE_URL, dispatcher
+from bot import AUTHORIZED_CHATS, dispatcher
+from bot.helper.ext_utils.metrics import track_command
 from bot.helper.telegram_helper.bot_commands import BotCommands
 from bot.helper.telegram_helper.filters import CustomFilters
 from bot.helper.telegram_helper.message_utils import sendMessage
-from bot.helper.ext_utils.database import DatabaseHelper
+from bot.helper.ext_utils.database import auth_store
 
+@track_command(BotCommands.AuthorizeCommand)
 def authorize(update, context):
     reply_message = None
     message_ = None
@@ -13,48 +15,16 @@ def authorize(update, context):
     message_ = update.message.text.split(' ')
     if len(message_) == 2:
         # Trying to authorize an user in private
-        user_id = int(message_[1])
-        if user_id in AUTHORIZED_CHATS:
-            msg = 'Already authorized'
-        elif DATABASE_URL is not None:
-            db = DatabaseHelper()
-            msg = db.auth_user(user_id)
-            AUTHORIZED_CHATS.add(user_id)
-        else:
-            AUTHORIZED_CHATS.add(user_id)
-            with open('authorized_chats.txt', 'a') as file:
-                file.write(f'{user_id}\n')
-                msg = 'Authorization granted'
+        msg = auth_store.authorize(int(message_[1]))
     elif reply_message is None:
         # Trying to authorize a chat
-        chat_id = update.effective_chat.id
-        if chat_id in AUTHORIZED_CHATS:
-            msg = 'Already authorized'
-        elif DATABASE_URL is not None:
-            db = DatabaseHelper()
-            msg = db.auth_user(chat_id)
-            AUTHORIZED_CHATS.add(chat_id)
-        else:
-            AUTHORIZED_CHATS.add(chat_id)
-            with open('authorized_chats.txt', 'a') as file:
-                file.write(f'{chat_id}\n')
-                msg = 'Authorization granted'
+        msg = auth_store.authorize(update.effective_chat.id)
     else:
         # Trying to authorize an user by replying
-        user_id = reply_message.from_user.id
-        if user_id in AUTHORIZED_CHATS:
-            msg = 'Already authorized'
-        elif DATABASE_URL is not None:
-            db = DatabaseHelper()
-            msg = db.auth_user(user_id)
-            AUTHORIZED_CHATS.add(user_id)
-        else:
-            AUTHORIZED_CHATS.add(user_id)
-            with open('authorized_chats.txt', 'a') as file:
-                file.write(f'{user_id}\n')
-                msg = 'Authorization granted'
+        msg = auth_store.authorize(reply_message.from_user.id)
     sendMessage(msg, context.bot, update)
 
+@track_command(BotCommands.UnauthorizeCommand)
 def unauthorize(update, context):
     reply_message = None
     message_ = None
@@ -62,47 +32,16 @@ def unauthorize(update, context):
     message_ = update.message.text.split(' ')
     if len(message_) == 2:
         # Trying to unauthorize an user in private
-        user_id = int(message_[1])
-        if user_id in AUTHORIZED_CHATS:
-            if DATABASE_URL is not None:
-                db = DatabaseHelper()
-                msg = db.unauth_user(user_id)
-            else:
-                msg = 'Authorization revoked'
-            AUTHORIZED_CHATS.remove(user_id)
-        else:
-            msg = 'Already unauthorized'
+        msg = auth_store.unauthorize(int(message_[1]))
     elif reply_message is None:
         # Trying to unauthorize a chat
-        chat_id = update.effective_chat.id
-        if chat_id in AUTHORIZED_CHATS:
-            if DATABASE_URL is not None:
-                db = DatabaseHelper()
-                msg = db.unauth_user(chat_id)
-            else:
-                msg = 'Authorization revoked'
-            AUTHORIZED_CHATS.remove(chat_id)
-        else:
-            msg = 'Already unauthorized'
+        msg = auth_store.unauthorize(update.effective_chat.id)
     else:
         # Trying to unauthorize an user by replying
-        user_id = reply_message.from_user.id
-        if user_id in AUTHORIZED_CHATS:
-            if DATABASE_URL is not None:
-                db = DatabaseHelper()
-                msg = db.unauth_user(user_id)
-            else:
-                msg = 'Authorization revoked'
-            AUTHORIZED_CHATS.remove(user_id)
-        else:
-            msg = 'Already unauthorized'
-    if DATABASE_URL is None:
-        with open('authorized_chats.txt', 'a') as file:
-            file.truncate(0)
-            for i in AUTHORIZED_CHATS:
-                file.write(f'{i}\n')
+        msg = auth_store.unauthorize(reply_message.from_user.id)
     sendMessage(msg, context.bot, update)
 
+@track_command(BotCommands.UsersCommand)
 def auth_chats(update, context):
     users = ''
     for user in AUTHORIZED_CHATS:
@@ -1,42 +1,82 @@
-import time
-
 from telegram.ext import CommandHandler
 
-from bot import LOGGER, dispatcher
-from bot.helper.drive_utils.gdriveTools import GoogleDriveHelper
-from bot.helper.ext_utils.bot_utils import new_thread, is_gdrive_link, is_appdrive_link, is_gdtot_link, is_sharer_link
+from bot import LOGGER, OWNER_ID, dispatcher
+from bot.helper.drive_utils import drive_helper
+from bot.helper.ext_utils.metrics import track_command
+from bot.helper.ext_utils.bot_utils import new_thread, get_links, split_message, is_gdrive_link, is_ddl_link, \
+    is_appdrive_link, is_gdtot_link, is_sharer_link
+from bot.helper.ext_utils.executor import drive_pool, resolve_pool
 from bot.helper.ext_utils.clone_status import CloneStatus
 from bot.helper.ext_utils.exceptions import DDLException
+from bot.helper.ext_utils.link_cache import link_cache
 from bot.helper.ext_utils.parser import appdrive, gdtot, sharer
-from bot.helper.telegram_helper.message_utils import sendMessage, editMessage, deleteMessage
+from bot.helper.telegram_helper.message_utils import sendMessage, deleteMessage
+from bot.helper.telegram_helper.status_scheduler import status_scheduler
 from bot.helper.telegram_helper.bot_commands import BotCommands
 from bot.helper.telegram_helper.filters import CustomFilters
 
+def resolveLink(link):
+    """Return the Drive link behind link and whether it is a temporary copy to delete after cloning."""
+    LOGGER.info(f"Processing: {link}")
+    if is_appdrive_link(link):
+        appdict = appdrive(link)
+        return appdict.get('gdrive_link'), appdict.get('link_type') == 'login'
+    if is_gdtot_link(link):
+        return gdtot(link), True
+    if is_sharer_link(link):
+        return sharer(link), True
+    return link, False
+
+def getCachedResult(link):
+    if not is_ddl_link(link):
+        return None
+    cached = link_cache.get(link)
+    if cached is not None:
+        if drive_helper().checkExists(cached['dest_id']):
+            LOGGER.info(f"Cached: {link}")
+            return cached['result']
+        link_cache.remove(link)
+    return None
+
+def cloneLink(ddl_link, link, temporary, status, repair=False):
+    LOGGER.info(f"Cloning: {link}")
+    gd = drive_helper()
+    result = gd.clone(link, status, repair)
+    status.set_status(True)
+    if ddl_link is not None and gd.dest_id is not None:
+        # A temporary copy is deleted below, so only a lasting source is worth remembering
+        source_id = None if temporary else gd.getIdFromUrl(link)
+        link_cache.set(ddl_link, source_id, gd.dest_id, result)
+    if temporary:
+        LOGGER.info(f"Deleting: {link}")
+        gd.deleteFile(link)
+    return result
+
 @new_thread
+@track_command(BotCommands.CloneCommand)
 def cloneNode(update, context):
     LOGGER.info('User: {} [{}]'.format(update.message.from_user.first_name, update.message.from_user.id))
     args = update.message.text.split(" ", maxsplit=1)
     reply_to = update.message.reply_to_message
-    link = ''
+    text = ''
     if len(args) > 1:
-        link = args[1]
+        text = args[1]
     if reply_to is not None:
-        if len(link) == 0:
-            link = reply_to.text
-    is_appdrive = is_appdrive_link(link)
-    is_gdtot = is_gdtot_link(link)
-    is_sharer = is_sharer_link(link)
-    if (is_appdrive or is_gdtot or is_sharer):
+        if len(text) == 0:
+            text = reply_to.text
+    links = get_links(text)
+    if len(links) > 1:
+        return cloneLinks(links, update, context)
+    link = links[0] if links else text
+    ddl_link = link if is_ddl_link(link) else None
+    temporary = False
+    if ddl_link is not None:
+        cached = getCachedResult(ddl_link)
+        if cached is not None:
+            return sendMessage(cached, context.bot, update)
         try:
             msg = sendMessage(f"<b>Processing:</b> <code>{link}</code>", context.bot, update)
-            LOGGER.info(f"Processing: {link}")
-            if is_appdrive:
-                appdict = appdrive(link)
-                link = appdict.get('gdrive_link')
-            if is_gdtot:
-                link = gdtot(link)
-            if is_sharer:
-                link = sharer(link)
+            link, temporary = resolveLink(link)
             deleteMessage(context.bot, msg)
         except DDLException as e:
             deleteMessage(context.bot, msg)
@@ -44,46 +84,65 @@ def cloneNode(update, context):
             return sendMessage(str(e), context.bot, update)
     if is_gdrive_link(link):
         msg = sendMessage(f"<b>Cloning:</b> <code>{link}</code>", context.bot, update)
-        LOGGER.info(f"Cloning: {link}")
         status_class = CloneStatus()
-        gd = GoogleDriveHelper()
-        sendCloneStatus(link, msg, status_class, update, context)
-        result = gd.clone(link, status_class)
+        status_scheduler.add(msg, lambda: getCloneStatus(status_class), status_class.done)
+        result = cloneLink(ddl_link, link, temporary, status_class,
+                           update.message.from_user.id == OWNER_ID)
+        status_scheduler.remove(msg)
         deleteMessage(context.bot, msg)
-        status_class.set_status(True)
         sendMessage(result, context.bot, update)
-        if is_gdtot:
-            LOGGER.info(f"Deleting: {link}")
-            gd.deleteFile(link)
-        elif is_appdrive:
-            if apdict.get('link_type') == 'login':
-                LOGGER.info(f"Deleting: {link}")
-                gd.deleteFile(link)
-        if is_sharer:
-            LOGGER.info(f"Deleting: {link}")
-            gd.deleteFile(link)
     else:
         sendMessage("<b>Send a Drive / AppDrive / DriveApp / GDToT / Sharer link along with command</b>", context.bot, update)
         LOGGER.info("Cloning: None")
 
-@new_thread
-def sendCloneStatus(link, msg, status, update, context):
-    old_statmsg = ''
-    while not status.done():
-        time.sleep(3)
+def cloneLinks(links, update, context):
+    msg = sendMessage(f"<b>Cloning:</b> <code>{len(links)} links</code>", context.bot, update)
+    LOGGER.info(f"Cloning: {len(links)} links")
+    # Only the owner may have VERIFY_CLONE=fix trash copies in the destination
+    repair = update.message.from_user.id == OWNER_ID
+
+    def resolve(link):
+        cached = getCachedResult(link)
+        if cached is not None:
+            return cached, None, False
+        if not is_ddl_link(link):
+            return None, link, False
         try:
-            statmsg = f"<b>Cloning:</b> <a href='{status.source_folder_link}'>{status.source_folder_name}</a>\n━━━━━━━━━━━━━━" \
-                      f"\n<b>Current file:</b> <code>{status.get_name()}</code>\n\n<b>Transferred</b>: <code>{status.get_size()}</code>"
-            if not statmsg == old_statmsg:
-                editMessage(statmsg, msg)
-                old_statmsg = statmsg
+            drive_link, temporary = resolveLink(link)
+            return None, drive_link, temporary
+        except DDLException as e:
+            LOGGER.error(e)
+            return str(e), None, False
+        except Exception as e:
+            LOGGER.exception(e)
+            return f"Failed to process the link: {e}", None, False
+
+    # Resolve the DDL links BATCH_WORKERS at a time, then clone through the bounded Drive pool
+    results = [None] * len(links)
+    jobs = {}
+    for index, (result, drive_link, temporary) in enumerate(resolve_pool.map(resolve, links)):
+        if result is not None:
+            results[index] = result
+        elif not is_gdrive_link(drive_link):
+            results[index] = "No Drive link found"
+        else:
+            ddl_link = links[index] if is_ddl_link(links[index]) else None
+            jobs[index] = drive_pool.submit(cloneLink, ddl_link, drive_link, temporary, CloneStatus(), repair)
+    for index, job in jobs.items():
+        try:
+            results[index] = job.result()
         except Exception as e:
-            if str(e) == "Message to edit not found":
-                break
-            time.sleep(2)
-            continue
-    return
+            LOGGER.exception(e)
+            results[index] = str(e)
+    deleteMessage(context.bot, msg)
+    summary = '\n\n'.join(f"<b>{index + 1}.</b> {result}" for index, result in enumerate(results))
+    for chunk in split_message(summary):
+        sendMessage(chunk, context.bot, update)
+
+def getCloneStatus(status):
+    return f"<b>Cloning:</b> <a href='{status.source_folder_link}'>{status.source_folder_name}</a>\n━━━━━━━━━━━━━━" \
+           f"\n<b>Current file:</b> <code>{status.get_name()}</code>\n\n<b>Transferred</b>: <code>{status.get_size()}</code>"
 
 clone_handler = CommandHandler(BotCommands.CloneCommand, cloneNode,
-                               filters=CustomFilters.authorized_chat | CustomFilters.authorized_user, run_async=True)
+                               filters=CustomFilters.authorized_chat | CustomFilters.authorized_user)
 dispatcher.add_handler(clone_handler)
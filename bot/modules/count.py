@@ -1,27 +1,34 @@
 from telegram.ext import CommandHandler
 
 from bot import LOGGER, dispatcher
-from bot.helper.drive_utils.gdriveTools import GoogleDriveHelper
-from bot.helper.ext_utils.bot_utils import new_thread, is_gdrive_link
+from bot.helper.drive_utils import drive_helper
+from bot.helper.ext_utils.metrics import track_command
+from bot.helper.ext_utils.bot_utils import new_thread, get_links, split_message, is_gdrive_link
+from bot.helper.ext_utils.executor import drive_pool
 from bot.helper.telegram_helper.message_utils import sendMessage, deleteMessage
 from bot.helper.telegram_helper.bot_commands import BotCommands
 from bot.helper.telegram_helper.filters import CustomFilters
 
 @new_thread
+@track_command(BotCommands.CountCommand)
 def countNode(update, context):
     LOGGER.info('User: {} [{}]'.format(update.message.from_user.first_name, update.message.from_user.id))
     args = update.message.text.split(" ", maxsplit=1)
     reply_to = update.message.reply_to_message
-    link = ''
+    text = ''
     if len(args) > 1:
-        link = args[1]
+        text = args[1]
     if reply_to is not None:
-        if len(link) == 0:
-            link = reply_to.text
+        if len(text) == 0:
+            text = reply_to.text
+    links = get_links(text, is_gdrive_link)
+    if len(links) > 1:
+        return countLinks(links, update, context)
+    link = links[0] if links else text
     if is_gdrive_link(link):
         msg = sendMessage(f"<b>Counting:</b> <code>{link}</code>", context.bot, update)
         LOGGER.info(f"Counting: {link}")
-        gd = GoogleDriveHelper()
+        gd = drive_helper()
         result = gd.count(link)
         deleteMessage(context.bot, msg)
         sendMessage(result, context.bot, update)
@@ -29,6 +36,26 @@ def countNode(update, context):
         sendMessage("Send a drive link along with command", context.bot, update)
         LOGGER.info("Counting: None")
 
+def countLink(link):
+    LOGGER.info(f"Counting: {link}")
+    return drive_helper().count(link)
+
+def countLinks(links, update, context):
+    msg = sendMessage(f"<b>Counting:</b> <code>{len(links)} links</code>", context.bot, update)
+    LOGGER.info(f"Counting: {len(links)} links")
+    jobs = [drive_pool.submit(countLink, link) for link in links]
+    results = []
+    for job in jobs:
+        try:
+            results.append(job.result())
+        except Exception as e:
+            LOGGER.exception(e)
+            results.append(str(e))
+    deleteMessage(context.bot, msg)
+    summary = '\n\n'.join(f"<b>{index + 1}.</b> {result}" for index, result in enumerate(results))
+    for chunk in split_message(summary):
+        sendMessage(chunk, context.bot, update)
+
 count_handler = CommandHandler(BotCommands.CountCommand, countNode,
-                               filters=CustomFilters.authorized_chat | CustomFilters.authorized_user, run_async=True)
+                               filters=CustomFilters.authorized_chat | CustomFilters.authorized_user)
 dispatcher.add_handler(count_handler)
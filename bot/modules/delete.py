@@ -1,13 +1,15 @@
 from telegram.ext import CommandHandler
 
 from bot import LOGGER, dispatcher
-from bot.helper.drive_utils.gdriveTools import GoogleDriveHelper
+from bot.helper.drive_utils import drive_helper
+from bot.helper.ext_utils.metrics import track_command
 from bot.helper.ext_utils.bot_utils import new_thread, is_gdrive_link
 from bot.helper.telegram_helper.message_utils import sendMessage, deleteMessage
 from bot.helper.telegram_helper.bot_commands import BotCommands
 from bot.helper.telegram_helper.filters import CustomFilters
 
 @new_thread
+@track_command(BotCommands.DeleteCommand)
 def deleteNode(update, context):
     LOGGER.info('User: {} [{}]'.format(update.message.from_user.first_name, update.message.from_user.id))
     args = update.message.text.split(" ", maxsplit=1)
@@ -21,7 +23,7 @@ def deleteNode(update, context):
     if is_gdrive_link(link):
         msg = sendMessage(f"<b>Deleting:</b> <code>{link}</code>", context.bot, update)
         LOGGER.info(f"Deleting: {link}")
-        gd = GoogleDriveHelper()
+        gd = drive_helper()
         result = gd.deleteFile(link)
         deleteMessage(context.bot, msg)
         sendMessage(result, context.bot, update)
@@ -30,5 +32,5 @@ def deleteNode(update, context):
         LOGGER.info("Deleting: None")
 
 delete_handler = CommandHandler(BotCommands.DeleteCommand, deleteNode,
-                                filters=CustomFilters.owner_filter, run_async=True)
+                                filters=CustomFilters.owner_filter)
 dispatcher.add_handler(delete_handler)
@@ -0,0 +1,44 @@
+from telegram.ext import CommandHandler
+
+from bot import LOGGER, DRIVE_ID, DRIVE_NAME, dispatcher
+from bot.helper.drive_utils import drive_helper
+from bot.helper.ext_utils.metrics import track_command
+from bot.helper.ext_utils.bot_utils import new_thread, get_readable_file_size
+from bot.helper.telegram_helper.message_utils import sendMessage, deleteMessage, send_file
+from bot.helper.telegram_helper.bot_commands import BotCommands
+from bot.helper.telegram_helper.filters import CustomFilters
+
+@new_thread
+@track_command(BotCommands.DupesCommand)
+def dupesNode(update, context):
+    from bot.helper.drive_utils.dupes_index import dupes_index
+    if len(DRIVE_ID) == 0:
+        return sendMessage("Add drives to drive_list first", context.bot, update)
+    args = update.message.text.split()[1:]
+    rebuild = '-r' in args
+    msg = sendMessage(f"<b>Indexing:</b> <code>{len(DRIVE_ID)} drives</code>", context.bot, update)
+    LOGGER.info(f"Finding duplicates in {len(DRIVE_ID)} drives")
+    try:
+        if rebuild:
+            errors = dupes_index.build(drive_helper(), DRIVE_ID, reuse=lambda drive_id: False)
+        else:
+            errors = dupes_index.build(drive_helper(), DRIVE_ID)
+    except Exception as e:
+        LOGGER.exception(e)
+        deleteMessage(context.bot, msg)
+        return sendMessage(str(e).replace('>', '').replace('<', ''), context.bot, update)
+    names = dict(zip(DRIVE_ID, DRIVE_NAME))
+    dupes = dupes_index.duplicates(DRIVE_ID)
+    deleteMessage(context.bot, msg)
+    result = f"<b>Duplicate groups: </b>{len(dupes)}"
+    result += f"\n<b>Duplicate files: </b>{sum(len(files) - 1 for _, _, files in dupes)}"
+    result += f"\n<b>Reclaimable: </b>{get_readable_file_size(sum(size * (len(files) - 1) for _, size, files in dupes))}"
+    if errors:
+        result += f"\n\n<b>Not indexed: </b>{', '.join(names.get(drive_id, drive_id) for drive_id in errors)}"
+    sendMessage(result, context.bot, update)
+    if dupes:
+        send_file(context.bot, update, 'dupes.txt', dupes_index.report(dupes, names))
+
+dupes_handler = CommandHandler(BotCommands.DupesCommand, dupesNode,
+                               filters=CustomFilters.owner_filter)
+dispatcher.add_handler(dupes_handler)
@@ -1,11 +1,15 @@
 from telegram.ext import CommandHandler
 
 from bot import LOGGER, dispatcher
-from bot.helper.drive_utils.gdriveTools import GoogleDriveHelper
+from bot.helper.drive_utils import drive_helper
+from bot.helper.ext_utils.bot_utils import new_thread
+from bot.helper.ext_utils.metrics import track_command
 from bot.helper.telegram_helper.bot_commands import BotCommands
 from bot.helper.telegram_helper.filters import CustomFilters
 from bot.helper.telegram_helper.message_utils import sendMessage, editMessage
 
+@new_thread
+@track_command(BotCommands.ListCommand)
 def list_drive(update, context):
     LOGGER.info('User: {} [{}]'.format(update.message.from_user.first_name, update.message.from_user.id))
     try:
@@ -14,16 +18,27 @@ def list_drive(update, context):
         sendMessage('Send a search query along with command', context.bot, update)
         LOGGER.info("Query: None")
         return
+    # -t may appear anywhere in the arguments
+    words = search.split()
+    show_timings = '-t' in words
+    if show_timings:
+        search = ' '.join(word for word in words if word != '-t')
+        if search == '':
+            sendMessage('Send a search query along with command', context.bot, update)
+            return
     reply = sendMessage('Searching...', context.bot, update)
     LOGGER.info(f"Query: {search}")
-    google_drive = GoogleDriveHelper(None)
+    google_drive = drive_helper(None)
     try:
         msg, button = google_drive.drive_list(search)
     except Exception as e:
         msg, button = "There was an error", None
         LOGGER.exception(e)
+    if show_timings and google_drive.search_timings:
+        msg += '\n\n<b>Timings:</b> ' + ' | '.join(f'{phase}: {seconds}s'
+                                                  for phase, seconds in google_drive.search_timings.items())
     editMessage(msg, reply, button)
 
 list_handler = CommandHandler(BotCommands.ListCommand, list_drive,
-                              filters=CustomFilters.authorized_chat | CustomFilters.authorized_user, run_async=True)
+                              filters=CustomFilters.authorized_chat | CustomFilters.authorized_user)
 dispatcher.add_handler(list_handler)
@@ -1,28 +1,34 @@
 from telegram.ext import CommandHandler
 
 from bot import LOGGER, dispatcher
-from bot.helper.drive_utils.gdriveTools import GoogleDriveHelper
+from bot.helper.drive_utils import drive_helper
+from bot.helper.ext_utils.metrics import track_command
 from bot.helper.ext_utils.bot_utils import new_thread, is_gdrive_link
 from bot.helper.telegram_helper.message_utils import sendMessage, deleteMessage
 from bot.helper.telegram_helper.bot_commands import BotCommands
 from bot.helper.telegram_helper.filters import CustomFilters
 
 @new_thread
+@track_command(BotCommands.PermissionCommand)
 def permissionNode(update, context):
     LOGGER.info('User: {} [{}]'.format(update.message.from_user.first_name, update.message.from_user.id))
     args = update.message.text.split(" ", maxsplit=1)
     reply_to = update.message.reply_to_message
     link = ''
+    recursive = False
     if len(args) > 1:
         link = args[1]
+        if link == '-r' or link.startswith('-r '):
+            recursive = True
+            link = link[2:].strip()
     if reply_to is not None:
         if len(link) == 0:
             link = reply_to.text
     if is_gdrive_link(link):
         msg = sendMessage(f"<b>Setting permission:</b> <code>{link}</code>", context.bot, update)
         LOGGER.info(f"Setting permission: {link}")
-        gd = GoogleDriveHelper()
-        result = gd.setPerm(link)
+        gd = drive_helper()
+        result = gd.setPerm(link, recursive)
         deleteMessage(context.bot, msg)
         sendMessage(result, context.bot, update)
     else:
@@ -30,5 +36,5 @@ def permissionNode(update, context):
         LOGGER.info("Setting permission: None")
 
 permission_handler = CommandHandler(BotCommands.PermissionCommand, permissionNode,
-                                filters=CustomFilters.owner_filter, run_async=True)
+                                filters=CustomFilters.owner_filter)
 dispatcher.add_handler(permission_handler)
@@ -0,0 +1,37 @@
+from telegram.ext import CommandHandler
+
+from bot import LOGGER, dispatcher
+from bot.helper.ext_utils.profiler import command_profiler
+from bot.helper.telegram_helper.bot_commands import BotCommands
+from bot.helper.telegram_helper.filters import CustomFilters
+from bot.helper.telegram_helper.message_utils import sendMessage, send_file
+
+def profile(update, context):
+    args = update.message.text.split()[1:]
+    if len(args) == 0:
+        if command_profiler.remaining > 0:
+            target = f"/{command_profiler.command}" if command_profiler.command else "command"
+            msg = f"Profiling the next {command_profiler.remaining} {target} run(s)"
+        else:
+            msg = f"Send /{BotCommands.ProfileCommand} [count] or /{BotCommands.ProfileCommand} [command] [count]"
+        return sendMessage(msg, context.bot, update)
+    if args[0].lower() == 'off':
+        command_profiler.disarm()
+        return sendMessage("Profiling disabled", context.bot, update)
+    command = None
+    if not args[0].isdigit():
+        command = args.pop(0).lstrip('/').lower()
+    try:
+        count = int(args[0]) if args else 1
+        if count <= 0:
+            raise ValueError
+    except ValueError:
+        return sendMessage("Count must be a positive number", context.bot, update)
+    command_profiler.arm(count, command, lambda filename, text: send_file(context.bot, update, filename, text))
+    LOGGER.info(f"Profiling the next {count} {command or 'command'} run(s)")
+    target = f"/{command}" if command else "command"
+    sendMessage(f"Profiling the next {count} {target} run(s), reports will be sent here", context.bot, update)
+
+profile_handler = CommandHandler(BotCommands.ProfileCommand, profile,
+                                 filters=CustomFilters.owner_filter, run_async=True)
+dispatcher.add_handler(profile_handler)
@@ -3,10 +3,12 @@ import subprocess
 from telegram.ext import CommandHandler
 
 from bot import LOGGER, dispatcher
+from bot.helper.ext_utils.metrics import track_command
 from bot.helper.telegram_helper.bot_commands import BotCommands
 from bot.helper.telegram_helper.filters import CustomFilters
 from bot.helper.telegram_helper.message_utils import sendMessage
 
+@track_command(BotCommands.ShellCommand)
 def shell(update, context):
     LOGGER.info('User: {} [{}]'.format(update.message.from_user.first_name, update.message.from_user.id))
     message = update.effective_message
@@ -0,0 +1,35 @@
+from telegram.ext import CommandHandler
+
+from bot import LOGGER, OWNER_ID, dispatcher
+from bot.helper.drive_utils import drive_helper
+from bot.helper.ext_utils.metrics import track_command
+from bot.helper.ext_utils.bot_utils import new_thread, get_links, split_message, is_gdrive_link
+from bot.helper.telegram_helper.message_utils import sendMessage, deleteMessage
+from bot.helper.telegram_helper.bot_commands import BotCommands
+from bot.helper.telegram_helper.filters import CustomFilters
+
+@new_thread
+@track_command(BotCommands.VerifyCommand)
+def verifyNode(update, context):
+    LOGGER.info('User: {} [{}]'.format(update.message.from_user.first_name, update.message.from_user.id))
+    args = update.message.text.split(" ", maxsplit=1)
+    text = args[1] if len(args) > 1 else ''
+    fix = text == '-f' or text.startswith('-f ')
+    if fix:
+        text = text[2:]
+        if update.message.from_user.id != OWNER_ID:
+            return sendMessage("Only the owner can re-copy with -f", context.bot, update)
+    links = get_links(text, is_gdrive_link)
+    if len(links) != 2:
+        return sendMessage("Send the source and destination drive links along with command, "
+                           "add -f to re-copy what differs", context.bot, update)
+    msg = sendMessage(f"<b>Verifying:</b> <code>{links[0]}</code>", context.bot, update)
+    LOGGER.info(f"Verifying: {links[0]} against {links[1]}")
+    result = drive_helper().verify(links[0], links[1], fix)
+    deleteMessage(context.bot, msg)
+    for chunk in split_message(result):
+        sendMessage(chunk, context.bot, update)
+
+verify_handler = CommandHandler(BotCommands.VerifyCommand, verifyNode,
+                                filters=CustomFilters.authorized_chat | CustomFilters.authorized_user)
+dispatcher.add_handler(verify_handler)
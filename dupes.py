@@ -0,0 +1,40 @@
+"""Report duplicate files across the drives in drive_list without going through Telegram.
+
+Uses the bot's config.env, token.json and drive_list, and shares its index
+file with /dupes. It is safe to run while the bot runs, the file is replaced
+atomically, but whichever of the two saves last keeps its copy of the index.
+
+    python3 dupes.py [--reuse] [--min-size BYTES] [--output dupes.txt]
+"""
+
+import argparse
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--reuse', action='store_true',
+                        help='report from the existing index of a drive instead of listing it again')
+    parser.add_argument('--min-size', type=int, default=1, help='ignore files smaller than this many bytes')
+    parser.add_argument('--output', help='write the report to this file instead of printing it')
+    args = parser.parse_args()
+
+    from bot import DRIVE_ID, DRIVE_NAME
+    from bot.helper.drive_utils.dupes_index import dupes_index
+    from bot.helper.drive_utils.gdriveTools import GoogleDriveHelper
+
+    if len(DRIVE_ID) == 0:
+        print("ERROR: No drives in drive_list")
+        exit(1)
+    errors = dupes_index.build(GoogleDriveHelper(), DRIVE_ID, reuse=lambda drive_id: args.reuse)
+    names = dict(zip(DRIVE_ID, DRIVE_NAME))
+    for drive_id, error in errors.items():
+        print(f"ERROR: Failed to list {names.get(drive_id, drive_id)}: {error}")
+    report = dupes_index.report(dupes_index.duplicates(DRIVE_ID, args.min_size), names)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report)
+        print(f"Wrote {args.output}")
+    else:
+        print(report, end='')
+
+if __name__ == '__main__':
+    main()